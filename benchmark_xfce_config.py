@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Benchmark de XFCEConfigManager sobre árboles xfce4 sintéticos
+Mide guardar, backup, restaurar, reemplazar y verificar con HOME y
+directorio de trabajo temporales, y compara contra un resultado anterior
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+from datetime import datetime
+from pathlib import Path
+
+import xfce_config_manager as xcm
+
+REPO_DIR = Path(__file__).resolve().parent
+SAMPLE_CONFIG = REPO_DIR / "Configuraciones" / "xfce4"
+
+PROPERTY_TYPES = ("int", "uint", "bool", "double", "string")
+
+
+def channel_xml(name, properties, rng):
+    """XML de un canal xfconf con propiedades agrupadas como las reales"""
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', "",
+             f'<channel name="{name}" version="1.0">']
+    for group in range(max(1, properties // 10)):
+        lines.append(f'  <property name="group-{group}" type="empty">')
+        for i in range(min(10, properties - group * 10)):
+            ptype = rng.choice(PROPERTY_TYPES)
+            value = {"int": rng.randint(-100, 100), "uint": rng.randint(0, 1000),
+                     "bool": rng.choice(("true", "false")), "double": round(rng.random(), 6),
+                     "string": f"valor-{rng.randint(0, 10 ** 6)}"}[ptype]
+            lines.append(f'    <property name="prop-{i}" type="{ptype}" value="{value}"/>')
+        lines.append('  </property>')
+    lines.append('</channel>')
+    return "\n".join(lines) + "\n"
+
+
+def generate_tree(root, files, size, depth, channels=20, properties=60, seed=0):
+    """Genera un árbol xfce4 sintético en root
+
+    Parte de Configuraciones/xfce4 (canales y archivos reales), agrega
+    channels canales xfconf generados y files archivos de alrededor de size
+    bytes repartidos en directorios de depth niveles. Devuelve los bytes totales.
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    if SAMPLE_CONFIG.exists():
+        shutil.copytree(SAMPLE_CONFIG, root)
+    channel_dir = root / xcm.CHANNEL_DIR
+    channel_dir.mkdir(parents=True, exist_ok=True)
+
+    for n in range(channels):
+        (channel_dir / f"bench-{n}.xml").write_text(channel_xml(f"bench-{n}", properties, rng))
+
+    fanout = 8
+    for i in range(files):
+        parts = [f"d{(i // fanout ** level) % fanout}" for level in range(depth)]
+        directory = root.joinpath("bench", *parts)
+        directory.mkdir(parents=True, exist_ok=True)
+        file_size = max(0, int(rng.gauss(size, size / 4)))
+        (directory / f"f{i}.rc").write_bytes(rng.randbytes(file_size))
+
+    return sum(p.stat().st_size for p in root.rglob("*") if p.is_file() and not p.is_symlink())
+
+
+def wait_background():
+    """Espera a que terminen los borrados en segundo plano (fuera del tiempo medido)"""
+    for thread in list(xcm._background_removals.values()):
+        thread.join()
+
+
+def remove(path):
+    if Path(path).exists():
+        shutil.rmtree(path)
+
+
+def seed_backup(manager):
+    """Crea un backup "backup_seed" en el almacén para que el siguiente deduplique"""
+    if not manager.store.has_snapshot("backup_seed"):
+        manager.backup_dir.mkdir(exist_ok=True)
+        manager.store.create_snapshot(manager.xfce_config_path, manager.backup_dir / "backup_seed",
+                                      manager.exclude)
+
+
+def ensure_save(manager):
+    if not manager.save_manifest_path.exists():
+        manager.settings["incremental_save"] = True
+        manager.save_config_tree()
+
+
+def ensure_backup(manager, fmt="store"):
+    if not manager.list_backups():
+        manager.settings["backup_format"] = fmt
+        manager.create_backup()
+
+
+def backup_with(fmt):
+    def run(manager):
+        manager.settings["backup_format"] = fmt
+        manager.create_backup()
+    return run
+
+
+def set_incremental(manager, enabled):
+    manager.settings["incremental_save"] = enabled
+    return manager.save_config_tree()
+
+
+# Operación: (preparación sin medir, operación medida)
+OPERATIONS = {
+    "save_full": (lambda m: remove(m.current_config_dir),
+                  lambda m: set_incremental(m, False)),
+    "save_incremental": (ensure_save,
+                         lambda m: set_incremental(m, True)),
+    "backup_store": (lambda m: remove(m.backup_dir),
+                     backup_with("store")),
+    "backup_store_dedup": (lambda m: (remove(m.backup_dir), seed_backup(m)),
+                           backup_with("store")),
+    "backup_tar_gz": (lambda m: remove(m.backup_dir),
+                      backup_with("tar.gz")),
+    "restore": (lambda m: (wait_background(), ensure_backup(m)),
+                lambda m: m.restore("backup:latest", apply_live=False)),
+    "replace": (lambda m: (wait_background(), ensure_save(m)),
+                lambda m: m.replace("saved")),
+    "verify_fast": (lambda m: (ensure_save(m), ensure_backup(m)),
+                    lambda m: m.verify(deep=False)),
+    "verify_deep": (lambda m: (ensure_save(m), ensure_backup(m)),
+                    lambda m: m.verify(deep=True)),
+}
+
+
+def percentile(samples, p):
+    """Percentil por rango más cercano de una lista ordenada"""
+    return samples[max(0, min(len(samples) - 1, math.ceil(p / 100 * len(samples)) - 1))]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "samples": samples,
+        "min": samples[0],
+        "p50": percentile(samples, 50),
+        "p90": percentile(samples, 90),
+        "p99": percentile(samples, 99),
+        "mean": sum(samples) / len(samples),
+        "max": samples[-1],
+    }
+
+
+def run_benchmark(files, args):
+    """Mide todas las operaciones pedidas sobre un árbol de files archivos"""
+    work_root = Path(tempfile.mkdtemp(prefix="xfce-bench-"))
+    old_home, old_cwd = os.environ.get("HOME"), os.getcwd()
+    results = []
+    try:
+        home = work_root / "home"
+        work = work_root / "work"
+        (home / ".config").mkdir(parents=True)
+        work.mkdir()
+        total_bytes = generate_tree(home / ".config" / "xfce4", files, args.size, args.depth,
+                                    args.channels, args.properties, args.seed)
+        if SAMPLE_CONFIG.exists():
+            shutil.copytree(SAMPLE_CONFIG, work / "Configuraciones" / "xfce4")
+        os.environ["HOME"] = str(home)
+        os.chdir(work)
+
+        settings = {"copy_workers": args.workers}
+        for op in args.ops:
+            prepare, run = OPERATIONS[op]
+            samples = []
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                for rep in range(args.warmup + args.repeat):
+                    manager = xcm.XFCEConfigManager(settings)
+                    prepare(manager)
+                    start = time.perf_counter()
+                    run(manager)
+                    elapsed = time.perf_counter() - start
+                    if rep >= args.warmup:
+                        samples.append(elapsed)
+            wait_background()
+            result = {"op": op, "files": files, "bytes": total_bytes, **summarize(samples)}
+            results.append(result)
+            print(f"{op:<20} {files:>7} archivos  p50 {result['p50'] * 1000:9.2f} ms  "
+                  f"p90 {result['p90'] * 1000:9.2f} ms", file=sys.stderr)
+    finally:
+        os.chdir(old_cwd)
+        if old_home is not None:
+            os.environ["HOME"] = old_home
+        wait_background()
+        shutil.rmtree(work_root, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compara la p50 contra el baseline; devuelve las regresiones"""
+    previous = {(r["op"], r["files"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = previous.get((result["op"], result["files"]))
+        if base is None or base["p50"] <= 0:
+            continue
+        ratio = result["p50"] / base["p50"]
+        result["baseline_p50"] = base["p50"]
+        result["ratio"] = ratio
+        mark = "⚠️ " if ratio > 1 + threshold else "  "
+        print(f"{mark}{result['op']:<20} {result['files']:>7} archivos  x{ratio:.2f} "
+              f"({base['p50'] * 1000:.2f} → {result['p50'] * 1000:.2f} ms)", file=sys.stderr)
+        if ratio > 1 + threshold:
+            regressions.append(result)
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark de XFCEConfigManager sobre árboles sintéticos")
+    parser.add_argument("--files", type=int, nargs="+", default=[10, 1000],
+                        help="cantidades de archivos a probar (por ejemplo 10 1000 100000)")
+    parser.add_argument("--size", type=int, default=4096, help="tamaño medio de los archivos en bytes")
+    parser.add_argument("--depth", type=int, default=3, help="niveles de directorios")
+    parser.add_argument("--channels", type=int, default=20, help="canales xfconf sintéticos")
+    parser.add_argument("--properties", type=int, default=60, help="propiedades por canal")
+    parser.add_argument("--ops", default=",".join(OPERATIONS),
+                        help=f"operaciones separadas por coma ({', '.join(OPERATIONS)})")
+    parser.add_argument("--repeat", type=int, default=5, help="repeticiones medidas")
+    parser.add_argument("--warmup", type=int, default=1, help="repeticiones previas sin medir")
+    parser.add_argument("--workers", type=int, default=xcm.DEFAULT_SETTINGS["copy_workers"],
+                        help="hilos del motor de copia")
+    parser.add_argument("--seed", type=int, default=0, help="semilla del generador")
+    parser.add_argument("--output", help="archivo JSON de resultados (por defecto stdout)")
+    parser.add_argument("--baseline", help="resultados anteriores para comparar")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="aumento de p50 tolerado antes de marcar regresión (0.10 = 10%%)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.ops = [op.strip() for op in args.ops.split(",") if op.strip()]
+    unknown = [op for op in args.ops if op not in OPERATIONS]
+    if unknown or args.repeat < 1:
+        print(f"❌ Operaciones desconocidas: {', '.join(unknown)}" if unknown
+              else "❌ --repeat debe ser al menos 1", file=sys.stderr)
+        return 2
+
+    results = []
+    for files in args.files:
+        results.extend(run_benchmark(files, args))
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "size": args.size, "depth": args.depth, "channels": args.channels,
+            "properties": args.properties, "repeat": args.repeat, "warmup": args.warmup,
+            "workers": args.workers, "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report["regressions"] = [(r["op"], r["files"]) for r in regressions]
+
+    text = json.dumps(report, indent=1)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding='utf-8')
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+import xfce_config_manager as xcm  # noqa: E402
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """HOME falso con ~/.config/xfce4 y un directorio de trabajo con Configuraciones/"""
+    home = tmp_path / "home"
+    work = tmp_path / "work"
+    (home / ".config").mkdir(parents=True)
+    work.mkdir()
+    shutil.copytree(REPO / "Configuraciones" / "xfce4", home / ".config" / "xfce4")
+    shutil.copytree(REPO / "Configuraciones", work / "Configuraciones")
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.chdir(work)
+    yield home
+    # Los árboles viejos se borran en segundo plano: esperarlos antes de limpiar tmp_path
+    for thread in list(xcm._background_removals.values()):
+        thread.join()
+
+
+def tree_files(root):
+    """{ruta relativa: contenido} de los archivos de un árbol"""
+    return {str(p.relative_to(root)): p.read_bytes() for p in sorted(Path(root).rglob("*")) if p.is_file()}
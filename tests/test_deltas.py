@@ -0,0 +1,71 @@
+import itertools
+import re
+from datetime import datetime, timedelta
+
+import xfce_config_manager as xcm
+
+SETTINGS = {"copy_workers": 1, "channel_deltas": {"enabled": True, "max_chain": 3},
+            "retention": {"keep_last": 100}}
+
+
+def set_theme(channel, value):
+    text = re.sub(r'name="theme" type="string" value="[^"]*"',
+                  f'name="theme" type="string" value="{value}"', channel.read_text())
+    channel.write_text(text)
+
+
+def take_backups(home, count, monkeypatch):
+    channel = home / ".config" / "xfce4" / xcm.CHANNEL_DIR / "xfwm4.xml"
+    clock = itertools.count()
+
+    class FakeDatetime(datetime):
+        # Un nombre distinto por backup sin esperar un segundo entre ellos
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2026, 1, 1) + timedelta(minutes=next(clock))
+
+    versions = []
+    for i in range(count):
+        set_theme(channel, f"Tema{i}")
+        manager = xcm.XFCEConfigManager(SETTINGS)
+        with monkeypatch.context() as patch:
+            patch.setattr(xcm, "datetime", FakeDatetime)
+            name = manager.create_backup()["name"]
+        versions.append((name, channel.read_bytes()))
+    return manager, versions
+
+
+def chain_depth(objects, digest):
+    depth = 0
+    while digest in objects:
+        digest = objects[digest]["base"]
+        depth += 1
+    return depth
+
+
+def test_line_delta_round_trip():
+    old = b"".join(b"linea %d\n" % i for i in range(200))
+    new = old.replace(b"linea 50\n", b"otra\n") + b"final\n"
+    assert xcm.apply_line_delta(new, xcm.line_delta(new, old)) == old
+
+
+def test_old_versions_are_rebuilt_from_delta_chains(home, monkeypatch):
+    manager, versions = take_backups(home, 8, monkeypatch)
+
+    objects = manager.store.load_deltas(reload=True)["objects"]
+    assert objects
+    assert max(chain_depth(objects, d) for d in objects) <= 3
+
+    manager = xcm.XFCEConfigManager(SETTINGS)
+    for name, content in versions:
+        assert manager.channels_of(f"backup:{name}")["xfwm4"][1]() == content
+    assert all(r["problems"] == [] for r in manager.verify(deep=True))
+
+
+def test_deleting_every_snapshot_frees_all_objects(home, monkeypatch):
+    manager, versions = take_backups(home, 5, monkeypatch)
+    for name, _ in versions:
+        manager.delete_backup(manager.backup_dir / name)
+    store = manager.store
+    assert not [p for p in store.objects_dir.rglob("*") if p.is_file()]
+    assert not [p for p in store.deltas_dir.rglob("*") if p.is_file()]
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+import xfce_config_manager as xcm
+
+from conftest import tree_files
+
+
+@pytest.fixture(params=["combinada", "ordenada"])
+def rules(request):
+    """Compila las reglas por los dos caminos de ExcludeRules
+
+    Una regla "!" que nunca coincide obliga a evaluar en orden en vez de
+    usar la expresión regular combinada.
+    """
+    def make(*patterns):
+        if request.param == "ordenada":
+            patterns += ("!nunca-coincide",)
+        compiled = xcm.ExcludeRules(patterns)
+        assert (compiled._dir_re is None) == (request.param == "ordenada")
+        return compiled
+    return make
+
+
+def test_unanchored_pattern_matches_at_any_depth(rules):
+    r = rules("*.log")
+    assert r.excluded("a.log", False)
+    assert r.excluded("panel/sub/a.log", False)
+    assert not r.excluded("a.log.txt", False)
+
+
+def test_anchored_patterns(rules):
+    r = rules("/history", "panel/cache")
+    assert r.excluded("history", False)
+    assert not r.excluded("appfinder/history", False)
+    assert r.excluded("panel/cache", False)
+    assert not r.excluded("otro/panel/cache", False)
+
+
+def test_double_star(rules):
+    r = rules("**/tmp", "logs/**")
+    assert r.excluded("tmp", True)
+    assert r.excluded("a/b/tmp", False)
+    assert r.excluded("logs/x", False)
+    assert r.excluded("logs/a/b", False)
+    assert not r.excluded("logs", True)
+
+
+def test_directory_only_pattern(rules):
+    r = rules("cache/")
+    assert r.excluded("cache", True)
+    assert r.excluded("panel/cache", True)
+    assert not r.excluded("cache", False)
+
+
+def test_character_classes(rules):
+    r = rules("file[0-9].txt", "x[!a]")
+    assert r.excluded("file3.txt", False)
+    assert not r.excluded("fileA.txt", False)
+    assert r.excluded("xb", False)
+    assert not r.excluded("xa", False)
+
+
+def test_comments_blank_lines_and_escapes():
+    r = xcm.ExcludeRules(["# comentario", "", "   ", "\\#literal", "\\!literal"])
+    assert len(r.rules) == 2
+    assert r.excluded("#literal", False)
+    assert r.excluded("!literal", False)
+
+
+def test_negation_last_match_wins():
+    r = xcm.ExcludeRules(["*.xml", "!keep.xml", "/panel/keep.xml"])
+    assert r.excluded("a.xml", False)
+    assert not r.excluded("keep.xml", False)
+    assert not r.excluded("sub/keep.xml", False)
+    assert r.excluded("panel/keep.xml", False)
+
+
+def test_excluded_path_checks_parents(rules):
+    r = rules("cache/")
+    assert not r.excluded("cache/a", False)
+    assert r.excluded_path("cache/a", False)
+    assert r.excluded_path("x/cache/y/z", False)
+
+
+def test_scan_tree_prunes_excluded_directories(tmp_path, monkeypatch):
+    (tmp_path / "cache" / "deep").mkdir(parents=True)
+    (tmp_path / "cache" / "deep" / "f").write_text("x")
+    (tmp_path / "keep").mkdir()
+    (tmp_path / "keep" / "g").write_text("y")
+    (tmp_path / "keep" / "h.tmp").write_text("z")
+    visited = []
+    scandir = os.scandir
+
+    def tracking(path):
+        visited.append(os.path.relpath(path, tmp_path))
+        return scandir(path)
+
+    monkeypatch.setattr(xcm.os, "scandir", tracking)
+    rels = [rel for rel, _ in xcm.scan_tree(tmp_path, exclude=xcm.ExcludeRules(["cache/", "*.tmp"]))]
+
+    assert rels == ["keep", "keep/g"]
+    assert not any(v.startswith("cache") for v in visited)
+
+
+def test_default_excludes_can_be_reincluded(home):
+    profile = home.parent / "work" / "Configuraciones" / "xfce4"
+    rules = xcm.ExcludeRules.for_profile(profile)
+    assert rules.excluded_path("desktop/icons.screen0.yaml", False)
+    profile.with_name("xfce4.exclude").write_text("!/desktop/icons.screen0.yaml\n")
+    assert not xcm.ExcludeRules.for_profile(profile).excluded_path("desktop/icons.screen0.yaml", False)
+
+
+def test_restore_keeps_excluded_files_of_the_target(home):
+    live = home / ".config" / "xfce4"
+    manager = xcm.XFCEConfigManager({"exclude": ["cache/", "*.estado"]})
+    name = manager.create_backup()["name"]
+
+    (live / "cache").mkdir()
+    (live / "cache" / "datos").write_text("propio")
+    (live / "panel" / "algo.estado").write_text("estado")
+    (live / "helpers.rc").write_text("cambiado")
+    manager.restore(f"backup:{name}", apply_live=False)
+
+    assert (live / "cache" / "datos").read_text() == "propio"
+    assert (live / "panel" / "algo.estado").read_text() == "estado"
+    assert (live / "helpers.rc").read_text() != "cambiado"
+
+
+def test_preserve_excluded_prefers_the_target_version(tmp_path):
+    target, staging = tmp_path / "target", tmp_path / "staging"
+    for root, text in ((target, "del destino"), (staging, "del origen")):
+        (root / "cache").mkdir(parents=True)
+        (root / "cache" / "a").write_text(text)
+    (staging / "cache" / "solo-origen").write_text("x")
+    (target / "normal").write_text("no se copia")
+
+    count = xcm.preserve_excluded(target, staging, xcm.ExcludeRules(["cache/"]))
+
+    assert count == 1
+    assert tree_files(staging) == {"cache/a": b"del destino"}
@@ -0,0 +1,64 @@
+import os
+import shutil
+
+import pytest
+
+import xfce_config_manager as xcm
+
+from conftest import tree_files
+
+
+@pytest.fixture
+def interrupted_restore(home, monkeypatch):
+    """Backup en el store y una restauración cortada a mitad de copia"""
+    source = home / ".config" / "xfce4"
+    big = source / "big"
+    big.mkdir()
+    for i in range(30):
+        (big / f"f{i}").write_bytes(os.urandom(512))
+    manager = xcm.XFCEConfigManager({"copy_workers": 1})
+    name = manager.create_backup()["name"]
+    expected = tree_files(source)
+
+    shutil.rmtree(big)
+    (source / "basura").write_text("x")
+    before = tree_files(source)
+
+    calls = {"n": 0}
+    mark_done = xcm.Journal.mark_done
+
+    def interrupt(self, *args):
+        calls["n"] += 1
+        if calls["n"] == 15:
+            raise KeyboardInterrupt
+        return mark_done(self, *args)
+
+    monkeypatch.setattr(xcm.Journal, "mark_done", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        manager.restore(f"backup:{name}", apply_live=False)
+    monkeypatch.setattr(xcm.Journal, "mark_done", mark_done)
+    return manager, name, source, expected, before
+
+
+def test_interrupted_restore_leaves_target_and_resumes(interrupted_restore, monkeypatch):
+    manager, name, source, expected, before = interrupted_restore
+    assert tree_files(source) == before
+    assert [j["name"] for j in manager.pending_journals()] == ["restore"]
+
+    copies = []
+    copy_file_data = xcm.copy_file_data
+    monkeypatch.setattr(xcm, "copy_file_data", lambda a, b: (copies.append(a), copy_file_data(a, b))[1])
+    xcm.XFCEConfigManager({"copy_workers": 1}).restore(f"backup:{name}", apply_live=False)
+
+    assert tree_files(source) == expected
+    # Lo que ya estaba copiado no se vuelve a copiar
+    assert 0 < len(copies) < len(expected)
+    assert manager.pending_journals() == []
+
+
+def test_rollback_discards_partial_restore(interrupted_restore):
+    manager, _, source, _, before = interrupted_restore
+    assert manager.rollback("restore")
+    assert tree_files(source) == before
+    assert manager.pending_journals() == []
+    assert not [p for p in source.parent.iterdir() if p.name.startswith(".xfce4")]
@@ -0,0 +1,62 @@
+import xfce_config_manager as xcm
+
+
+def live_state(home):
+    channel_dir = home / ".config" / "xfce4" / xcm.CHANNEL_DIR
+    return {f.stem: xcm.parse_xfconf_channel(f.read_bytes()) for f in channel_dir.glob("*.xml")}
+
+
+def test_live_delta_only_lists_changed_properties(home):
+    live = live_state(home)
+    live["xfwm4"]["/general/theme"] = ("string", "Otro")
+    live["xfwm4"]["/general/extra"] = ("int", "3")
+    backend = xcm.MemoryXfconfBackend(live)
+    manager = xcm.XFCEConfigManager({}, xfconf_backend=backend)
+
+    changes = manager.live_delta("local:xfce4")
+
+    assert {(c["channel"], c["property"], c["change"]) for c in changes} == {
+        ("xfwm4", "/general/theme", "changed"),
+        ("xfwm4", "/general/extra", "removed"),
+    }
+    theme = next(c for c in changes if c["property"] == "/general/theme")
+    assert theme["old"] == ["string", "Otro"]
+
+
+def test_live_delta_is_empty_when_in_sync(home):
+    manager = xcm.XFCEConfigManager({}, xfconf_backend=xcm.MemoryXfconfBackend(live_state(home)))
+    assert manager.live_delta("local:xfce4") == []
+
+
+class RecordingBackend(xcm.MemoryXfconfBackend):
+    """Anota, en cada tanda, qué había en disco en ese momento"""
+
+    def __init__(self, channels, path):
+        super().__init__(channels)
+        self.path = path
+        self.on_disk = []
+
+    def apply(self, changes):
+        self.on_disk.append(self.path.read_bytes())
+        return super().apply(changes)
+
+
+def test_restore_applies_delta_in_one_batch_after_install(home):
+    live = live_state(home)
+    live["xfwm4"]["/general/theme"] = ("string", "Otro")
+    channel = home / ".config" / "xfce4" / xcm.CHANNEL_DIR / "xfwm4.xml"
+    channel.write_text(channel.read_text().replace('name="theme" type="string" value="Default"',
+                                                   'name="theme" type="string" value="Otro"'))
+    backend = RecordingBackend(live, channel)
+    manager = xcm.XFCEConfigManager({"apply_live": True}, xfconf_backend=backend)
+
+    manager.restore("local:xfce4")
+
+    assert len(backend.batches) == 1
+    assert b'value="Otro"' not in backend.on_disk[0]
+    assert backend.channels["xfwm4"]["/general/theme"] == ("string", "Default")
+    assert manager.live_delta("local:xfce4") == []
+
+
+def test_memory_backend_unknown_channel_is_empty():
+    assert xcm.MemoryXfconfBackend().read_channel("no-existe") == {}
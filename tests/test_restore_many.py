@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+import xfce_config_manager as xcm
+
+UID = GID = 4242
+
+pytestmark = pytest.mark.skipif(os.geteuid() != 0, reason="necesita root para homes ajenos")
+
+
+@pytest.fixture
+def homes():
+    """Directorio para homes ajenos: el tmp_path de pytest no es accesible para otro usuario"""
+    root = Path(tempfile.mkdtemp())
+    os.chmod(root, 0o755)
+    yield root
+    shutil.rmtree(root)
+
+
+def user_home(root, name):
+    home = root / name
+    home.mkdir()
+    os.chown(home, UID, GID)
+    return home
+
+
+def test_restore_many_writes_as_the_user(home, homes):
+    target = user_home(homes, "usuario")
+    manager = xcm.XFCEConfigManager({})
+
+    [result] = manager.restore_many("local:xfce4", [str(target)])
+
+    assert result["ok"], result
+    tree = target / ".config" / "xfce4"
+    assert all(os.lstat(p).st_uid == UID and os.lstat(p).st_gid == GID for p in [tree, *tree.rglob("*")])
+
+
+def test_swapped_staging_cannot_redirect_writes(home, homes, monkeypatch):
+    target = user_home(homes, "usuario")
+    victim = homes / "sistema"
+    victim.mkdir()
+    manager = xcm.XFCEConfigManager({})
+    copy_file_objects = xcm.copy_file_objects
+    swapped = []
+
+    def swap_staging(fin, fout):
+        # Al copiar un archivo de la raíz, el usuario cambia el staging por un
+        # symlink a un directorio de root
+        if not swapped and os.path.samefile(os.path.dirname(fin.name), manager.local_xfce_dir):
+            staging = next((target / ".config").glob(".xfce4.staging-*"))
+            staging.rename(target / ".config" / "movido")
+            staging.symlink_to(victim)
+            swapped.append(staging)
+        return copy_file_objects(fin, fout)
+
+    monkeypatch.setattr(xcm, "copy_file_objects", swap_staging)
+    [result] = manager.restore_many("local:xfce4", [str(target)])
+
+    assert swapped
+    assert not result["ok"]
+    assert list(victim.iterdir()) == []
+    assert not (target / ".config" / "xfce4").exists()
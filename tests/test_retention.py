@@ -0,0 +1,68 @@
+import itertools
+import os
+from datetime import datetime, timedelta
+
+import xfce_config_manager as xcm
+
+
+def entry(name, when, stored_bytes=100, fmt="tar.gz"):
+    return {"name": name, "mtime": when.timestamp(), "stored_bytes": stored_bytes, "format": fmt}
+
+
+def names(entries):
+    return [e["name"] for e in entries]
+
+
+def test_plan_keep_last_and_buckets():
+    start = datetime(2026, 3, 1, 12)
+    entries = [entry(f"b{i}", start + timedelta(hours=6 * i)) for i in range(12)]
+    keep, prune = xcm.RetentionPolicy(keep_last=2, daily=3).plan(entries)
+    # Los 2 últimos y el más reciente de cada uno de los últimos 3 días
+    assert names(keep) == ["b11", "b10", "b9", "b5"]
+    assert names(prune) == ["b8", "b7", "b6", "b4", "b3", "b2", "b1", "b0"]
+
+
+def test_plan_budget_counts_archives_by_stored_bytes():
+    start = datetime(2026, 3, 1)
+    entries = [entry(f"b{i}", start + timedelta(days=i), stored_bytes=400) for i in range(4)]
+    keep, _ = xcm.RetentionPolicy(keep_last=10, max_total_bytes=1000).plan(entries)
+    assert names(keep) == ["b3", "b2"]
+
+
+def test_plan_budget_counts_shared_blobs_once():
+    start = datetime(2026, 3, 1)
+    # Todos comparten "base"; cada uno agrega un blob propio de 300 bytes
+    blobs = {f"b{i}": {"base": 500, f"propio{i}": 300} for i in range(4)}
+    entries = [entry(f"b{i}", start + timedelta(days=i), stored_bytes=800 if i == 0 else 300, fmt="store")
+               for i in range(4)]
+    keep, _ = xcm.RetentionPolicy(keep_last=10, max_total_bytes=1200).plan(entries, lambda e: blobs[e["name"]])
+    # b3 cuesta 800 y b2 solo su blob propio: 1100; b1 ya no entra
+    assert names(keep) == ["b3", "b2"]
+
+
+def test_store_budget_uses_real_space(home, monkeypatch):
+    clock = itertools.count()
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2026, 1, 1) + timedelta(minutes=next(clock))
+
+    monkeypatch.setattr(xcm, "datetime", FakeDatetime)
+    big = home / ".config" / "xfce4" / "grande"
+    manager = xcm.XFCEConfigManager({})
+    for _ in range(3):
+        manager.create_backup()
+    for i in range(2):
+        big.write_bytes(os.urandom(20000 + i))
+        manager.create_backup()
+    entries = sorted(manager.catalog.entries(), key=lambda e: e["name"])
+    newest = sum(manager.backup_blobs(entries[-1]).values())
+
+    policy = xcm.RetentionPolicy(keep_last=10, max_total_bytes=newest + 5000)
+    keep, prune = policy.plan(entries, manager.backup_blobs)
+
+    # Los 3 primeros no tienen "grande" y el resto lo comparten con el más
+    # nuevo: no ocupan nada extra. Solo la versión vieja de "grande" no entra.
+    assert names(prune) == [entries[3]["name"]]
+    assert manager.estimate_freed_bytes(keep, prune) >= 20000
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+import xfce_config_manager as xcm
+
+from conftest import tree_files
+
+
+def interrupt_save(manager, monkeypatch, after=5):
+    calls = {"n": 0}
+    mark_done = xcm.Journal.mark_done
+
+    def interrupt(self, *args):
+        calls["n"] += 1
+        if calls["n"] == after:
+            raise KeyboardInterrupt
+        return mark_done(self, *args)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(xcm.Journal, "mark_done", interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            manager.save_config_tree()
+
+
+def change_everything(source):
+    for path in source.rglob("*"):
+        if path.is_file() and not path.is_symlink():
+            path.write_bytes(path.read_bytes() + b"\n<!-- cambio -->\n")
+
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_interrupted_save_leaves_previous_state(home, monkeypatch, incremental):
+    source = home / ".config" / "xfce4"
+    manager = xcm.XFCEConfigManager({"incremental_save": incremental})
+    manager.save_config_tree()
+    saved = manager.current_config_dir / "xfce4"
+    before = tree_files(saved)
+
+    change_everything(source)
+    interrupt_save(manager, monkeypatch)
+
+    assert tree_files(saved) == before
+    assert [j["name"] for j in manager.pending_journals()] == ["save"]
+    assert manager.rollback("save")
+    assert tree_files(saved) == before
+    assert manager.pending_journals() == []
+
+
+def test_interrupted_save_resumes(home, monkeypatch):
+    source = home / ".config" / "xfce4"
+    manager = xcm.XFCEConfigManager({})
+    manager.save_config_tree()
+    change_everything(source)
+    interrupt_save(manager, monkeypatch)
+
+    stats = xcm.XFCEConfigManager({}).save_config_tree()
+
+    assert stats["skipped"] >= 4
+    expected = {rel: data for rel, data in tree_files(source).items()
+                if not manager.exclude.excluded_path(rel, False)}
+    assert tree_files(manager.current_config_dir / "xfce4") == expected
+    assert manager.pending_journals() == []
+
+
+def test_incremental_save_never_writes_into_the_previous_tree(home):
+    source = home / ".config" / "xfce4"
+    manager = xcm.XFCEConfigManager({})
+    manager.save_config_tree()
+    saved = manager.current_config_dir / "xfce4"
+    helpers = saved / "helpers.rc"
+    old_data = helpers.read_bytes()
+    # Otro enlace al archivo guardado: tiene que seguir con el contenido viejo
+    os.link(helpers, home / "enlace")
+
+    (source / "helpers.rc").write_text("otro contenido\n")
+    manager.save_config_tree()
+
+    assert (saved / "helpers.rc").read_text() == "otro contenido\n"
+    assert (home / "enlace").read_bytes() == old_data
+
+
+def saved_matches(manager, source):
+    expected = {rel: data for rel, data in tree_files(source).items()
+                if not manager.exclude.excluded_path(rel, False)}
+    return tree_files(manager.current_config_dir / "xfce4") == expected
+
+
+def test_unchanged_save_copies_nothing(home):
+    manager = xcm.XFCEConfigManager({})
+    first = manager.save_config_tree()
+    second = manager.save_config_tree()
+    assert first["copied"] > 0
+    assert second["copied"] == second["updated"] == second["deleted"] == 0
+    assert second["skipped"] == first["copied"]
+
+
+def test_incremental_save_copies_changes_and_deletions(home):
+    source = home / ".config" / "xfce4"
+    manager = xcm.XFCEConfigManager({})
+    manager.save_config_tree()
+
+    (source / "helpers.rc").write_text("cambiado\n")
+    (source / "panel" / "xfce4-clipman-actions.xml").unlink()
+    stats = manager.save_config_tree()
+
+    assert stats["copied"] == 1 and stats["deleted"] == 1
+    assert saved_matches(manager, source)
+
+
+def test_incremental_save_handles_type_changes(home):
+    source = home / ".config" / "xfce4"
+    manager = xcm.XFCEConfigManager({})
+    manager.save_config_tree()
+
+    (source / "helpers.rc").unlink()
+    (source / "helpers.rc").mkdir()
+    (source / "helpers.rc" / "dentro").write_text("x")
+    (source / "panel" / "xfce4-clipman-actions.xml").unlink()
+    os.rmdir(source / "panel")
+    os.symlink("desktop", source / "panel")
+    manager.save_config_tree()
+
+    saved = manager.current_config_dir / "xfce4"
+    assert (saved / "helpers.rc").is_dir() and os.readlink(saved / "panel") == "desktop"
+    assert saved_matches(manager, source)
+
+
+def test_file_deleted_from_saved_tree_is_copied_again(home):
+    source = home / ".config" / "xfce4"
+    manager = xcm.XFCEConfigManager({})
+    manager.save_config_tree()
+    saved = manager.current_config_dir / "xfce4"
+    (saved / "helpers.rc").unlink()
+    (saved / "panel" / "xfce4-clipman-actions.xml").unlink()
+    (saved / "panel").rmdir()
+
+    stats = manager.save_config_tree()
+
+    assert stats["copied"] == 2
+    assert saved_matches(manager, source)
+    assert all(not r["problems"] for r in manager.verify(["saved"]))
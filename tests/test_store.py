@@ -0,0 +1,100 @@
+import errno
+import os
+
+import pytest
+
+import xfce_config_manager as xcm
+
+from conftest import tree_files
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Árbol de origen con permisos, fechas y un symlink"""
+    src = tmp_path / "src"
+    (src / "panel").mkdir(parents=True)
+    (src / "a.xml").write_text("<a/>\n")
+    (src / "panel" / "b.rc").write_bytes(os.urandom(5000))
+    (src / "privado").write_text("secreto\n")
+    os.chmod(src / "privado", 0o600)
+    os.symlink("panel/b.rc", src / "enlace")
+    os.chmod(src / "panel", 0o750)
+    for n, path in enumerate([src / "a.xml", src / "panel" / "b.rc", src / "privado", src / "panel", src]):
+        os.utime(path, ns=(1_600_000_000_000_000_000 + n, 1_600_000_000_000_000_000 + n))
+    return src
+
+
+@pytest.fixture
+def store(tmp_path):
+    return xcm.BlobStore(tmp_path / "backups" / ".store", xcm.TreeEngine(2))
+
+
+def objects(store):
+    return [p for p in store.objects_dir.rglob("*") if p.is_file()]
+
+
+def metadata(root):
+    meta = {}
+    for path in [root, *sorted(root.rglob("*"))]:
+        st = os.lstat(path)
+        meta[str(path.relative_to(root))] = (st.st_mode, st.st_mtime_ns, os.readlink(path) if path.is_symlink() else None)
+    return meta
+
+
+def test_second_snapshot_of_same_tree_writes_nothing(tree, store, tmp_path):
+    first = store.create_snapshot(tree, tmp_path / "backups" / "uno")
+    second = store.create_snapshot(tree, tmp_path / "backups" / "dos")
+
+    assert first["written_bytes"] == first["bytes"] > 0
+    assert second["written_bytes"] == 0
+    assert len(objects(store)) == 3
+    assert (os.stat(tmp_path / "backups" / "uno" / "a.xml").st_ino
+            == os.stat(tmp_path / "backups" / "dos" / "a.xml").st_ino)
+
+
+def test_materialize_round_trip_keeps_modes_and_mtimes(tree, store, tmp_path):
+    snapshot = tmp_path / "backups" / "uno"
+    store.create_snapshot(tree, snapshot)
+    dst = tmp_path / "restaurado"
+
+    store.materialize(snapshot, dst)
+
+    assert tree_files(dst) == tree_files(tree)
+    assert metadata(dst) == metadata(tree)
+
+
+def test_deleting_one_snapshot_keeps_shared_blobs(tree, store, tmp_path):
+    uno, dos = tmp_path / "backups" / "uno", tmp_path / "backups" / "dos"
+    store.create_snapshot(tree, uno)
+    (tree / "a.xml").write_text("<a cambio='1'/>\n")
+    store.create_snapshot(tree, dos)
+    assert len(objects(store)) == 4
+
+    freed = store.delete_snapshot(uno)
+
+    # Solo se libera la versión vieja de a.xml
+    assert freed == len("<a/>\n")
+    assert len(objects(store)) == 3
+    store.materialize(dos, tmp_path / "restaurado")
+    assert tree_files(tmp_path / "restaurado") == tree_files(tree)
+
+    store.delete_snapshot(dos)
+    assert objects(store) == []
+
+
+def test_snapshot_without_hardlinks_survives_gc(tree, store, tmp_path, monkeypatch):
+    uno, dos = tmp_path / "backups" / "uno", tmp_path / "backups" / "dos"
+    store.create_snapshot(tree, uno)
+
+    def no_link(src, dst):
+        raise OSError(errno.EMLINK, "Too many links")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(xcm.os, "link", no_link)
+        store.create_snapshot(tree, dos)
+    assert all(os.stat(p).st_nlink == 1 for p in dos.rglob("*") if p.is_file() and not p.is_symlink())
+
+    # Al borrar el único snapshot con hardlinks los blobs quedan sin enlaces
+    store.delete_snapshot(uno)
+    store.materialize(dos, tmp_path / "restaurado")
+    assert tree_files(tmp_path / "restaurado") == tree_files(tree)
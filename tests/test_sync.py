@@ -0,0 +1,88 @@
+import pytest
+
+import xfce_config_manager as xcm
+
+from conftest import tree_files
+
+
+def test_push_repush_pull_round_trip(home, tmp_path):
+    remote = tmp_path / "repo"
+    manager = xcm.XFCEConfigManager({"sync_remote": str(remote)})
+
+    first = manager.push("local:xfce4", name="equipo")
+    assert first["chunks_sent"] == first["chunks"] > 0
+    assert xcm.LocalSyncTransport(remote).list_snapshots() == ["equipo"]
+
+    again = manager.push("local:xfce4", name="equipo")
+    assert again["chunks_sent"] == 0
+    assert again["bytes_sent"] == 0
+
+    pulled = manager.pull("equipo", "local:copia")
+    target = manager.local_xfce_dir.parent / "copia"
+    assert pulled["target"] == str(target)
+    assert tree_files(target) == tree_files(manager.local_xfce_dir)
+
+    # Lo bajado tiene el mismo contenido: volver a subirlo no manda nada
+    assert manager.push("local:copia", name="equipo")["chunks_sent"] == 0
+
+def test_pull_reuses_local_files(home, tmp_path):
+    manager = xcm.XFCEConfigManager({"sync_remote": str(tmp_path / "repo")})
+    manager.push("local:xfce4", name="equipo")
+
+    pulled = manager.pull("equipo", "local:copia")
+
+    # Todo el contenido ya está en ~/.config/xfce4: no se baja ningún trozo
+    assert pulled["chunks_received"] == 0
+    assert pulled["files_reused"] == pulled["files"]
+
+
+def evil_entries(manifest):
+    """Variantes de un manifiesto legítimo que intentan escribir fuera del destino"""
+    file_item = next(e for e in manifest["entries"] if e["type"] == "file")
+    link = {"type": "symlink", "mode": 0o777, "mtime_ns": 0}
+    escape = dict(file_item, path="../../../afuera.txt")
+    absolute = dict(file_item, path="/tmp/afuera.txt")
+    inner = dict(file_item, path="panel/../../afuera.txt")
+    return {
+        "ruta con ..": [escape],
+        "ruta absoluta": [absolute],
+        "ruta sin normalizar": [inner],
+        "archivo dentro de un symlink": [dict(link, path="salida", target=".."),
+                                         dict(file_item, path="salida/afuera.txt")],
+        "symlink absoluto": [dict(link, path="salida", target="/etc")],
+        "symlink que sube": [dict(link, path="salida", target="../..")],
+        "symlink a través de otro": [dict(link, path="a", target="."),
+                                     dict(link, path="b", target="a/../..")],
+        "hash inválido": [dict(file_item, path="x", sha256="../../etc/passwd")],
+    }
+
+
+@pytest.mark.parametrize("case", ["ruta con ..", "ruta absoluta", "ruta sin normalizar",
+                                  "archivo dentro de un symlink", "symlink absoluto",
+                                  "symlink que sube", "symlink a través de otro", "hash inválido"])
+def test_pull_rejects_malicious_manifest(home, tmp_path, case):
+    remote = xcm.LocalSyncTransport(tmp_path / "repo")
+    manager = xcm.XFCEConfigManager({"sync_remote": str(tmp_path / "repo")})
+    manager.push("local:xfce4", name="equipo")
+    manifest = remote.get_manifest("equipo")
+    manifest["entries"] += evil_entries(manifest)[case]
+    remote.put_manifest("malo", manifest)
+    outside = {p for p in tmp_path.rglob("*")}
+
+    with pytest.raises(xcm.ConfigManagerError):
+        manager.pull("malo", "local:copia")
+
+    assert not (manager.local_xfce_dir.parent / "copia").exists()
+    assert {p for p in tmp_path.rglob("*")} == outside
+
+
+def test_pull_keeps_links_inside_the_tree(home, tmp_path):
+    source = home.parent / "work" / "Configuraciones" / "xfce4"
+    (source / "panel" / "atajo").symlink_to("../helpers.rc")
+    manager = xcm.XFCEConfigManager({"sync_remote": str(tmp_path / "repo")})
+    manager.push("local:xfce4", name="equipo")
+
+    manager.pull("equipo", "local:copia")
+
+    link = manager.local_xfce_dir.parent / "copia" / "panel" / "atajo"
+    assert link.is_symlink() and link.read_bytes() == (source / "helpers.rc").read_bytes()
@@ -0,0 +1,85 @@
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+
+import xfce_config_manager as xcm
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_scheduler_waits_for_quiet_period(clock):
+    scheduler = xcm.SnapshotScheduler(quiet_period=2.0, min_interval=0.0, clock=clock)
+    assert scheduler.seconds_until_due() is None
+
+    scheduler.record("a")
+    clock.now = 1.5
+    scheduler.record("b")
+    # Cada evento nuevo reinicia la espera
+    assert scheduler.seconds_until_due() == 2.0
+    clock.now = 3.5
+    assert scheduler.seconds_until_due() == 0.0
+    assert scheduler.take() == (["a", "b"], 0)
+    assert scheduler.seconds_until_due() is None
+
+
+def test_scheduler_respects_min_interval(clock):
+    scheduler = xcm.SnapshotScheduler(quiet_period=1.0, min_interval=60.0, clock=clock)
+    scheduler.record("a")
+    clock.now = 1.0
+    scheduler.take()
+
+    clock.now = 10.0
+    scheduler.record("b")
+    clock.now = 20.0
+    assert scheduler.seconds_until_due() == 41.0
+    clock.now = 61.0
+    assert scheduler.seconds_until_due() == 0.0
+
+
+def test_scheduler_bounds_pending_paths(clock):
+    scheduler = xcm.SnapshotScheduler(max_pending=3, clock=clock)
+    for path in ["a", "b", "c", "d", "e", "a", "d"]:
+        scheduler.record(path)
+    assert scheduler.take() == (["a", "b", "c"], 3)
+    assert scheduler.pending == set() and scheduler.dropped == 0
+
+
+@pytest.fixture
+def minutes(monkeypatch):
+    clock = itertools.count()
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2026, 1, 1) + timedelta(minutes=next(clock))
+
+    monkeypatch.setattr(xcm, "datetime", FakeDatetime)
+
+
+def test_watch_snapshots_keep_history_with_default_retention(home, minutes):
+    manager = xcm.XFCEConfigManager({})
+    manual = manager.create_backup()["name"]
+    for _ in range(4):
+        result = manager.take_watch_snapshot()
+        assert "pruned" not in result
+    names = [e["name"] for e in manager.catalog.entries()]
+    assert len(names) == 5 and manual in names
+
+
+def test_watch_snapshots_apply_configured_retention(home, minutes):
+    manager = xcm.XFCEConfigManager({"retention": {"keep_last": 3}})
+    for _ in range(5):
+        manager.take_watch_snapshot()
+    assert len(manager.catalog.entries()) == 3
@@ -4,22 +4,3122 @@ XFCE Configuration Manager
 Gestor de configuraciones para XFCE Desktop Environment
 """
 
+import io
 import os
+import re
 import sys
+import json
+import copy
+import zlib
+import errno
+import stat
 import shutil
+import time
+import shlex
+import signal
+import select
+import sqlite3
+import struct
+import difflib
+import argparse
+import contextlib
+import fcntl
+import ctypes
+import tarfile
+import hashlib
 import platform
+import pwd
+import tempfile
+import threading
 import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_SETTINGS = {
+    # Guardar en current_config/ copiando solo lo que cambió
+    "incremental_save": True,
+    # Hilos para copiar y borrar archivos en paralelo (1 = secuencial)
+    "copy_workers": 8,
+    # Formato de los backups: "store" (deduplicado) o "tar.gz" / "tar.xz" / "tar.zst"
+    "backup_format": "store",
+    # Aplicar en vivo las propiedades xfconf al restaurar (sin reiniciar la sesión)
+    "apply_live": False,
+    # Backend de xfconf: "auto", "dbus" o "xfconf-query"
+    "xfconf_backend": "auto",
+    # Modo watch: segundos sin cambios antes del snapshot, mínimo entre snapshots
+    # y cantidad máxima de rutas pendientes que se recuerdan
+    "watch": {"quiet_period": 2.0, "min_interval": 60.0, "max_pending": 4096, "backup": True},
+    # Reglas de exclusión (estilo .gitignore) que se suman a DEFAULT_EXCLUDES
+    "exclude": [],
+    # Repositorio para sync push/pull: ruta, ssh://host/ruta, host:ruta o http(s)://
+    "sync_remote": None,
+    # Retención: últimos N más los más recientes de cada hora/día/semana/mes
+    "retention": {"keep_last": 2, "hourly": 0, "daily": 0, "weekly": 0, "monthly": 0,
+                  "max_total_bytes": None},
+    # Almacén: guardar las versiones viejas de los canales xfconf como deltas de la
+    # siguiente, con cadenas de a lo sumo max_chain deltas hasta una versión completa
+    "channel_deltas": {"enabled": False, "max_chain": 16},
+}
+
+ARCHIVE_FORMATS = ("tar.gz", "tar.xz", "tar.zst")
+
+# Carpeta de Configuraciones/ con las capas que solo se usan dentro de perfiles compuestos
+LAYERS_DIR = "capas"
+# Composiciones de perfiles que se conservan en backups/.store/profiles/
+PROFILE_CACHE_SIZE = 8
+
+# Contenido volátil de ~/.config/xfce4 que no se guarda ni se respalda.
+# Se puede volver a incluir con "!patrón" en Configuraciones/<perfil>.exclude
+DEFAULT_EXCLUDES = (
+    # Temporales y respaldos de editores
+    "*~",
+    "*.tmp",
+    "*.swp",
+    # xfconfd escribe primero <canal>.xml.new y después lo renombra
+    "xfconf/xfce-perchannel-xml/*.new",
+    # Estado que cambia en cada uso: posiciones de íconos, historial
+    "/desktop/icons.screen*",
+    "/xfce4-appfinder/history",
+)
+
+SETTINGS_FILE = Path("xfce_config_manager.json")
+
+# Ruta del archivo de traza ("1" elige un nombre con el pid); vacío = sin traza
+TRACE_ENV = "XFCE_TRACE"
+
+
+class ConfigManagerError(Exception):
+    """Error de una operación del gestor"""
+
+
+class SourceNotFoundError(ConfigManagerError):
+    """La configuración de origen pedida no existe"""
+
+
+class NullTracer:
+    """Tracer apagado: cada fase es el mismo objeto y no se mide nada"""
+
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def phase(self, name, **args):
+        return self
+
+    def update(self, **counters):
+        pass
+
+    def write(self):
+        return None
+
+
+class TracePhase:
+    """Fase en curso de un Tracer: mide el tiempo de pared y acumula contadores"""
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self, end)
+        return False
+
+    def update(self, **counters):
+        """Suma contadores (archivos, bytes, syscalls evitadas...) a la fase"""
+        for key, value in counters.items():
+            self.args[key] = self.args.get(key, 0) + value
+
+
+class Tracer:
+    """Registra fases y contadores y los escribe como traza de Chrome (JSON)
+
+    El archivo se abre en chrome://tracing o Perfetto; otherData trae el
+    resumen por fase (cantidad, milisegundos y contadores sumados) para
+    agregar trazas de varias máquinas sin procesar los eventos.
+    """
+
+    enabled = True
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.events = []
+        self.origin = time.perf_counter_ns()
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self._lock = threading.Lock()
+
+    def phase(self, name, **args):
+        return TracePhase(self, name, args)
+
+    def add(self, phase, end):
+        event = {"name": phase.name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                 "ts": (phase.start - self.origin) / 1000, "dur": (end - phase.start) / 1000,
+                 "args": phase.args}
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self):
+        """Totales por fase: cantidad, milisegundos y contadores numéricos sumados"""
+        phases = {}
+        for event in self.events:
+            total = phases.setdefault(event["name"], {"count": 0, "ms": 0.0})
+            total["count"] += 1
+            total["ms"] += event["dur"] / 1000
+            for key, value in event["args"].items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total[key] = total.get(key, 0) + value
+        return phases
+
+    def write(self):
+        """Escribe la traza y devuelve su ruta"""
+        write_json_atomic(self.path, {
+            "traceEvents": self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"started": self.started, "argv": sys.argv, "python": platform.python_version(),
+                          "platform": platform.platform(), "phases": self.summary()},
+        })
+        return self.path
+
+
+def make_tracer(path=None):
+    """Tracer según la ruta pedida o la variable XFCE_TRACE (NullTracer si no hay)"""
+    path = path or os.environ.get(TRACE_ENV)
+    if not path:
+        return NullTracer()
+    if path == "1":
+        path = f"xfce_trace_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{os.getpid()}.json"
+    return Tracer(path)
+
+
+def load_settings(path=SETTINGS_FILE):
+    """Lee los ajustes del usuario (JSON) si el archivo existe"""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def hash_file(path):
+    """Calcula el SHA-256 del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tree_digest(entries):
+    """Hash de un árbol completo a partir de sus entradas (ruta + contenido)"""
+    digest = hashlib.sha256()
+    for item in sorted(entries, key=lambda e: e["path"]):
+        if item["type"] == "file":
+            digest.update(f"F {item['path']}\0{item['sha256']}\n".encode())
+        elif item["type"] == "symlink":
+            digest.update(f"L {item['path']}\0{item['target']}\n".encode())
+        else:
+            digest.update(f"D {item['path']}\n".encode())
+    return digest.hexdigest()
+
+
+class ExcludeRules:
+    """Reglas de exclusión estilo .gitignore compiladas una sola vez
+
+    Soporta *, ?, [...], ** y las marcas de .gitignore: "!" vuelve a incluir,
+    "/" al final solo aplica a directorios y un "/" al principio o en el medio
+    ancla el patrón a la raíz. Gana la última regla que coincide. Sin reglas
+    "!" todo se resuelve con una sola expresión regular combinada.
+    """
+
+    def __init__(self, patterns=()):
+        self.rules = []
+        for line in patterns:
+            rule = self.compile_rule(line)
+            if rule is not None:
+                self.rules.append(rule)
+
+        self._file_re = self._dir_re = None
+        if not any(negate for _, negate, _ in self.rules):
+            self._file_re = self._combine([r for r, _, dir_only in self.rules if not dir_only])
+            self._dir_re = self._combine([r for r, _, _ in self.rules])
+
+    @staticmethod
+    def _combine(regexes):
+        if not regexes:
+            return None
+        return re.compile("|".join(f"(?:{r.pattern})" for r in regexes))
+
+    @staticmethod
+    def compile_rule(line):
+        """Convierte una línea de reglas en (regex, negación, solo directorios) o None"""
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            return None
+        negate = line.startswith("!")
+        if negate or line.startswith("\\"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if not line:
+            return None
+
+        regex = ""
+        i = 0
+        while i < len(line):
+            if line.startswith("**/", i):
+                regex += "(?:.*/)?"
+                i += 3
+            elif line.startswith("**", i):
+                regex += ".*"
+                i += 2
+            elif line[i] == "*":
+                regex += "[^/]*"
+                i += 1
+            elif line[i] == "?":
+                regex += "[^/]"
+                i += 1
+            elif line[i] == "[" and "]" in line[i + 2:]:
+                end = line.index("]", i + 2)
+                body = line[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                regex += f"[{body}]"
+                i = end + 1
+            else:
+                regex += re.escape(line[i])
+                i += 1
+
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        return re.compile(f"{regex}$"), negate, dir_only
+
+    @classmethod
+    def for_profile(cls, profile_dir, extra=()):
+        """Reglas por defecto + extra + Configuraciones/<perfil>.exclude si existe"""
+        patterns = list(DEFAULT_EXCLUDES) + list(extra)
+        override = Path(profile_dir).with_name(f"{Path(profile_dir).name}.exclude")
+        if override.exists():
+            with open(override, encoding='utf-8') as f:
+                patterns.extend(f)
+        return cls(patterns)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def excluded(self, rel, is_dir):
+        """Indica si la ruta relativa queda excluida (sin mirar sus padres)"""
+        if self._dir_re is not None or not self.rules:
+            regex = self._dir_re if is_dir else self._file_re
+            return regex is not None and regex.match(rel) is not None
+        for regex, negate, dir_only in reversed(self.rules):
+            if (is_dir or not dir_only) and regex.match(rel):
+                return not negate
+        return False
+
+    def excluded_path(self, rel, is_dir):
+        """Como excluded, pero también excluye si algún directorio padre lo está"""
+        parts = rel.split("/")
+        for n in range(1, len(parts)):
+            if self.excluded("/".join(parts[:n]), True):
+                return True
+        return self.excluded(rel, is_dir)
+
+
+def tree_signature(root):
+    """Hash barato de un árbol a partir de rutas, tamaños y fechas (sin leer contenido)"""
+    digest = hashlib.sha256()
+    for rel, entry in scan_tree(root):
+        st = entry.stat(follow_symlinks=False)
+        digest.update(f"{rel}\0{st.st_mode}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def describe_tree(root):
+    """Cantidad de archivos, bytes y hash de contenido de un árbol (leyendo todo)"""
+    entries = []
+    for rel, entry in scan_tree(root):
+        if entry.is_symlink():
+            entries.append({"path": rel, "type": "symlink", "target": os.readlink(entry.path)})
+        elif entry.is_dir():
+            entries.append({"path": rel, "type": "dir"})
+        elif entry.is_file():
+            entries.append({"path": rel, "type": "file", "sha256": hash_file(entry.path),
+                            "size": entry.stat().st_size})
+    files = [e for e in entries if e["type"] == "file"]
+    return {"file_count": len(files), "bytes": sum(e["size"] for e in files),
+            "digest": tree_digest(entries)}
+
+
+def scan_tree(root, rel="", exclude=None):
+    """Recorre un árbol con os.scandir devolviendo (ruta relativa, DirEntry)
+
+    Con exclude (ExcludeRules) los directorios excluidos se podan sin entrar.
+    """
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda e: e.name)
+
+    for entry in entries:
+        rel_path = f"{rel}/{entry.name}" if rel else entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if exclude and exclude.excluded(rel_path, is_dir):
+            continue
+        yield rel_path, entry
+        # Los directorios se devuelven antes que su contenido
+        if is_dir:
+            yield from scan_tree(entry.path, rel_path, exclude)
+
+
+def scan_excluded(root, exclude, rel=""):
+    """Entradas de un árbol que exclude deja afuera: (ruta relativa, DirEntry)
+
+    Un directorio excluido se devuelve entero, sin entrar en él.
+    """
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda e: e.name)
+
+    for entry in entries:
+        rel_path = f"{rel}/{entry.name}" if rel else entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if exclude.excluded(rel_path, is_dir):
+            yield rel_path, entry
+        elif is_dir:
+            yield from scan_excluded(entry.path, exclude, rel_path)
+
+
+def preserve_excluded(target, staging, exclude, engine=None):
+    """Copia a staging lo excluido del árbol actual target, devuelve cuántas entradas
+
+    Lo excluido no está en los backups ni en los guardados: al instalar un
+    árbol nuevo se conserva lo que ya había (la versión de target gana).
+    """
+    engine = engine or TreeEngine(1)
+    target, staging = Path(target), Path(staging)
+    if not exclude or not target.is_dir() or target.is_symlink():
+        return 0
+    count = 0
+    for rel, entry in scan_excluded(target, exclude):
+        dst = staging / rel
+        if os.path.lexists(dst):
+            engine.remove_tree(dst)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if entry.is_symlink():
+            os.symlink(os.readlink(entry.path), dst)
+            shutil.copystat(entry.path, dst, follow_symlinks=False)
+        elif entry.is_dir():
+            engine.copy_tree(entry.path, dst)
+        elif entry.is_file():
+            engine.copy_file(entry.path, dst)
+        else:
+            continue
+        count += 1
+    return count
+
+
+def write_json_atomic(path, data):
+    """Escribe un JSON de forma atómica (archivo temporal + rename)"""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp{os.getpid()}")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+FICLONE = 0x40049409
+
+# Errores que indican "este método no sirve acá", no un fallo real de copia
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                    errno.ENOTTY, errno.EBADF, errno.ETXTBSY, errno.EPERM}
+_unsupported_copy = set()
+
+
+def _copy_reflink(fin, fout, size):
+    fcntl.ioctl(fout, FICLONE, fin)
+
+
+def _copy_file_range(fin, fout, size):
+    remaining = size
+    while remaining > 0:
+        copied = os.copy_file_range(fin, fout, remaining)
+        if copied == 0:
+            break
+        remaining -= copied
+
+
+def _copy_sendfile(fin, fout, size):
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(fout, fin, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+_COPY_METHODS = [("reflink", _copy_reflink)]
+if hasattr(os, "copy_file_range"):
+    _COPY_METHODS.append(("copy_file_range", _copy_file_range))
+if hasattr(os, "sendfile"):
+    _COPY_METHODS.append(("sendfile", _copy_sendfile))
+
+
+def copy_file_data(src, dst):
+    """Copia el contenido de src a dst usando el camino más rápido disponible
+
+    Orden: reflink (FICLONE, btrfs/XFS), copy_file_range y sendfile (copia en
+    el kernel) y, como último recurso, copia con buffer. Si un método no está
+    soportado entre esos dos sistemas de archivos no se vuelve a intentar.
+    Devuelve el nombre del método usado.
+    """
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        return copy_file_objects(fin, fout)
+
+
+def copy_file_objects(fin, fout):
+    """Como copy_file_data pero con los dos archivos ya abiertos"""
+    in_fd = fin.fileno()
+    out_fd = fout.fileno()
+    src_st = os.fstat(in_fd)
+    devices = (src_st.st_dev, os.fstat(out_fd).st_dev)
+
+    for name, method in _COPY_METHODS:
+        if (name, devices) in _unsupported_copy:
+            continue
+        try:
+            method(in_fd, out_fd, src_st.st_size)
+            return name
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            _unsupported_copy.add((name, devices))
+            # Descartar lo que se haya copiado a medias
+            os.ftruncate(out_fd, 0)
+            os.lseek(in_fd, 0, os.SEEK_SET)
+            os.lseek(out_fd, 0, os.SEEK_SET)
+
+    shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+    return "buffered"
+
+
+class TreeEngine:
+    """Motor compartido de copia y borrado de árboles
+
+    Recorre con os.scandir en un solo hilo (en orden, los directorios antes
+    que su contenido) y reparte las operaciones por archivo entre un pool de
+    hilos acotado. El resultado es el de shutil.copytree(symlinks=True):
+    permisos y fechas de archivos y directorios, symlinks como symlinks.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = max(1, int(workers))
+        self.copy_methods = Counter()
+        self._lock = threading.Lock()
+
+    def map(self, func, items):
+        """Aplica func a cada elemento usando el pool; propaga el primer error"""
+        items = list(items)
+        if self.workers == 1 or len(items) < 2:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as pool:
+            return list(pool.map(func, items))
+
+    def copy_data(self, src, dst):
+        """Copia solo el contenido de un archivo, registrando el método usado"""
+        method = copy_file_data(src, dst)
+        with self._lock:
+            self.copy_methods[method] += 1
+        return method
+
+    def copy_open(self, fin, fout):
+        """Como copy_data pero con los dos archivos ya abiertos"""
+        method = copy_file_objects(fin, fout)
+        with self._lock:
+            self.copy_methods[method] += 1
+        return method
+
+    def copy_file(self, src, dst):
+        """Copia un archivo con sus permisos y fechas"""
+        self.copy_data(src, dst)
+        shutil.copystat(src, dst)
+
+    def take_copy_report(self):
+        """Devuelve y reinicia el conteo de métodos de copia usados"""
+        with self._lock:
+            report = dict(self.copy_methods)
+            self.copy_methods.clear()
+        return report
+
+    def copy_tree(self, src, dst, exclude=None, journal=None):
+        """Copia src a dst (que no debe existir) salvo lo excluido, devuelve estadísticas
+
+        Con journal, dst puede ser una copia interrumpida: los archivos que el
+        journal da por terminados no se vuelven a copiar.
+        """
+        src = Path(src)
+        dst = Path(dst)
+        dst.mkdir(parents=True, exist_ok=journal is not None)
+        stats = {"files": 0, "dirs": 0, "symlinks": 0, "bytes": 0}
+        dirs = [(src, dst)]
+        files = []
+
+        for rel, entry in scan_tree(src, exclude=exclude):
+            target = dst / rel
+            if entry.is_symlink():
+                if journal is not None and os.path.lexists(target):
+                    target.unlink()
+                os.symlink(os.readlink(entry.path), target)
+                shutil.copystat(entry.path, target, follow_symlinks=False)
+                stats["symlinks"] += 1
+            elif entry.is_dir():
+                target.mkdir(exist_ok=journal is not None)
+                dirs.append((entry.path, target))
+                stats["dirs"] += 1
+            else:
+                stats["files"] += 1
+                stats["bytes"] += entry.stat(follow_symlinks=False).st_size
+                if journal is None or not journal.is_done(rel):
+                    files.append((rel, entry.path, target))
+
+        def copy_one(task):
+            rel, src_path, target = task
+            self.copy_file(src_path, target)
+            if journal is not None:
+                journal.mark_done(rel)
+
+        self.map(copy_one, files)
+
+        # Fechas de directorios al final: copiar adentro las modifica
+        for src_dir, dst_dir in reversed(dirs):
+            shutil.copystat(src_dir, dst_dir)
+        return stats
+
+    def remove_tree(self, path):
+        """Borra un árbol: archivos en paralelo, luego directorios de adentro hacia afuera"""
+        path = Path(path)
+        if path.is_symlink() or not path.is_dir():
+            if os.path.lexists(path):
+                path.unlink()
+            return
+
+        dirs = [path]
+        files = []
+        for rel, entry in scan_tree(path):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            else:
+                files.append(entry.path)
+
+        self.map(os.unlink, files)
+        for directory in reversed(dirs):
+            os.rmdir(directory)
+
+
+def copy_tree_as_user(src, dst, uid, gid, engine):
+    """Copia src a dst escribiendo con la identidad uid:gid (src puede ser solo de root)
+
+    Como root solo se recorre src y se abre cada archivo; todo lo que se crea
+    en dst se hace con setfsuid del usuario, así el árbol queda a su nombre
+    y, si cambia dst por un symlink mientras tanto, la escritura no tiene
+    más permisos que él. Devuelve los bytes copiados.
+    """
+    with fs_identity(0, 0):
+        root_st = os.stat(src)
+        entries = [(rel, entry, entry.stat(follow_symlinks=False)) for rel, entry in scan_tree(src)]
+        links = {rel: os.readlink(entry.path) for rel, entry, _ in entries if entry.is_symlink()}
+    size = 0
+    with fs_identity(uid, gid):
+        os.mkdir(dst, 0o700)
+        dirs = [(dst, root_st)]
+        for rel, entry, st in entries:
+            target = os.path.join(dst, rel)
+            if rel in links:
+                os.symlink(links[rel], target)
+                os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                os.mkdir(target, 0o700)
+                dirs.append((target, st))
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            with fs_identity(0, 0):
+                fin = open(entry.path, 'rb')
+            with fin, open(os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW,
+                                   0o600), 'wb') as fout:
+                engine.copy_open(fin, fout)
+            os.chmod(target, stat.S_IMODE(st.st_mode) & 0o1777)
+            os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+            size += st.st_size
+        # Fechas de directorios al final: copiar adentro las modifica
+        for path, st in reversed(dirs):
+            os.chmod(path, stat.S_IMODE(st.st_mode) & 0o1777)
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return size
+
+
+def check_user_dir(path, uid):
+    """Comprueba que path sea un directorio real (no symlink) de uid; False si no existe
+
+    Para escribir como root en un home ajeno: un symlink puesto por el
+    usuario llevaría la escritura a cualquier lado del sistema.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    if stat.S_ISLNK(st.st_mode):
+        raise ConfigManagerError(f"{path} es un symlink: no se restaura ahí")
+    if not stat.S_ISDIR(st.st_mode):
+        raise ConfigManagerError(f"{path} no es un directorio")
+    if st.st_uid != uid:
+        raise ConfigManagerError(f"{path} no pertenece al usuario {uid}")
+    return True
+
+
+@contextlib.contextmanager
+def fs_identity(uid, gid):
+    """Usa uid:gid para los permisos de archivos de este hilo (setfsuid/setfsgid)
+
+    Solo tiene efecto como root y no cambia al resto del proceso; los hilos
+    que se crean adentro heredan la identidad.
+    """
+    if os.geteuid() != 0:
+        yield
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    old_gid = libc.setfsgid(gid)
+    old_uid = libc.setfsuid(uid)
+    try:
+        yield
+    finally:
+        libc.setfsuid(old_uid)
+        libc.setfsgid(old_gid)
+
+
+def index_entry(entry, st):
+    """Arma la entrada de índice (tipo, tamaño, mtime, inodo) de un DirEntry"""
+    item = {"mode": st.st_mode & 0o7777, "mtime_ns": st.st_mtime_ns}
+    if entry.is_symlink():
+        item.update(type="symlink", target=os.readlink(entry.path))
+    elif entry.is_dir():
+        item["type"] = "dir"
+    elif entry.is_file():
+        item.update(type="file", size=st.st_size, inode=st.st_ino)
+    else:
+        return None
+    return item
+
+
+def link_tree(src, dst):
+    """Arma dst con hardlinks a los archivos de src (directorios y symlinks se recrean)
+
+    Lo que ya existe en dst se deja como está, así se puede retomar. Si el
+    sistema de archivos no permite el hardlink, el archivo se copia.
+    """
+    os.makedirs(dst, exist_ok=True)
+    with os.scandir(src) as it:
+        for entry in it:
+            target = os.path.join(dst, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                if not os.path.lexists(target):
+                    os.mkdir(target)
+                elif os.path.islink(target) or not os.path.isdir(target):
+                    continue
+                link_tree(entry.path, target)
+            elif os.path.lexists(target):
+                continue
+            elif entry.is_symlink():
+                os.symlink(os.readlink(entry.path), target)
+                shutil.copystat(entry.path, target, follow_symlinks=False)
+            else:
+                try:
+                    os.link(entry.path, target)
+                except OSError:
+                    shutil.copy2(entry.path, target)
+    # Fechas del directorio al final: crear adentro las modifica
+    shutil.copystat(src, dst)
+
+
+def incremental_copy(src, dst, previous, engine=None, exclude=None, journal=None):
+    """Sincroniza dst con src copiando solo las entradas que cambiaron
+
+    previous es el índice {ruta: entrada} del último guardado. Un archivo con
+    el mismo tamaño, mtime_ns e inodo que sigue en dst se da por igual sin
+    leerlo; si cambió
+    solo la metadata pero el hash coincide, se actualizan permisos y fechas.
+    Lo que exclude deja afuera se borra de dst si estaba de antes. Con
+    journal se anotan los archivos a copiar y cada uno al terminar (ver
+    Journal.resume_index).
+    Devuelve (índice nuevo, estadísticas).
+    """
+    engine = engine or TreeEngine(1)
+    src = Path(src)
+    dst = Path(dst)
+    dst.mkdir(parents=True, exist_ok=True)
+    stats = {"copied": 0, "updated": 0, "deleted": 0, "skipped": 0, "bytes": 0, "bytes_copied": 0}
+    current = {}
+    touched_dirs = []
+    to_copy = []
+
+    for rel, entry in scan_tree(src, exclude=exclude):
+        item = index_entry(entry, entry.stat(follow_symlinks=False))
+        if item is None:
+            continue
+        current[rel] = item
+        old = previous.get(rel)
+        target = dst / rel
+
+        if old is not None and old["type"] != item["type"]:
+            # Cambió el tipo de entrada: borrar la anterior
+            if old["type"] == "dir":
+                engine.remove_tree(target)
+            elif os.path.lexists(target):
+                target.unlink()
+            old = None
+
+        # El índice solo sirve si la entrada sigue en dst: lo que se borró del
+        # guardado se vuelve a copiar
+        if old is not None and not os.path.lexists(target):
+            old = None
+
+        if item["type"] == "dir":
+            if old is None:
+                target.mkdir(exist_ok=True)
+            if old is None or old["mtime_ns"] != item["mtime_ns"] or old["mode"] != item["mode"]:
+                touched_dirs.append((target, item))
+            continue
+
+        if item["type"] == "symlink":
+            if old is None or old["target"] != item["target"]:
+                if os.path.lexists(target):
+                    target.unlink()
+                os.symlink(item["target"], target)
+                stats["copied"] += 1
+            else:
+                stats["skipped"] += 1
+            continue
+
+        stats["bytes"] += item["size"]
+        if (old is not None and old["size"] == item["size"]
+                and old["mtime_ns"] == item["mtime_ns"] and old["inode"] == item["inode"]
+                and old["mode"] == item["mode"]):
+            item["sha256"] = old["sha256"]
+            stats["skipped"] += 1
+            continue
+
+        to_copy.append((entry.path, target, item, old))
+
+    if journal is not None:
+        journal.plan([os.path.relpath(target, dst) for _, target, _, _ in to_copy])
+
+    def sync_file(task):
+        src_path, target, item, old = task
+        item["sha256"] = hash_file(src_path)
+        same = old is not None and old.get("sha256") == item["sha256"] and target.exists()
+        if same and os.stat(target).st_nlink == 1:
+            shutil.copystat(src_path, target)
+        else:
+            # Un archivo enlazado a otro árbol (ver link_tree) no se toca en el lugar
+            if os.path.lexists(target):
+                target.unlink()
+            engine.copy_file(src_path, target)
+        copied = not same
+        if journal is not None:
+            journal.mark_done(os.path.relpath(target, dst), item)
+        return copied
+
+    for (_, _, item, _), copied in zip(to_copy, engine.map(sync_file, to_copy)):
+        if copied:
+            stats["copied"] += 1
+            stats["bytes_copied"] += item["size"]
+        else:
+            stats["updated"] += 1
+
+    # Borrar lo que ya no existe en el origen (lo más profundo primero)
+    for rel in sorted(set(previous) - set(current), reverse=True):
+        target = dst / rel
+        if previous[rel]["type"] == "dir":
+            if os.path.lexists(target):
+                engine.remove_tree(target)
+        elif os.path.lexists(target):
+            target.unlink()
+        stats["deleted"] += 1
+
+    # Permisos y fechas de los directorios tocados, de adentro hacia afuera
+    for target, item in reversed(touched_dirs):
+        os.chmod(target, item["mode"])
+        os.utime(target, ns=(item["mtime_ns"], item["mtime_ns"]))
+    shutil.copystat(src, dst)
+
+    return current, stats
+
+
+class HashingReader:
+    """Envoltorio de archivo que calcula el SHA-256 de lo que se lee"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+class CountingWriter:
+    """Envoltorio de archivo que cuenta los bytes escritos y calcula su SHA-256"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+        self.hasher = hashlib.sha256()
+
+    def write(self, data):
+        self.count += len(data)
+        self.hasher.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+def archive_format(path):
+    """Devuelve el formato de archivo comprimido según la extensión (o None)"""
+    for fmt in ARCHIVE_FORMATS:
+        if path.name.endswith("." + fmt):
+            return fmt
+    return None
+
+
+def _open_tar_stream(fileobj, fmt, mode):
+    """Abre un tar en modo stream ('w' o 'r') con la compresión de fmt
+
+    Devuelve (tar, stream intermedio a cerrar o None).
+    """
+    compression = fmt.split(".", 1)[1]
+    if compression != "zst":
+        return tarfile.open(fileobj=fileobj, mode=f"{mode}|{compression}"), None
+    if "zst" in getattr(tarfile.TarFile, "OPEN_METH", {}):
+        # Python 3.14+ trae zstd en la biblioteca estándar
+        return tarfile.open(fileobj=fileobj, mode=f"{mode}|zst"), None
+    if zstandard is None:
+        raise RuntimeError("El formato tar.zst necesita el paquete 'zstandard' (pip install zstandard)")
+    if mode == "w":
+        stream = zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False)
+    else:
+        stream = zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+    return tarfile.open(fileobj=stream, mode=f"{mode}|"), stream
+
+
+def write_archive(src_dir, archive_path, fmt, exclude=None):
+    """Escribe src_dir como tar comprimido en un solo recorrido
+
+    Los bytes originales y comprimidos se cuentan mientras se escribe, sin
+    una segunda pasada sobre el árbol ni sobre el archivo. Las estadísticas
+    incluyen las entradas con su hash y el SHA-256 del archivo comprimido.
+    """
+    archive_path = Path(archive_path)
+    tmp = archive_path.with_name(f".{archive_path.name}.tmp{os.getpid()}")
+    stats = {"file_count": 0, "bytes": 0, "compressed_bytes": 0}
+    entries = []
+
+    try:
+        with open(tmp, 'wb') as raw:
+            counter = CountingWriter(raw)
+            tar, stream = _open_tar_stream(counter, fmt, "w")
+            with tar:
+                tar.add(src_dir, arcname=".", recursive=False)
+                for rel, entry in scan_tree(src_dir, exclude=exclude):
+                    if not (entry.is_dir() or entry.is_file() or entry.is_symlink()):
+                        continue
+                    info = tar.gettarinfo(entry.path, arcname=rel)
+                    if info.isreg():
+                        with open(entry.path, 'rb') as f:
+                            reader = HashingReader(f)
+                            tar.addfile(info, reader)
+                        entries.append({"path": rel, "type": "file", "size": info.size,
+                                        "sha256": reader.hexdigest()})
+                        stats["file_count"] += 1
+                        stats["bytes"] += info.size
+                    elif info.issym():
+                        entries.append({"path": rel, "type": "symlink", "target": info.linkname})
+                        tar.addfile(info)
+                    else:
+                        entries.append({"path": rel, "type": "dir"})
+                        tar.addfile(info)
+            if stream is not None:
+                stream.close()
+            stats["compressed_bytes"] = counter.count
+            stats["sha256"] = counter.hasher.hexdigest()
+            stats["digest"] = tree_digest(entries)
+            stats["entries"] = entries
+        os.replace(tmp, archive_path)
+    except BaseException:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+    return stats
+
+
+def _extract_filter(member, path):
+    """Filtro de extracción: rutas seguras, pero conservando los permisos originales"""
+    safe = tarfile.data_filter(member, path)
+    if safe is None or member.issym():
+        return safe
+    return safe.replace(mode=member.mode & 0o777, deep=False)
+
+
+def extract_archive(archive_path, dst_dir, journal=None):
+    """Extrae un backup comprimido directo en dst_dir, leyendo en modo stream
+
+    Con journal los archivos ya extraídos en una ejecución interrumpida se
+    saltean (el stream igual se lee entero, pero no se vuelven a escribir).
+    """
+    archive_path = Path(archive_path)
+    dst_dir = Path(dst_dir)
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    stats = {"file_count": 0, "bytes": 0}
+
+    with open(archive_path, 'rb') as raw:
+        tar, stream = _open_tar_stream(raw, archive_format(archive_path), "r")
+        with tar:
+            dirs = []
+            for member in tar:
+                member = _extract_filter(member, str(dst_dir))
+                if member is None:
+                    continue
+                if member.isdir():
+                    dirs.append(member)
+                    # Permisos y fechas de directorios al final
+                    tar.extract(member.replace(mode=0o700, deep=False), dst_dir, filter='fully_trusted')
+                    continue
+                if member.isreg():
+                    stats["file_count"] += 1
+                    stats["bytes"] += member.size
+                    if journal is not None and journal.is_done(member.name):
+                        continue
+                tar.extract(member, dst_dir, filter='fully_trusted')
+                if journal is not None and member.isreg():
+                    journal.mark_done(member.name)
+            for member in reversed(dirs):
+                target = dst_dir / member.name
+                os.chmod(target, member.mode)
+                os.utime(target, (member.mtime, member.mtime))
+        if stream is not None:
+            stream.close()
+    return stats
+
+
+def scan_archive(archive_path):
+    """Lee un backup comprimido en un solo paso y devuelve sus estadísticas y hash"""
+    archive_path = Path(archive_path)
+    entries = []
+    with open(archive_path, 'rb') as raw:
+        tar, stream = _open_tar_stream(raw, archive_format(archive_path), "r")
+        with tar:
+            for member in tar:
+                if member.name == ".":
+                    continue
+                if member.isreg():
+                    reader = HashingReader(tar.extractfile(member))
+                    for _ in iter(lambda: reader.read(CHUNK_SIZE), b''):
+                        pass
+                    entries.append({"path": member.name, "type": "file", "size": member.size,
+                                    "sha256": reader.hexdigest()})
+                elif member.issym():
+                    entries.append({"path": member.name, "type": "symlink", "target": member.linkname})
+                elif member.isdir():
+                    entries.append({"path": member.name, "type": "dir"})
+        if stream is not None:
+            stream.close()
+    files = [e for e in entries if e["type"] == "file"]
+    return {"file_count": len(files), "bytes": sum(e["size"] for e in files),
+            "compressed_bytes": archive_path.stat().st_size, "digest": tree_digest(entries)}
+
+
+def verify_files(tasks, deep=False, engine=None, verified=None):
+    """Verifica archivos contra su manifiesto en paralelo
+
+    tasks es una lista de (ruta relativa, ruta real, tamaño, mtime_ns, sha256).
+    En modo rápido un archivo con el mismo tamaño y mtime se da por bueno sin
+    leerlo (con mtime None alcanza con el tamaño) y solo se rehashean los que
+    cambiaron de fecha; en modo profundo se rehashean todos. verified guarda
+    los resultados por ruta para no releer blobs compartidos entre snapshots.
+    Devuelve la lista de problemas [{path, problem}].
+    """
+    engine = engine or TreeEngine(1)
+    verified = {} if verified is None else verified
+
+    def check(task):
+        _, path, size, mtime_ns, digest = task
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return "falta"
+        if st.st_size != size:
+            return "tamaño distinto"
+        if not deep and (mtime_ns is None or st.st_mtime_ns == mtime_ns):
+            return None
+        key = str(path)
+        if key not in verified:
+            verified[key] = None if hash_file(path) == digest else "hash distinto"
+        return verified[key]
+
+    problems = []
+    for task, problem in zip(tasks, engine.map(check, tasks)):
+        if problem:
+            problems.append({"path": task[0], "problem": problem})
+    return problems
+
+
+CHANNEL_DIR = "xfconf/xfce-perchannel-xml"
+
+
+def is_channel_path(rel):
+    """Indica si una ruta relativa a xfce4/ es el XML de un canal xfconf"""
+    return rel.startswith(CHANNEL_DIR + "/") and rel.endswith(".xml")
+
+
+def parse_xfconf_channel(data):
+    """Convierte el XML de un canal xfconf en {ruta de propiedad: (tipo, valor)}
+
+    Los arrays se representan como lista de [tipo, valor]. Los nodos "empty"
+    que solo agrupan otras propiedades no se incluyen.
+    """
+    root = ET.fromstring(data)
+    props = {}
+
+    def walk(element, prefix):
+        for prop in element.findall("property"):
+            path = f"{prefix}/{prop.get('name')}"
+            ptype = prop.get("type")
+            children = prop.findall("property")
+            if ptype == "array":
+                props[path] = (ptype, [[v.get("type"), v.get("value")] for v in prop.findall("value")])
+            elif ptype != "empty" or not children:
+                props[path] = (ptype, prop.get("value"))
+            walk(prop, path)
+
+    walk(root, "")
+    return props
+
+
+def tree_channels(root):
+    """Canales xfconf de un árbol: {canal: (hash, función que devuelve el XML)}"""
+    channel_dir = Path(root) / CHANNEL_DIR
+    channels = {}
+    if not channel_dir.is_dir():
+        return channels
+    for entry in os.scandir(channel_dir):
+        if not entry.name.endswith(".xml") or not entry.is_file():
+            continue
+        digest = hash_file(entry.path)
+        channels[entry.name[:-4]] = (digest, lambda path=entry.path: Path(path).read_bytes())
+    return channels
+
+
+def archive_channels(archive_path):
+    """Canales xfconf de un backup comprimido (se leen en una pasada del stream)"""
+    archive_path = Path(archive_path)
+    channels = {}
+    with open(archive_path, 'rb') as raw:
+        tar, stream = _open_tar_stream(raw, archive_format(archive_path), "r")
+        with tar:
+            for member in tar:
+                directory, _, name = member.name.rpartition("/")
+                if member.isreg() and directory == CHANNEL_DIR and name.endswith(".xml"):
+                    data = tar.extractfile(member).read()
+                    channels[name[:-4]] = (hashlib.sha256(data).hexdigest(), lambda data=data: data)
+        if stream is not None:
+            stream.close()
+    return channels
+
+
+def diff_channels(old, new):
+    """Diferencias de propiedades entre dos conjuntos de canales
+
+    Los canales con el mismo hash se saltan sin parsearlos. Devuelve una lista
+    de cambios {channel, property, change, old, new} con change en
+    added/removed/changed y old/new como [tipo, valor].
+    """
+    changes = []
+    for channel in sorted(old.keys() | new.keys()):
+        old_digest, old_read = old.get(channel, (None, None))
+        new_digest, new_read = new.get(channel, (None, None))
+        if old_digest == new_digest:
+            continue
+
+        old_props = parse_xfconf_channel(old_read()) if old_read else {}
+        new_props = parse_xfconf_channel(new_read()) if new_read else {}
+        changes.extend(diff_properties(channel, old_props, new_props))
+    return changes
+
+
+def _comparable(value):
+    """Normaliza [tipo, valor] para comparar (p. ej. "1.5" y "1.500000" son iguales)"""
+    if value is None:
+        return None
+    ptype, content = value
+    if ptype == "array":
+        return (ptype, tuple(_comparable(v) for v in content))
+    try:
+        if ptype in ("double", "float"):
+            return (ptype, float(content))
+        if ptype in ("int", "uint", "int64", "uint64", "uchar", "int16", "uint16"):
+            return (ptype, int(content))
+        if ptype == "bool":
+            return (ptype, str(content).lower() == "true")
+    except (TypeError, ValueError):
+        pass
+    return (ptype, content)
+
+
+def diff_properties(channel, old_props, new_props):
+    """Diferencias entre dos mapas {propiedad: (tipo, valor)} de un mismo canal"""
+    changes = []
+    for prop in sorted(old_props.keys() | new_props.keys()):
+        before = old_props.get(prop)
+        after = new_props.get(prop)
+        if _comparable(before) == _comparable(after):
+            continue
+        change = "changed"
+        if before is None:
+            change = "added"
+        elif after is None:
+            change = "removed"
+        changes.append({
+            "channel": channel,
+            "property": prop,
+            "change": change,
+            "old": list(before) if before else None,
+            "new": list(after) if after else None,
+        })
+    return changes
+
+
+def format_property_value(value):
+    """Representación corta de [tipo, valor] para mostrar diferencias"""
+    if value is None:
+        return "-"
+    ptype, content = value
+    if ptype == "array":
+        return f"{ptype} [" + ", ".join(str(v) for _, v in content) + "]"
+    return f"{ptype} {content!r}"
+
+
+def merge_channel_xml(base, overlay):
+    """Mezcla dos XML de canal xfconf a nivel de propiedad, devuelve el XML resultante
+
+    Las propiedades del overlay reemplazan tipo y valor de las del base con
+    el mismo nombre (los arrays se reemplazan enteros) y las que no existen
+    se agregan. Un nodo "empty" del overlay solo agrupa: no cambia el valor
+    del base. Lo que el overlay no menciona queda como estaba.
+    """
+    root = ET.fromstring(base)
+
+    def merge(target, source):
+        existing = {p.get("name"): p for p in target.findall("property")}
+        for prop in source.findall("property"):
+            current = existing.get(prop.get("name"))
+            if current is None:
+                target.append(copy.deepcopy(prop))
+                continue
+            if prop.get("type") != "empty":
+                current.set("type", prop.get("type"))
+                if prop.get("value") is None:
+                    current.attrib.pop("value", None)
+                else:
+                    current.set("value", prop.get("value"))
+                for value in current.findall("value"):
+                    current.remove(value)
+                for i, value in enumerate(prop.findall("value")):
+                    current.insert(i, copy.deepcopy(value))
+            merge(current, prop)
+
+    merge(root, ET.fromstring(overlay))
+    ET.indent(root, space="  ")
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n\n' + ET.tostring(root, encoding="unicode") + "\n").encode()
+
+
+def compose_layers(layers, dst, engine=None):
+    """Arma en dst (que no debe existir) la composición de varias capas
+
+    La primera capa es la base y cada una pisa a las anteriores archivo por
+    archivo, salvo los canales xfconf (xfconf/xfce-perchannel-xml/*.xml)
+    que se mezclan por propiedad. Devuelve la cantidad de canales mezclados.
+    """
+    engine = engine or TreeEngine(1)
+    dst = Path(dst)
+    dst.mkdir(parents=True)
+    merged = 0
+
+    for layer in layers:
+        dirs = [(layer, dst)]
+        files = []
+        for rel, entry in scan_tree(layer):
+            target = dst / rel
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if os.path.lexists(target) and (is_dir != (target.is_dir() and not target.is_symlink())):
+                # Cambió el tipo de entrada entre capas
+                engine.remove_tree(target)
+            if is_dir:
+                target.mkdir(exist_ok=True)
+                dirs.append((entry.path, target))
+                continue
+
+            if is_channel_path(rel) and entry.is_file() and target.is_file() and not target.is_symlink():
+                with open(target, 'rb') as f:
+                    base = f.read()
+                with open(entry.path, 'rb') as f:
+                    overlay = f.read()
+                with open(target, 'wb') as f:
+                    f.write(merge_channel_xml(base, overlay))
+                shutil.copystat(entry.path, target)
+                merged += 1
+                continue
+
+            if os.path.lexists(target):
+                target.unlink()
+            if entry.is_symlink():
+                os.symlink(os.readlink(entry.path), target)
+            else:
+                files.append((entry.path, target))
+
+        engine.map(lambda pair: engine.copy_file(*pair), files)
+        for src_dir, dst_dir in reversed(dirs):
+            shutil.copystat(src_dir, dst_dir)
+
+    return merged
+
+
+class XfconfBackend:
+    """Acceso a las propiedades de xfconfd (interfaz)
+
+    read_channel devuelve {propiedad: (tipo, valor)} como parse_xfconf_channel
+    y apply recibe una tanda de cambios de diff_properties y los aplica juntos.
+    Un valor nuevo None o de tipo "empty" significa resetear la propiedad.
+    """
+
+    name = "base"
+
+    def read_channel(self, channel):
+        raise NotImplementedError
+
+    def apply(self, changes):
+        raise NotImplementedError
+
+
+class MemoryXfconfBackend(XfconfBackend):
+    """Backend en memoria: sirve de xfconfd falso para pruebas"""
+
+    name = "memory"
+
+    def __init__(self, channels=None):
+        self.channels = {ch: dict(props) for ch, props in (channels or {}).items()}
+        self.batches = []
+
+    def read_channel(self, channel):
+        return dict(self.channels.get(channel, {}))
+
+    def apply(self, changes):
+        self.batches.append(list(changes))
+        for c in changes:
+            props = self.channels.setdefault(c["channel"], {})
+            if c["new"] is None:
+                props.pop(c["property"], None)
+            else:
+                props[c["property"]] = tuple(c["new"])
+        return len(changes)
+
+
+class XfconfQueryBackend(XfconfBackend):
+    """Backend con xfconf-query: los cambios se mandan en un solo script de shell
+
+    El estado actual se lee de los XML que xfconfd mantiene en disco.
+    """
+
+    name = "xfconf-query"
+
+    def __init__(self, config_path):
+        self.channel_dir = Path(config_path) / CHANNEL_DIR
+
+    def read_channel(self, channel):
+        path = self.channel_dir / f"{channel}.xml"
+        return parse_xfconf_channel(path.read_bytes()) if path.exists() else {}
+
+    def command(self, change):
+        """Línea de xfconf-query para un cambio"""
+        base = ["xfconf-query", "-c", change["channel"], "-p", change["property"]]
+        if change["new"] is None or change["new"][0] == "empty":
+            return base + ["-r"]
+        ptype, value = change["new"]
+        if ptype == "array":
+            args = base + ["-n", "--force-array"]
+            for item_type, item_value in value:
+                args += ["-t", item_type, "-s", item_value]
+            return args
+        return base + ["-n", "-t", ptype, "-s", value]
+
+    def apply(self, changes):
+        if not changes:
+            return 0
+        script = "\n".join(shlex.join(self.command(c)) for c in changes)
+        subprocess.run(["sh", "-e", "-c", script], check=True)
+        return len(changes)
+
+
+class DBusXfconfBackend(XfconfBackend):
+    """Backend por D-Bus (org.xfce.Xfconf) con una sola conexión; necesita PyGObject"""
+
+    name = "dbus"
+    SIGNATURES = {"string": "s", "int": "i", "uint": "u", "bool": "b", "double": "d",
+                  "float": "d", "int64": "x", "uint64": "t", "uchar": "y",
+                  "int16": "n", "uint16": "q"}
+
+    def __init__(self):
+        from gi.repository import Gio, GLib
+        self.Gio, self.GLib = Gio, GLib
+        bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+        self.proxy = Gio.DBusProxy.new_sync(bus, Gio.DBusProxyFlags.NONE, None, "org.xfce.Xfconf",
+                                            "/org/xfce/Xfconf", "org.xfce.Xfconf", None)
+        self.type_names = {sig: name for name, sig in self.SIGNATURES.items() if name != "float"}
+
+    def _call(self, method, signature, args):
+        return self.proxy.call_sync(method, self.GLib.Variant(signature, args), 0, -1, None)
+
+    def _to_variant(self, ptype, value):
+        if ptype == "array":
+            return self.GLib.Variant("av", [self._to_variant(t, v) for t, v in value])
+        sig = self.SIGNATURES[ptype]
+        if sig == "b":
+            content = str(value).lower() == "true"
+        elif sig == "d":
+            content = float(value)
+        elif sig == "s":
+            content = value
+        else:
+            content = int(value)
+        return self.GLib.Variant(sig, content)
+
+    def _from_variant(self, variant):
+        sig = variant.get_type_string()
+        if sig == "av":
+            items = [self._from_variant(variant.get_child_value(i).get_variant())
+                     for i in range(variant.n_children())]
+            return ("array", [list(item) for item in items])
+        content = variant.unpack()
+        if sig == "b":
+            content = "true" if content else "false"
+        return (self.type_names.get(sig, "string"), str(content))
+
+    def read_channel(self, channel):
+        try:
+            reply = self._call("GetAllProperties", "(ss)", (channel, "/"))
+        except self.GLib.Error as exc:
+            # xfconfd responde con error a un canal que todavía no existe:
+            # igual que los otros backends, eso es un canal vacío
+            if "NotFound" not in (self.Gio.DBusError.get_remote_error(exc) or ""):
+                raise
+            return {}
+        props = {}
+        entries = reply.get_child_value(0)
+        for i in range(entries.n_children()):
+            entry = entries.get_child_value(i)
+            key = entry.get_child_value(0).get_string()
+            props[key] = self._from_variant(entry.get_child_value(1).get_variant())
+        return props
+
+    def apply(self, changes):
+        applied = 0
+        for c in changes:
+            if c["new"] is None or c["new"][0] == "empty":
+                self._call("ResetProperty", "(ssb)", (c["channel"], c["property"], False))
+            else:
+                variant = self._to_variant(*c["new"])
+                self._call("SetProperty", "(ssv)", (c["channel"], c["property"], variant))
+            applied += 1
+        return applied
+
+
+def make_xfconf_backend(name, config_path):
+    """Crea el backend de xfconf pedido ("auto" elige D-Bus si hay PyGObject)"""
+    if name in ("auto", "dbus"):
+        try:
+            return DBusXfconfBackend()
+        except Exception:
+            if name == "dbus":
+                raise
+    if name in ("auto", "xfconf-query"):
+        if shutil.which("xfconf-query") is None:
+            raise RuntimeError("No se encontró xfconf-query ni PyGObject para aplicar cambios en vivo")
+        return XfconfQueryBackend(config_path)
+    raise ValueError(f"backend de xfconf desconocido: {name}")
+
+
+SYNC_CHUNK_MIN = 2 * 1024
+SYNC_CHUNK_MAX = 64 * 1024
+# Un corte cada 2^13 bytes en promedio (~8 KiB)
+SYNC_CHUNK_BITS = 13
+# Trozos por tanda al subir o bajar, y entradas que se recuerdan en la caché de cortes
+SYNC_BATCH = 256
+SYNC_CACHE_ENTRIES = 20000
+_SYNC_MASK = ((1 << SYNC_CHUNK_BITS) - 1) << (64 - SYNC_CHUNK_BITS)
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "little") for i in range(256)]
+
+
+def content_chunks(data):
+    """Corta data en trozos definidos por contenido, devuelve [(inicio, tamaño)]
+
+    Usa un hash rodante tipo gear: se corta donde los bits altos del hash
+    son cero, así un cambio en el medio de un archivo solo mueve los cortes
+    cercanos y el resto de los trozos se mantiene igual entre versiones.
+    """
+    chunks = []
+    start = 0
+    size = len(data)
+    while start < size:
+        end = min(size, start + SYNC_CHUNK_MAX)
+        cut = end
+        h = 0
+        # Los primeros SYNC_CHUNK_MIN bytes nunca cortan: no hace falta hashearlos
+        for i in range(start + SYNC_CHUNK_MIN, end):
+            h = ((h << 1) + _GEAR[data[i]]) & 0xFFFFFFFFFFFFFFFF
+            if not h & _SYNC_MASK:
+                cut = i + 1
+                break
+        chunks.append((start, cut - start))
+        start = cut
+    return chunks
+
+
+def file_chunks(path, cache):
+    """Devuelve (sha256, [[hash de trozo, tamaño], ...]) de un archivo
+
+    cache ({sha256: trozos}) evita volver a cortar archivos ya conocidos.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    chunks = cache.get(digest)
+    if chunks is None:
+        chunks = [[hashlib.sha256(data[offset:offset + size]).hexdigest(), size]
+                  for offset, size in content_chunks(data)]
+        cache[digest] = chunks
+    return digest, chunks
+
+
+def read_chunk(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def check_sync_name(name):
+    """Valida el nombre de un snapshot del repositorio de sync"""
+    if not name or "/" in name or name.startswith("."):
+        raise ConfigManagerError(f"Nombre de snapshot inválido: '{name}'")
+    return name
+
+
+SYNC_DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+
+def symlink_inside(path, target, links):
+    """Si el symlink path -> target queda dentro del árbol
+
+    Se resuelve componente por componente: no puede ser absoluto, subir más
+    allá de la raíz ni pasar a través de otro symlink de links (que podría
+    apuntar más arriba de lo que su nombre aparenta).
+    """
+    if not target or target.startswith("/"):
+        return False
+    parts = path.split("/")[:-1]
+    components = target.split("/")
+    for i, part in enumerate(components):
+        if part == "..":
+            if not parts:
+                return False
+            parts.pop()
+        elif part not in ("", "."):
+            parts.append(part)
+            if i < len(components) - 1 and "/".join(parts) in links:
+                return False
+    return True
+
+
+def check_sync_manifest(manifest):
+    """Valida un manifiesto bajado del repositorio antes de escribir nada
+
+    El repositorio es compartido, así que sus rutas no son de confianza:
+    como tarfile.data_filter con los backups comprimidos, se rechazan rutas
+    absolutas o con "..", entradas dentro de un symlink o de algo que no es
+    un directorio del mismo manifiesto, y symlinks absolutos o que salen
+    del árbol. Los directorios tienen que venir antes que su contenido.
+    """
+    dirs = {""}
+    seen = set()
+    try:
+        links = {item["path"] for item in manifest["entries"] if item["type"] == "symlink"}
+        for item in manifest["entries"]:
+            path, kind = item["path"], item["type"]
+            if (not isinstance(path, str) or path in ("", ".") or path.startswith("/")
+                    or os.path.normpath(path) != path or ".." in path.split("/")):
+                raise ConfigManagerError(f"Ruta insegura en el snapshot: {path!r}")
+            if path in seen or os.path.dirname(path) not in dirs:
+                raise ConfigManagerError(f"Ruta fuera de un directorio del snapshot: {path!r}")
+            seen.add(path)
+            if not isinstance(item["mode"], int) or not isinstance(item["mtime_ns"], int):
+                raise ConfigManagerError(f"Metadatos inválidos en el snapshot: {path!r}")
+            if kind == "dir":
+                dirs.add(path)
+            elif kind == "symlink":
+                target = item["target"]
+                if not isinstance(target, str) or not symlink_inside(path, target, links):
+                    raise ConfigManagerError(f"Symlink inseguro en el snapshot: {path!r} -> {target!r}")
+            elif kind == "file":
+                digests = [item["sha256"]] + [digest for digest, _ in item["chunks"]]
+                if not all(isinstance(d, str) and SYNC_DIGEST_RE.fullmatch(d) for d in digests):
+                    raise ConfigManagerError(f"Hash inválido en el snapshot: {path!r}")
+            else:
+                raise ConfigManagerError(f"Tipo de entrada desconocido en el snapshot: {path!r}")
+    except (KeyError, TypeError, ValueError, AttributeError) as exc:
+        raise ConfigManagerError(f"Manifiesto de sync inválido: {exc!r}") from None
+    return manifest
+
+
+class SyncTransport:
+    """Repositorio de snapshots para push/pull
+
+    Layout: snapshots/<nombre>.json (manifiestos con la lista de trozos de
+    cada archivo) y chunks/xx/<hash> (trozos). Las operaciones trabajan por
+    tandas para hacer pocas idas y vueltas con el repositorio.
+    """
+
+    def list_snapshots(self):
+        raise NotImplementedError
+
+    def get_manifest(self, name):
+        """Manifiesto de un snapshot (None si no existe)"""
+        raise NotImplementedError
+
+    def put_manifest(self, name, manifest):
+        raise NotImplementedError
+
+    def missing_chunks(self, digests):
+        """Subconjunto de digests que el repositorio no tiene"""
+        raise NotImplementedError
+
+    def get_chunks(self, digests):
+        """{hash: bytes} de los trozos pedidos"""
+        raise NotImplementedError
+
+    def put_chunks(self, chunks):
+        """Sube {hash: bytes}"""
+        raise NotImplementedError
+
+    @staticmethod
+    def chunk_name(digest):
+        return f"{digest[:2]}/{digest[2:]}"
+
+
+class LocalSyncTransport(SyncTransport):
+    """Repositorio en un directorio (disco compartido, NFS o pruebas)"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def list_snapshots(self):
+        snapshots = self.root / "snapshots"
+        if not snapshots.exists():
+            return []
+        return sorted(p.stem for p in snapshots.glob("*.json"))
+
+    def get_manifest(self, name):
+        path = self.root / "snapshots" / f"{check_sync_name(name)}.json"
+        if not path.exists():
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def put_manifest(self, name, manifest):
+        (self.root / "snapshots").mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.root / "snapshots" / f"{check_sync_name(name)}.json", manifest)
+
+    def missing_chunks(self, digests):
+        return {d for d in digests if not (self.root / "chunks" / self.chunk_name(d)).exists()}
+
+    def get_chunks(self, digests):
+        chunks = {}
+        for digest in digests:
+            with open(self.root / "chunks" / self.chunk_name(digest), 'rb') as f:
+                chunks[digest] = f.read()
+        return chunks
+
+    def put_chunks(self, chunks):
+        for digest, data in chunks.items():
+            path = self.root / "chunks" / self.chunk_name(digest)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.tmp{os.getpid()}")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+
+
+class SSHSyncTransport(SyncTransport):
+    """Repositorio en otra máquina por SSH (solo necesita sh, find y tar del otro lado)
+
+    Los trozos viajan en un único tar por tanda en cada sentido.
+    """
+
+    def __init__(self, host, path, port=None):
+        self.host = host
+        self.path = path
+        self.port = port
+
+    def run(self, script, data=None):
+        command = ["ssh", "-o", "BatchMode=yes"]
+        if self.port:
+            command += ["-p", str(self.port)]
+        command += [self.host, f"mkdir -p {shlex.quote(self.path)} && cd {shlex.quote(self.path)} && {script}"]
+        return subprocess.run(command, input=data, capture_output=True, check=True).stdout
+
+    def list_snapshots(self):
+        output = self.run("ls snapshots 2>/dev/null || true").decode()
+        return sorted(line[:-5] for line in output.split() if line.endswith(".json"))
+
+    def get_manifest(self, name):
+        path = shlex.quote(f"snapshots/{check_sync_name(name)}.json")
+        output = self.run(f"if [ -f {path} ]; then cat {path}; fi")
+        return json.loads(output) if output else None
+
+    def put_manifest(self, name, manifest):
+        path = shlex.quote(f"snapshots/{check_sync_name(name)}.json")
+        self.run(f"mkdir -p snapshots && cat > {path}.tmp && mv {path}.tmp {path}",
+                 json.dumps(manifest, indent=1).encode())
+
+    def missing_chunks(self, digests):
+        output = self.run("find chunks -type f 2>/dev/null || true").decode()
+        remote = {"".join(line.split("/")[-2:]) for line in output.split()}
+        return set(digests) - remote
+
+    def get_chunks(self, digests):
+        if not digests:
+            return {}
+        names = "\n".join(self.chunk_name(d) for d in digests).encode()
+        output = self.run("tar -c -C chunks -T -", names)
+        chunks = {}
+        with tarfile.open(fileobj=io.BytesIO(output)) as tar:
+            for member in tar:
+                if member.isreg():
+                    chunks[member.name.replace("/", "")] = tar.extractfile(member).read()
+        return chunks
+
+    def put_chunks(self, chunks):
+        if not chunks:
+            return
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for digest, data in chunks.items():
+                info = tarfile.TarInfo(self.chunk_name(digest))
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        self.run("mkdir -p chunks && tar -x -C chunks", buffer.getvalue())
+
+
+class HTTPSyncTransport(SyncTransport):
+    """Repositorio HTTP: GET para leer y PUT para escribir (por ejemplo WebDAV)
+
+    Como HTTP no lista directorios, el push mantiene snapshots/index.json.
+    Los trozos se piden y suben en paralelo.
+    """
+
+    def __init__(self, url, workers=8):
+        self.url = url.rstrip("/")
+        self.workers = workers
+
+    def request(self, method, path, data=None):
+        req = urllib.request.Request(f"{self.url}/{path}", data=data, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise ConfigManagerError(f"{method} {self.url}/{path}: HTTP {e.code}")
+        except urllib.error.URLError as e:
+            raise ConfigManagerError(f"{method} {self.url}/{path}: {e.reason}")
+
+    def map(self, func, items):
+        items = list(items)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(items)))) as pool:
+            return list(pool.map(func, items))
+
+    def list_snapshots(self):
+        data = self.request("GET", "snapshots/index.json")
+        return sorted(json.loads(data)) if data else []
+
+    def get_manifest(self, name):
+        data = self.request("GET", f"snapshots/{check_sync_name(name)}.json")
+        return json.loads(data) if data else None
+
+    def put_manifest(self, name, manifest):
+        self.request("PUT", f"snapshots/{check_sync_name(name)}.json", json.dumps(manifest, indent=1).encode())
+        index = set(self.list_snapshots()) | {name}
+        self.request("PUT", "snapshots/index.json", json.dumps(sorted(index)).encode())
+
+    def missing_chunks(self, digests):
+        digests = list(digests)
+        found = self.map(lambda d: self.request("HEAD", f"chunks/{self.chunk_name(d)}") is not None, digests)
+        return {d for d, exists in zip(digests, found) if not exists}
+
+    def get_chunks(self, digests):
+        digests = list(digests)
+        data = self.map(lambda d: self.request("GET", f"chunks/{self.chunk_name(d)}"), digests)
+        missing = [d for d, chunk in zip(digests, data) if chunk is None]
+        if missing:
+            raise ConfigManagerError(f"Faltan {len(missing)} trozo(s) en el repositorio")
+        return dict(zip(digests, data))
+
+    def put_chunks(self, chunks):
+        self.map(lambda item: self.request("PUT", f"chunks/{self.chunk_name(item[0])}", item[1]),
+                 chunks.items())
+
+
+def make_sync_transport(remote):
+    """Transporte según la URL: ruta o file://, ssh://host/ruta, host:ruta o http(s)://"""
+    if remote.startswith(("http://", "https://")):
+        return HTTPSyncTransport(remote)
+    if remote.startswith("file://"):
+        return LocalSyncTransport(urllib.parse.urlparse(remote).path)
+    if remote.startswith("ssh://"):
+        url = urllib.parse.urlparse(remote)
+        host = f"{url.username}@{url.hostname}" if url.username else url.hostname
+        return SSHSyncTransport(host, url.path or ".", url.port)
+    host, sep, path = remote.partition(":")
+    if sep and "/" not in host:
+        return SSHSyncTransport(host, path or ".")
+    return LocalSyncTransport(remote)
+
+
+class InotifyWatcher:
+    """Vigila un árbol de forma recursiva con inotify (vía ctypes)"""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, root, exclude=None):
+        self.root = Path(root)
+        self.exclude = exclude
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        self.watches = {}
+        self.add_tree(self.root)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK | self.IN_ONLYDIR)
+        if wd < 0:
+            return
+        self.watches[wd] = Path(path)
+
+    def add_tree(self, path):
+        """Agrega watches a un directorio y a sus subdirectorios no excluidos"""
+        if not Path(path).is_dir():
+            return
+        rel = os.path.relpath(path, self.root)
+        rel = "" if rel == "." else rel
+        if rel and self.exclude and self.exclude.excluded_path(rel, True):
+            return
+        self.add_watch(path)
+        for _, entry in scan_tree(path, rel, self.exclude):
+            if entry.is_dir(follow_symlinks=False):
+                self.add_watch(entry.path)
+
+    def read_events(self, timeout):
+        """Espera hasta timeout segundos y devuelve las rutas que cambiaron
+
+        Se agregan watches a los directorios nuevos; si el propio árbol se
+        reemplaza (restore atómico) se vuelve a vigilar desde la raíz.
+        Un desborde de la cola del kernel se informa como la raíz.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        rewatch_root = False
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                paths.append(self.root)
+                continue
+            directory = self.watches.get(wd)
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF) and directory == self.root:
+                rewatch_root = True
+            path = directory / name if name else directory
+            paths.append(path)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self.add_tree(path)
+
+        if rewatch_root:
+            for wd in list(self.watches):
+                self.libc.inotify_rm_watch(self.fd, wd)
+            self.watches.clear()
+            self.add_tree(self.root)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SnapshotScheduler:
+    """Agrupa ráfagas de cambios y decide cuándo tomar el próximo snapshot
+
+    Se toma un snapshot cuando pasaron quiet_period segundos sin eventos y al
+    menos min_interval desde el anterior. Solo se recuerdan max_pending rutas:
+    el resto solo marca que hubo cambios, así la memoria queda acotada.
+    """
+
+    def __init__(self, quiet_period=2.0, min_interval=60.0, max_pending=4096, clock=time.monotonic):
+        self.quiet_period = quiet_period
+        self.min_interval = min_interval
+        self.max_pending = max_pending
+        self.clock = clock
+        self.pending = set()
+        self.dropped = 0
+        self.last_event = None
+        self.last_snapshot = None
+
+    def record(self, path):
+        """Registra un cambio"""
+        self.last_event = self.clock()
+        if len(self.pending) < self.max_pending:
+            self.pending.add(str(path))
+        elif str(path) not in self.pending:
+            self.dropped += 1
+
+    def has_changes(self):
+        return self.last_event is not None
+
+    def seconds_until_due(self):
+        """Segundos hasta que corresponda el snapshot (None si no hay cambios)"""
+        if not self.has_changes():
+            return None
+        now = self.clock()
+        wait = self.last_event + self.quiet_period - now
+        if self.last_snapshot is not None:
+            wait = max(wait, self.last_snapshot + self.min_interval - now)
+        return max(wait, 0.0)
+
+    def take(self):
+        """Marca el snapshot como tomado y devuelve (rutas pendientes, descartadas)"""
+        pending, dropped = sorted(self.pending), self.dropped
+        self.pending = set()
+        self.dropped = 0
+        self.last_event = None
+        self.last_snapshot = self.clock()
+        return pending, dropped
+
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+def exchange_paths(a, b):
+    """Intercambia dos rutas en una sola operación con renameat2(RENAME_EXCHANGE)
+
+    Devuelve False si el kernel, la libc o el sistema de archivos no lo soportan.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    result = renameat2(AT_FDCWD, os.fsencode(a), AT_FDCWD, os.fsencode(b), RENAME_EXCHANGE)
+    return result == 0
+
+
+_background_removals = {}
+
+
+def remove_tree_background(path, engine=None):
+    """Borra un árbol en un hilo aparte (el programa espera a que termine al salir)"""
+    engine = engine or TreeEngine(1)
+    path = Path(path)
+    thread = _background_removals.get(path)
+    if thread is not None and thread.is_alive():
+        return thread
+
+    def remove():
+        try:
+            engine.remove_tree(path)
+        except (OSError, RuntimeError):
+            # RuntimeError: el pool ya no acepta tareas porque el programa está terminando
+            shutil.rmtree(path, ignore_errors=True)
+
+    thread = threading.Thread(target=remove)
+    thread.start()
+    _background_removals[path] = thread
+    return thread
+
+
+class Journal:
+    """Journal de escritura anticipada de una operación sobre un árbol
+
+    Archivo JSON por línea junto al árbol (.<nombre>.journal): la primera
+    línea describe la operación, después van el plan (archivos a copiar),
+    una línea por archivo terminado y las fases. Cada línea se escribe con
+    flush y las fases con fsync, así después de una interrupción se sabe
+    qué quedó completo. Al terminar bien la operación el journal se borra.
+    """
+
+    # Entrada de índice que no coincide con ningún archivo: fuerza a revisarlo
+    DIRTY = {"type": "file", "mode": -1, "mtime_ns": -1, "size": -1, "inode": -1, "sha256": None}
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.header = {}
+        self.planned = []
+        self.done = {}
+        self.phases = []
+        self.phase_info = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def path_for(target):
+        target = Path(target)
+        return target.parent / f".{target.name}.journal"
+
+    @classmethod
+    def load(cls, path):
+        """Lee un journal existente (None si no hay); ignora una última línea cortada"""
+        journal = cls(path)
+        try:
+            with open(path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+        for n, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if n == 0:
+                journal.header = record
+            elif "planned" in record:
+                journal.planned.extend(record["planned"])
+            elif "done" in record:
+                journal.done[record["done"]] = record.get("item")
+            elif "phase" in record:
+                journal.phases.append(record.pop("phase"))
+                journal.phase_info[journal.phases[-1]] = record
+        return journal
+
+    def _write(self, record, sync=False):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def start(self, **header):
+        """Empieza un journal nuevo con la descripción de la operación"""
+        self.path.unlink(missing_ok=True)
+        self.header = dict(header, pid=os.getpid(), started=datetime.now().isoformat(timespec='seconds'))
+        self._write(self.header, sync=True)
+        return self
+
+    def plan(self, paths):
+        self.planned.extend(paths)
+        self._write({"planned": list(paths)}, sync=True)
+
+    def mark_done(self, rel, item=None):
+        self.done[rel] = item
+        self._write({"done": rel, "item": item} if item is not None else {"done": rel})
+
+    def is_done(self, rel):
+        return rel in self.done
+
+    def phase(self, name, **info):
+        self.phases.append(name)
+        self.phase_info[name] = info
+        self._write({"phase": name, **info}, sync=True)
+
+    def resume_index(self, previous):
+        """Índice para retomar un guardado: lo planeado y no terminado queda marcado
+        para revisar y lo terminado toma los datos anotados en el journal"""
+        index = dict(previous)
+        for rel in self.planned:
+            index[rel] = dict(self.DIRTY)
+        for rel, item in self.done.items():
+            if item is not None:
+                index[rel] = item
+        return index
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def finish(self):
+        """Cierra y borra el journal: la operación quedó completa (o descartada)"""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+def install_swapped(journal):
+    """Si el árbol armado ya ocupa el lugar de target (se compara el inodo)"""
+    built = journal.phase_info.get("built")
+    if built is None:
+        return False
+    try:
+        st = os.stat(journal.header["target"], follow_symlinks=False)
+    except FileNotFoundError:
+        return False
+    return (st.st_dev, st.st_ino) == (built["dev"], built["inode"])
+
+
+def discard_unswapped(journal, engine):
+    """Descarta el árbol a medio armar de una instalación que no llegó a intercambiarse"""
+    target = Path(journal.header["target"])
+    staging, old = Path(journal.header["staging"]), Path(journal.header["old"])
+    if not os.path.lexists(target) and os.path.lexists(old):
+        # Cortada entre los dos rename (sistemas sin intercambio atómico)
+        os.rename(old, target)
+    if os.path.lexists(staging):
+        engine.remove_tree(staging)
+
+
+def recover_install(journal, engine=None):
+    """Cierra una instalación interrumpida sin retomarla
+
+    Si el intercambio ya se hizo, el árbol nuevo queda y solo se borra el
+    anterior; si no, se descarta el árbol a medio armar.
+    """
+    engine = engine or TreeEngine(1)
+    staging, old = Path(journal.header["staging"]), Path(journal.header["old"])
+    if install_swapped(journal):
+        for leftover in (staging, old):
+            if os.path.lexists(leftover):
+                remove_tree_background(leftover, engine)
+    else:
+        discard_unswapped(journal, engine)
+    journal.finish()
+
+
+def rollback_install(journal, engine=None):
+    """Deshace una instalación interrumpida dejando el árbol que había antes"""
+    engine = engine or TreeEngine(1)
+    target = Path(journal.header["target"])
+    staging, old = Path(journal.header["staging"]), Path(journal.header["old"])
+    if install_swapped(journal):
+        previous = old if os.path.lexists(old) else staging
+        if journal.header.get("had_target") and not os.path.lexists(previous):
+            raise ConfigManagerError(f"El árbol anterior de {target} ya no existe: no se puede deshacer")
+        discarded = target.parent / f".{target.name}.rollback-{os.getpid()}"
+        os.rename(target, discarded)
+        if os.path.lexists(previous):
+            os.rename(previous, target)
+        engine.remove_tree(discarded)
+    else:
+        discard_unswapped(journal, engine)
+    journal.finish()
+
+
+def replace_tree_atomic(target, build, engine=None, journal=None, source=None, source_id=None):
+    """Reemplaza el árbol target por uno nuevo sin dejarlo nunca a medias
+
+    build(staging) arma el árbol nuevo en un directorio hermano (mismo sistema
+    de archivos). Si falla, target queda intacto. Si termina bien, los árboles
+    se intercambian con un rename y el anterior se borra en segundo plano.
+    Con journal (vacío o cargado de una ejecución interrumpida con el mismo
+    origen source) se llama build(staging, journal): el staging se conserva si la
+    operación se corta, para retomarla o deshacerla después. source_id
+    identifica el contenido concreto del origen (ver source_identity).
+    Devuelve lo que devuelva build.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if journal is not None and journal.header:
+        staging, old = Path(journal.header["staging"]), Path(journal.header["old"])
+    else:
+        suffix = f"{os.getpid()}-{datetime.now().strftime('%H%M%S%f')}"
+        staging = target.parent / f".{target.name}.staging-{suffix}"
+        old = target.parent / f".{target.name}.old-{suffix}"
+        if journal is not None:
+            journal.start(op="install", target=str(target), staging=str(staging), old=str(old),
+                          source=source, source_id=source_id, had_target=os.path.lexists(target))
+
+    # Restos de ejecuciones anteriores interrumpidas
+    for leftover in target.parent.glob(f".{target.name}.old-*"):
+        if leftover != old:
+            remove_tree_background(leftover, engine)
+    try:
+        result = build(staging) if journal is None else build(staging, journal)
+    except BaseException:
+        if journal is None:
+            shutil.rmtree(staging, ignore_errors=True)
+        else:
+            journal.close()
+        raise
+
+    if journal is not None:
+        # El inodo del árbol armado permite saber después si el intercambio llegó a hacerse
+        st = os.stat(staging)
+        journal.phase("built", dev=st.st_dev, inode=st.st_ino)
+    if not os.path.lexists(target):
+        os.rename(staging, target)
+    elif exchange_paths(staging, target):
+        # Ahora staging contiene el árbol anterior
+        os.rename(staging, old)
+        remove_tree_background(old, engine)
+    else:
+        os.rename(target, old)
+        os.rename(staging, target)
+        remove_tree_background(old, engine)
+    if journal is not None:
+        journal.finish()
+    return result
+
+
+def line_delta(base, data):
+    """Delta por líneas que reconstruye data a partir de base
+
+    Lista de operaciones: [inicio, fin] copia esas líneas de base y un texto
+    se inserta tal cual. Los bytes que no son UTF-8 viajan como surrogates.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = data.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(b"".join(lines[j1:j2]).decode('utf-8', 'surrogateescape'))
+    return ops
+
+
+def apply_line_delta(base, ops):
+    """Aplica un delta de line_delta sobre base"""
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op.encode('utf-8', 'surrogateescape'))
+        else:
+            parts.extend(base_lines[op[0]:op[1]])
+    return b"".join(parts)
+
+
+class BlobStore:
+    """Almacén de backups deduplicado por contenido (SHA-256)
+
+    Cada archivo se guarda una sola vez en objects/ y cada snapshot es un
+    manifiesto JSON más un árbol de hardlinks a esos blobs, así los archivos
+    que no cambian entre backups no vuelven a escribirse.
+
+    Con max_chain los canales xfconf no se enlazan en el snapshot: la versión
+    más nueva de cada canal queda completa en objects/ y las anteriores pasan
+    a deltas/ como delta de la versión siguiente (cadenas inversas). Una
+    versión cuya cadena superaría max_chain deltas queda completa (keyframe),
+    así reconstruir una versión vieja nunca aplica más de max_chain deltas.
+    """
+
+    def __init__(self, root, engine=None, max_chain=None):
+        self.root = Path(root)
+        self.engine = engine or TreeEngine(1)
+        self.max_chain = max_chain
+        self.objects_dir = self.root / "objects"
+        self.manifests_dir = self.root / "manifests"
+        self.deltas_dir = self.root / "deltas"
+        self.deltas_path = self.root / "deltas.json"
+        self._deltas = None
+        self._deltas_lock = threading.Lock()
+        self._store_lock = threading.RLock()
+        self._store_lock_depth = 0
+        self._store_lock_file = None
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Bloqueo exclusivo entre procesos (flock en .store/lock) para modificar el almacén
+
+        Lo toman la creación y el borrado de snapshots y las escrituras del
+        catálogo: watch y la CLI pueden correr a la vez sobre el mismo
+        backups/. Es reentrante dentro del proceso.
+        """
+        with self._store_lock:
+            if self._store_lock_depth == 0:
+                self.root.mkdir(parents=True, exist_ok=True)
+                self._store_lock_file = open(self.root / "lock", 'a')
+                fcntl.flock(self._store_lock_file, fcntl.LOCK_EX)
+            self._store_lock_depth += 1
+            try:
+                yield
+            finally:
+                self._store_lock_depth -= 1
+                if self._store_lock_depth == 0:
+                    # Cerrar el archivo libera el flock
+                    self._store_lock_file.close()
+                    self._store_lock_file = None
+
+    def blob_path(self, digest):
+        """Ruta del blob para un hash"""
+        return self.objects_dir / digest[:2] / digest[2:]
+
+    def manifest_path(self, name):
+        """Ruta del manifiesto de un snapshot"""
+        return self.manifests_dir / f"{name}.json"
+
+    def has_snapshot(self, name):
+        """Indica si el snapshot tiene manifiesto en el almacén"""
+        return self.manifest_path(name).exists()
+
+    def load_manifest(self, name):
+        """Lee el manifiesto de un snapshot"""
+        with open(self.manifest_path(name), encoding='utf-8') as f:
+            return json.load(f)
+
+    def delta_path(self, digest):
+        """Ruta del delta que reconstruye la versión con ese hash"""
+        return self.deltas_dir / digest[:2] / digest[2:]
+
+    def load_deltas(self, reload=False):
+        """Índice de deltas: {heads: {ruta: hash de la versión más nueva},
+        objects: {hash: {base, size, base_size, stored, sha256}}}"""
+        with self._deltas_lock:
+            if self._deltas is None or reload:
+                try:
+                    with open(self.deltas_path, encoding='utf-8') as f:
+                        self._deltas = json.load(f)
+                except FileNotFoundError:
+                    self._deltas = {"heads": {}, "objects": {}}
+            return self._deltas
+
+    def is_delta(self, digest):
+        """Indica si el contenido con ese hash solo está guardado como delta"""
+        if digest in self.load_deltas()["objects"]:
+            return True
+        # Otro proceso pudo haber convertido la versión después de leer el índice
+        return not self.blob_path(digest).exists() and digest in self.load_deltas(reload=True)["objects"]
+
+    def stored_size(self, digest, size):
+        """Bytes que ocupa en el almacén el contenido con ese hash"""
+        record = self.load_deltas()["objects"].get(digest)
+        return size if record is None else record["stored"]
+
+    def read_object(self, digest):
+        """Contenido de un hash, reconstruido desde su cadena de deltas si hace falta"""
+        objects = self.load_deltas()["objects"]
+        chain = []
+        while not self.blob_path(digest).exists():
+            record = objects.get(digest)
+            if record is None or len(chain) > len(objects):
+                raise ConfigManagerError(f"Falta el objeto {digest} en el almacén")
+            chain.append(digest)
+            digest = record["base"]
+
+        data = self.blob_path(digest).read_bytes()
+        for digest in reversed(chain):
+            with open(self.delta_path(digest), 'rb') as f:
+                ops = json.loads(zlib.decompress(f.read()))
+            data = apply_line_delta(data, ops)
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise ConfigManagerError(f"El delta {digest} no reconstruye su contenido")
+        return data
+
+    def read_file(self, snapshot_dir, item):
+        """Contenido de un archivo de un snapshot (blob, copia en el snapshot o delta)"""
+        blob = self.blob_path(item["sha256"])
+        if blob.exists():
+            return blob.read_bytes()
+        if self.is_delta(item["sha256"]):
+            return self.read_object(item["sha256"])
+        return (Path(snapshot_dir) / item["path"]).read_bytes()
+
+    def snapshot_channels(self, snapshot_dir):
+        """Canales xfconf de un snapshot (ver tree_channels) leídos del manifiesto
+
+        Los blobs son inmutables: el hash del manifiesto es confiable y los
+        canales que nadie lee no se reconstruyen.
+        """
+        channels = {}
+        for item in self.load_manifest(Path(snapshot_dir).name)["entries"]:
+            if item["type"] == "file" and is_channel_path(item["path"]):
+                name = item["path"].rpartition("/")[2][:-4]
+                channels[name] = (item["sha256"], lambda item=item: self.read_file(snapshot_dir, item))
+        return channels
+
+    def _write_delta(self, digest, payload):
+        path = self.delta_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.parent / f".tmp{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, path)
+
+    def update_channel_deltas(self, channels):
+        """Pasa a delta la versión anterior de cada canal que cambió
+
+        channels es {ruta: hash} del snapshot nuevo, cuyos canales ya están
+        completos en objects/. Se llama con el almacén bloqueado (ver lock).
+        Devuelve los bytes ahorrados.
+        """
+        index = self.load_deltas(reload=True)
+        heads, objects = index["heads"], index["objects"]
+        current = set(channels.values())
+        for digest in current & objects.keys():
+            # Versión que volvió a ser la más nueva: está completa otra vez
+            del objects[digest]
+            self.delta_path(digest).unlink(missing_ok=True)
+
+        dependents = {}
+        for digest, record in objects.items():
+            dependents.setdefault(record["base"], []).append(digest)
+
+        def height(digest):
+            """Deltas que hay que aplicar para llegar desde lo más viejo hasta digest"""
+            return max((1 + height(d) for d in dependents.get(digest, ())), default=0)
+
+        saved = 0
+        for path, digest in sorted(channels.items()):
+            previous = heads.get(path)
+            if previous is None or previous in current or previous in objects:
+                continue
+            blob = self.blob_path(previous)
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_nlink > 1 or height(previous) + 1 > self.max_chain:
+                # Enlazado en un snapshot anterior a los deltas, o keyframe
+                continue
+            base = self.blob_path(digest).read_bytes()
+            payload = zlib.compress(json.dumps(line_delta(base, blob.read_bytes())).encode(), 9)
+            if len(payload) * 2 > st.st_size:
+                # Cambio grande: no vale la pena, queda completa
+                continue
+            self._write_delta(previous, payload)
+            objects[previous] = {"base": digest, "size": st.st_size, "base_size": len(base),
+                                 "stored": len(payload), "sha256": hashlib.sha256(payload).hexdigest()}
+            dependents.setdefault(digest, []).append(previous)
+            blob.unlink()
+            saved += st.st_size - len(payload)
+
+        index["heads"] = dict(channels)
+        write_json_atomic(self.deltas_path, index)
+        return saved
+
+    def collect_objects(self, candidates):
+        """Borra los objetos (blobs o deltas) que ya no usa ningún snapshot
+
+        Un blob sigue en uso si tiene hardlinks o si es un canal de un snapshot
+        guardado con deltas; una versión que es base de un delta vivo se
+        conserva. Se llama con el almacén bloqueado (ver lock). Devuelve los
+        bytes liberados.
+        """
+        index = self.load_deltas(reload=True)
+        objects = index["objects"]
+        referenced = self.delta_channel_digests()
+        dependents = Counter(record["base"] for record in objects.values())
+        freed = 0
+        pending = list(candidates)
+        while pending:
+            digest = pending.pop()
+            if digest in referenced or dependents[digest] > 0:
+                continue
+            record = objects.pop(digest, None)
+            if record is not None:
+                self.delta_path(digest).unlink(missing_ok=True)
+                freed += record["stored"]
+                dependents[record["base"]] -= 1
+                pending.append(record["base"])
+            # Puede estar además completo (guardado de nuevo con los deltas apagados)
+            blob = self.blob_path(digest)
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_nlink == 1:
+                blob.unlink()
+                freed += st.st_size
+
+        index["heads"] = {path: digest for path, digest in index["heads"].items()
+                          if digest in objects or self.blob_path(digest).exists()}
+        write_json_atomic(self.deltas_path, index)
+        return freed
+
+    def delta_channel_digests(self):
+        """Hashes de canales que usan los snapshots guardados con deltas (no enlazados)"""
+        digests = set()
+        if not self.manifests_dir.exists():
+            return digests
+        for path in self.manifests_dir.glob("*.json"):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if manifest.get("channel_deltas"):
+                digests.update(e["sha256"] for e in manifest["entries"]
+                               if e["type"] == "file" and is_channel_path(e["path"]))
+        return digests
+
+    def put_file(self, src):
+        """Guarda un archivo en el almacén, devuelve (hash, bytes escritos)"""
+        digest = hash_file(src)
+        if self.blob_path(digest).exists():
+            return digest, 0
+
+        # Copiar calculando el hash en el mismo paso: si el archivo cambió
+        # desde el primer hash, el blob queda guardado con el hash correcto
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.objects_dir / f".tmp{os.getpid()}-{threading.get_ident()}"
+        hasher = hashlib.sha256()
+        written = 0
+        with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+            for chunk in iter(lambda: fin.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                fout.write(chunk)
+                written += len(chunk)
+        digest = hasher.hexdigest()
+
+        blob = self.blob_path(digest)
+        if blob.exists():
+            tmp.unlink()
+            return digest, 0
+
+        blob.parent.mkdir(exist_ok=True)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, blob)
+        return digest, written
+
+    def create_snapshot(self, src_dir, snapshot_dir, exclude=None):
+        """Crea un snapshot de src_dir (salvo lo excluido) como manifiesto + árbol de hardlinks"""
+        with self.lock():
+            snapshot_dir = Path(snapshot_dir)
+            self.manifests_dir.mkdir(parents=True, exist_ok=True)
+            snapshot_dir.mkdir()
+
+            entries = []
+            files = []
+
+            for rel, entry in scan_tree(src_dir, exclude=exclude):
+                st = entry.stat(follow_symlinks=False)
+                dst = snapshot_dir / rel
+                item = {"path": rel, "mode": st.st_mode & 0o7777, "mtime_ns": st.st_mtime_ns}
+
+                if entry.is_symlink():
+                    target = os.readlink(entry.path)
+                    os.symlink(target, dst)
+                    item.update(type="symlink", target=target)
+                elif entry.is_dir():
+                    dst.mkdir()
+                    item["type"] = "dir"
+                elif entry.is_file():
+                    item.update(type="file", size=st.st_size)
+                    files.append((entry.path, dst, item))
+                else:
+                    # Sockets, FIFOs y similares no se respaldan
+                    continue
+
+                entries.append(item)
+
+            deltas = self.max_chain is not None
+
+            def store_file(task):
+                src, dst, item = task
+                digest, written = self.put_file(src)
+                item["sha256"] = digest
+                if deltas and is_channel_path(item["path"]):
+                    # Sin hardlink: la versión vieja tiene que poder pasar a delta
+                    return written
+                try:
+                    os.link(self.blob_path(digest), dst)
+                except OSError:
+                    # Sin soporte de hardlinks (otro FS, límite de enlaces)
+                    self.engine.copy_data(self.blob_path(digest), dst)
+                return written
+
+            written_bytes = sum(self.engine.map(store_file, files))
+            total_bytes = sum(item["size"] for _, _, item in files)
+            delta_saved = 0
+            if deltas:
+                delta_saved = self.update_channel_deltas({item["path"]: item["sha256"] for _, _, item in files
+                                                          if is_channel_path(item["path"])})
+
+            root_st = os.stat(src_dir)
+            manifest = {
+                "name": snapshot_dir.name,
+                "created": datetime.now().isoformat(timespec='seconds'),
+                "root": {"mode": root_st.st_mode & 0o7777, "mtime_ns": root_st.st_mtime_ns},
+                "file_count": sum(1 for e in entries if e["type"] == "file"),
+                "bytes": total_bytes,
+                "written_bytes": written_bytes,
+                "digest": tree_digest(entries),
+                "entries": entries,
+            }
+            if deltas:
+                manifest.update(channel_deltas=True, delta_saved_bytes=delta_saved)
+            write_json_atomic(self.manifest_path(snapshot_dir.name), manifest)
+            return manifest
+
+    def record_archive(self, archive_path, stats):
+        """Guarda el manifiesto de integridad de un backup comprimido"""
+        st = archive_path.stat()
+        self.manifests_dir.mkdir(parents=True, exist_ok=True)
+        manifest = {
+            "name": archive_path.name,
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "archive": {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": stats["sha256"]},
+            "file_count": stats["file_count"],
+            "bytes": stats["bytes"],
+            "digest": stats["digest"],
+            "entries": stats["entries"],
+        }
+        write_json_atomic(self.manifest_path(archive_path.name), manifest)
+        return manifest
+
+    def verify_tasks(self, snapshot_dir):
+        """Tareas de verify_files para los archivos de un snapshot
+
+        Se verifica el blob (o la copia del snapshot si no hay hardlink); como
+        los blobs se comparten, su fecha no dice nada y el modo rápido solo
+        compara tamaños.
+        """
+        snapshot_dir = Path(snapshot_dir)
+        tasks = []
+        for item in self.load_manifest(snapshot_dir.name)["entries"]:
+            if item["type"] != "file":
+                continue
+            blob = self.blob_path(item["sha256"])
+            if not blob.exists() and self.is_delta(item["sha256"]):
+                tasks.extend(self.chain_tasks(item["path"], item["sha256"]))
+                continue
+            if not blob.exists():
+                blob = snapshot_dir / item["path"]
+            tasks.append((item["path"], blob, item["size"], None, item["sha256"]))
+        return tasks
+
+    def chain_tasks(self, rel, digest):
+        """Tareas de verify_files para cada delta de una cadena y su versión completa"""
+        objects = self.load_deltas()["objects"]
+        tasks = []
+        size = None
+        while digest in objects and not self.blob_path(digest).exists():
+            record = objects[digest]
+            tasks.append((rel, self.delta_path(digest), record["stored"], None, record["sha256"]))
+            digest, size = record["base"], record["base_size"]
+        tasks.append((rel, self.blob_path(digest), size, None, digest))
+        return tasks
+
+    def materialize(self, snapshot_dir, dst_dir, journal=None):
+        """Reconstruye el árbol de un snapshot a partir de su manifiesto
+
+        Con journal se saltean los archivos ya reconstruidos en una ejecución
+        interrumpida.
+        """
+        snapshot_dir = Path(snapshot_dir)
+        manifest = self.load_manifest(snapshot_dir.name)
+        dst_dir = Path(dst_dir)
+        dst_dir.mkdir(parents=True, exist_ok=True)
+
+        dirs = []
+        files = []
+        for item in manifest["entries"]:
+            dst = dst_dir / item["path"]
+            if item["type"] == "dir":
+                dst.mkdir(exist_ok=True)
+                dirs.append((dst, item))
+            elif item["type"] == "symlink":
+                if os.path.lexists(dst):
+                    dst.unlink()
+                os.symlink(item["target"], dst)
+                os.utime(dst, ns=(item["mtime_ns"], item["mtime_ns"]), follow_symlinks=False)
+            elif journal is None or not journal.is_done(item["path"]):
+                files.append((dst, item))
+
+        def restore_file(task):
+            dst, item = task
+            blob = self.blob_path(item["sha256"])
+            if not blob.exists() and self.is_delta(item["sha256"]):
+                # Versión vieja de un canal: se reconstruye desde su cadena de deltas
+                dst.write_bytes(self.read_object(item["sha256"]))
+            else:
+                if not blob.exists():
+                    # Copia hecha sin hardlink: el archivo vive en el snapshot
+                    blob = snapshot_dir / item["path"]
+                self.engine.copy_data(blob, dst)
+            os.chmod(dst, item["mode"])
+            os.utime(dst, ns=(item["mtime_ns"], item["mtime_ns"]))
+            if journal is not None:
+                journal.mark_done(item["path"])
+
+        self.engine.map(restore_file, files)
+
+        # Permisos y fechas de directorios al final, de adentro hacia afuera
+        dirs.insert(0, (dst_dir, manifest["root"]))
+        for dst, item in reversed(dirs):
+            os.chmod(dst, item["mode"])
+            os.utime(dst, ns=(item["mtime_ns"], item["mtime_ns"]))
+
+        return manifest
+
+    def delete_snapshot(self, snapshot_dir):
+        """Elimina un snapshot y los blobs que ya nadie referencia"""
+        with self.lock():
+            snapshot_dir = Path(snapshot_dir)
+            manifest_path = self.manifest_path(snapshot_dir.name)
+            digests = set()
+            if manifest_path.exists():
+                manifest = self.load_manifest(snapshot_dir.name)
+                digests = {e["sha256"] for e in manifest["entries"] if e["type"] == "file"}
+
+            if snapshot_dir.exists():
+                self.engine.remove_tree(snapshot_dir)
+            if manifest_path.exists():
+                manifest_path.unlink()
+
+            if self.deltas_path.exists():
+                # Los canales guardados con deltas no tienen hardlinks que los cuenten
+                return self.collect_objects(digests)
+
+            # Un blob con un solo enlace ya no pertenece a ningún snapshot
+            freed = 0
+            for digest in digests:
+                blob = self.blob_path(digest)
+                try:
+                    st = blob.stat()
+                except FileNotFoundError:
+                    continue
+                if st.st_nlink == 1:
+                    blob.unlink()
+                    freed += st.st_size
+            return freed
+
+
+class BackupCatalog:
+    """Índice persistente de backups (backups/.store/catalog.json)
+
+    Guarda por snapshot: nombre, formato, fecha, cantidad de archivos, bytes,
+    bytes en disco y hash del contenido. Se valida contra el mtime de backups/
+    (que cambia al crear o borrar un backup) y solo se reconstruye si no
+    coincide; al reconstruir se reutilizan las entradas que siguen vigentes.
+    Vive dentro de .store/ para que escribirlo no cambie ese mtime.
+    """
+
+    def __init__(self, backup_dir, store):
+        self.backup_dir = Path(backup_dir)
+        self.store = store
+        self.path = store.root / "catalog.json"
+        self._snapshots = None
+        self._dir_mtime_ns = None
+
+    def _dir_mtime(self):
+        try:
+            return self.backup_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def describe(self, path):
+        """Arma la entrada de catálogo de un backup leyendo su contenido"""
+        fmt = archive_format(path)
+        if fmt:
+            info = scan_archive(path)
+            stored = info["compressed_bytes"]
+        elif self.store.has_snapshot(path.name):
+            info = self.store.load_manifest(path.name)
+            fmt = "store"
+            stored = info["written_bytes"]
+            if "digest" not in info:
+                info["digest"] = tree_digest(info["entries"])
+        else:
+            # Backup de directorio plano (formato anterior al almacén)
+            info = describe_tree(path)
+            fmt = "dir"
+            stored = info["bytes"]
+
+        return self._make_entry(path, fmt, info, stored)
+
+    def _make_entry(self, path, fmt, info, stored_bytes):
+        mtime = path.stat().st_mtime
+        return {
+            "name": path.name,
+            "format": fmt,
+            "created": datetime.fromtimestamp(mtime).isoformat(timespec='seconds'),
+            "mtime": mtime,
+            "file_count": info["file_count"],
+            "bytes": info["bytes"],
+            "stored_bytes": stored_bytes,
+            "digest": info["digest"],
+        }
+
+    def _save(self):
+        self.store.root.mkdir(parents=True, exist_ok=True)
+        # El mtime se toma después de cualquier cambio en backups/
+        self._dir_mtime_ns = self._dir_mtime()
+        write_json_atomic(self.path, {"backup_dir_mtime_ns": self._dir_mtime_ns,
+                                      "snapshots": self._snapshots})
+
+    def rebuild(self):
+        """Reconstruye el catálogo reutilizando las entradas de backups que siguen existiendo"""
+        with self.store.lock():
+            previous = self._snapshots or {}
+            snapshots = {}
+            if self.backup_dir.exists():
+                for path in self.backup_dir.iterdir():
+                    if path.name.startswith('.') or not (path.is_dir() or archive_format(path)):
+                        continue
+                    known = previous.get(path.name)
+                    if known is not None and known["mtime"] == path.stat().st_mtime:
+                        snapshots[path.name] = known
+                    else:
+                        snapshots[path.name] = self.describe(path)
+            self._snapshots = snapshots
+            if self.backup_dir.exists():
+                self._save()
+
+    def _load(self):
+        """Devuelve las entradas, releyendo o reconstruyendo solo si backups/ cambió"""
+        current = self._dir_mtime()
+        if self._snapshots is not None and current == self._dir_mtime_ns:
+            return self._snapshots
+        if current is None:
+            self._snapshots, self._dir_mtime_ns = {}, None
+            return self._snapshots
+
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._snapshots = data["snapshots"]
+            if data["backup_dir_mtime_ns"] == current:
+                self._dir_mtime_ns = current
+                return self._snapshots
+        except (OSError, ValueError, KeyError):
+            self._snapshots = None
+        self.rebuild()
+        return self._snapshots
+
+    def _reload(self):
+        """Relee el catálogo del disco (con el almacén bloqueado) antes de modificarlo
+
+        Otro proceso (por ejemplo watch) pudo haber agregado o quitado
+        backups: partir de lo cacheado perdería sus entradas.
+        """
+        self._snapshots = None
+        return self._load()
+
+    def entries(self):
+        """Entradas del catálogo ordenadas de más antigua a más reciente"""
+        return sorted(self._load().values(), key=lambda e: (e["mtime"], e["name"]))
+
+    def get(self, name):
+        """Entrada de un backup (o None)"""
+        return self._load().get(name)
+
+    def add(self, path, fmt, info, stored_bytes):
+        """Registra un backup recién creado con los datos que ya se calcularon al crearlo"""
+        with self.store.lock():
+            self._reload()
+            self._snapshots[path.name] = self._make_entry(path, fmt, info, stored_bytes)
+            self._save()
+            return self._snapshots[path.name]
+
+    def remove(self, name):
+        """Quita un backup del catálogo"""
+        with self.store.lock():
+            self._reload()
+            self._snapshots.pop(name, None)
+            self._save()
+
+
+class PropertyIndex:
+    """Índice histórico de propiedades xfconf (backups/.store/index.sqlite)
+
+    Cada snapshot (backup, guardado o perfil) apunta a los hashes de sus
+    canales y las propiedades se guardan una vez por hash de canal, así un
+    canal que no cambió entre backups no se vuelve a parsear ni a guardar.
+    Los valores se guardan como texto (los arrays en JSON) con un hash corto
+    indexado para buscar qué snapshots tienen un valor dado.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY, source TEXT UNIQUE NOT NULL, kind TEXT NOT NULL,
+            time REAL NOT NULL, version TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS channels (
+            snapshot_id INTEGER NOT NULL, channel TEXT NOT NULL, channel_hash TEXT NOT NULL,
+            PRIMARY KEY (snapshot_id, channel)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS channels_by_name ON channels (channel, channel_hash);
+        CREATE TABLE IF NOT EXISTS parsed (channel_hash TEXT PRIMARY KEY) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS properties (
+            channel_hash TEXT NOT NULL, property TEXT NOT NULL, type TEXT,
+            value TEXT, value_hash TEXT NOT NULL,
+            PRIMARY KEY (channel_hash, property)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS properties_by_value ON properties (property, value_hash);
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.executescript(self.SCHEMA)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def value_text(value):
+        """Valor como texto: tal cual los escalares, JSON los arrays"""
+        if isinstance(value, list):
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    @staticmethod
+    def value_hash(text):
+        return hashlib.sha256((text or "").encode()).hexdigest()[:16]
+
+    def versions(self):
+        """{origen: versión} de los snapshots indexados"""
+        return dict(self.db.execute("SELECT source, version FROM snapshots"))
+
+    def add_snapshot(self, source, kind, time, version, channels):
+        """Indexa (o reindexa) un snapshot; solo parsea canales con hash nuevo
+
+        channels es {canal: (hash, función que devuelve el XML)}. Devuelve la
+        cantidad de canales parseados.
+        """
+        db = self.db
+        parsed = 0
+        with db:
+            db.execute("DELETE FROM channels WHERE snapshot_id = "
+                       "(SELECT id FROM snapshots WHERE source = ?)", (source,))
+            db.execute("INSERT INTO snapshots (source, kind, time, version) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT (source) DO UPDATE SET kind = excluded.kind, time = excluded.time, "
+                       "version = excluded.version", (source, kind, time, version))
+            snapshot_id = db.execute("SELECT id FROM snapshots WHERE source = ?", (source,)).fetchone()[0]
+            for channel, (digest, load) in channels.items():
+                db.execute("INSERT INTO channels VALUES (?, ?, ?)", (snapshot_id, channel, digest))
+                if db.execute("SELECT 1 FROM parsed WHERE channel_hash = ?", (digest,)).fetchone():
+                    continue
+                try:
+                    props = parse_xfconf_channel(load())
+                except ET.ParseError:
+                    props = {}
+                rows = []
+                for prop, (ptype, value) in props.items():
+                    text = self.value_text(value)
+                    rows.append((digest, prop, ptype, text, self.value_hash(text)))
+                db.executemany("INSERT OR REPLACE INTO properties VALUES (?, ?, ?, ?, ?)", rows)
+                db.execute("INSERT INTO parsed VALUES (?)", (digest,))
+                parsed += 1
+        return parsed
+
+    def remove_snapshots(self, sources):
+        """Quita snapshots y las propiedades de canales que ya nadie referencia"""
+        db = self.db
+        with db:
+            for source in sources:
+                db.execute("DELETE FROM channels WHERE snapshot_id = "
+                           "(SELECT id FROM snapshots WHERE source = ?)", (source,))
+                db.execute("DELETE FROM snapshots WHERE source = ?", (source,))
+            unused = "SELECT channel_hash FROM parsed EXCEPT SELECT channel_hash FROM channels"
+            db.execute(f"DELETE FROM properties WHERE channel_hash IN ({unused})")
+            db.execute(f"DELETE FROM parsed WHERE channel_hash IN ({unused})")
+
+    def history(self, channel, prop):
+        """[(origen, tipo de snapshot, fecha, tipo, valor)] de una propiedad, por fecha
+
+        Los snapshots que tienen el canal pero no la propiedad devuelven tipo
+        y valor None.
+        """
+        return self.db.execute(
+            "SELECT s.source, s.kind, s.time, p.type, p.value FROM channels c "
+            "JOIN snapshots s ON s.id = c.snapshot_id "
+            "LEFT JOIN properties p ON p.channel_hash = c.channel_hash AND p.property = ? "
+            "WHERE c.channel = ? ORDER BY s.time, s.source", (prop, channel)).fetchall()
+
+    def find_value(self, channel, prop, value):
+        """[(origen, tipo de snapshot, fecha, tipo)] de los snapshots donde la propiedad vale value"""
+        return self.db.execute(
+            "SELECT s.source, s.kind, s.time, p.type FROM properties p "
+            "JOIN channels c ON c.channel_hash = p.channel_hash AND c.channel = ? "
+            "JOIN snapshots s ON s.id = c.snapshot_id "
+            "WHERE p.property = ? AND p.value_hash = ? AND p.value = ? ORDER BY s.time, s.source",
+            (channel, prop, self.value_hash(value), value)).fetchall()
+
+
+class RetentionPolicy:
+    """Política de retención de backups (abuelo-padre-hijo)
+
+    Conserva los últimos keep_last backups más el más reciente de cada una de
+    las últimas N horas, días, semanas (ISO) y meses. Si se define
+    max_total_bytes, descarta los más antiguos de los conservados hasta
+    entrar en ese límite, contando una sola vez los blobs compartidos (el
+    más reciente se conserva siempre).
+    """
+
+    BUCKETS = {
+        "hourly": "%Y-%m-%d %H",
+        "daily": "%Y-%m-%d",
+        "weekly": "%G-W%V",
+        "monthly": "%Y-%m",
+    }
+
+    def __init__(self, keep_last=2, hourly=0, daily=0, weekly=0, monthly=0, max_total_bytes=None):
+        self.keep_last = keep_last
+        self.limits = {"hourly": hourly, "daily": daily, "weekly": weekly, "monthly": monthly}
+        self.max_total_bytes = max_total_bytes
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Crea la política a partir del ajuste "retention" """
+        return cls(**settings)
+
+    def plan(self, entries, blobs=None):
+        """Divide las entradas del catálogo en (conservar, eliminar) en una sola pasada
+
+        blobs(entry) da {hash: bytes almacenados} de un backup del almacén
+        deduplicado: para max_total_bytes cada backup cuenta solo los blobs
+        que todavía no comparte con otro conservado. Sin blobs (o para
+        backups comprimidos) se usa stored_bytes.
+        """
+        newest_first = sorted(entries, key=lambda e: (e["mtime"], e["name"]), reverse=True)
+        seen = {bucket: set() for bucket in self.BUCKETS}
+        keep = []
+        prune = []
+        total = 0
+        kept_blobs = set()
+
+        for i, entry in enumerate(newest_first):
+            when = datetime.fromtimestamp(entry["mtime"])
+            reasons = i < self.keep_last
+            for bucket, fmt in self.BUCKETS.items():
+                key = when.strftime(fmt)
+                if key not in seen[bucket] and len(seen[bucket]) < self.limits[bucket]:
+                    seen[bucket].add(key)
+                    reasons = True
+
+            cost = entry["stored_bytes"]
+            new_blobs = {}
+            if reasons and self.max_total_bytes is not None and blobs and entry["format"] == "store":
+                new_blobs = {d: size for d, size in blobs(entry).items() if d not in kept_blobs}
+                cost = sum(new_blobs.values())
+            over_budget = self.max_total_bytes is not None and keep and total + cost > self.max_total_bytes
+            if reasons and not over_budget:
+                keep.append(entry)
+                total += cost
+                kept_blobs.update(new_blobs)
+            else:
+                prune.append(entry)
+
+        return keep, prune
+
 
 class XFCEConfigManager:
-    def __init__(self):
+    def __init__(self, settings=None, xfconf_backend=None, tracer=None):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        # watch solo elimina backups con una retención elegida por el usuario
+        self.retention_configured = "retention" in (settings or {})
         self.xfce_config_path = Path.home() / ".config" / "xfce4"
         self.backup_dir = Path("backups")
         self.current_config_dir = Path("current_config")
         self.local_xfce_dir = Path("Configuraciones") / "xfce4"
-        
+        self.engine = TreeEngine(self.settings["copy_workers"])
+        deltas = dict(DEFAULT_SETTINGS["channel_deltas"], **self.settings["channel_deltas"])
+        self.store = BlobStore(self.backup_dir / ".store", self.engine,
+                               deltas["max_chain"] if deltas["enabled"] else None)
+        self.catalog = BackupCatalog(self.backup_dir, self.store)
+        self.save_manifest_path = self.current_config_dir / ".xfce4.manifest.json"
+        self._xfconf_backend = xfconf_backend
+        self._exclude = None
+        self.tracer = tracer or make_tracer()
+        self.property_index = PropertyIndex(self.store.root / "index.sqlite")
+    
+    @property
+    def exclude(self):
+        """Reglas de exclusión para guardar y respaldar ~/.config/xfce4 (se compilan una vez)"""
+        if self._exclude is None:
+            self._exclude = ExcludeRules.for_profile(self.local_xfce_dir, self.settings["exclude"])
+        return self._exclude
+
     def detect_environment(self):
         """Detecta si es Linux y XFCE"""
         os_name = platform.system()
@@ -56,51 +3156,937 @@ class XFCEConfigManager:
         self.backup_dir.mkdir(exist_ok=True)
         self.current_config_dir.mkdir(exist_ok=True)
     
+    def list_backups(self):
+        """Devuelve los backups según el catálogo, del más antiguo al más reciente"""
+        with self.tracer.phase("catalog") as phase:
+            entries = self.catalog.entries()
+            phase.update(backups=len(entries))
+        return [self.backup_dir / e["name"] for e in entries]
+    
+    def backup_date(self, backup_path):
+        """Fecha de un backup según el catálogo"""
+        return self.catalog.get(backup_path.name)["mtime"]
+    
+    def delete_backup(self, backup_path):
+        """Elimina un backup, liberando los blobs que solo él usaba"""
+        if archive_format(backup_path):
+            backup_path.unlink()
+            if self.store.has_snapshot(backup_path.name):
+                self.store.manifest_path(backup_path.name).unlink()
+        elif self.store.has_snapshot(backup_path.name):
+            self.store.delete_snapshot(backup_path)
+        else:
+            self.engine.remove_tree(backup_path)
+        self.catalog.remove(backup_path.name)
+    
+    def print_copy_report(self):
+        """Muestra qué métodos de copia se usaron en la última operación"""
+        report = self.engine.take_copy_report()
+        if report:
+            detail = " · ".join(f"{name}: {count}" for name, count in sorted(report.items()))
+            print(f"   Copia: {detail}")
+    
+    def install_tree(self, target, build, source=None, source_id=None, preserve=True):
+        """Instala un árbol nuevo en target de forma atómica (ver replace_tree_atomic)
+
+        Con source (la referencia de origen) y source_id (su contenido, ver
+        source_identity) la instalación lleva journal: si una ejecución
+        anterior con el mismo contenido de origen quedó cortada se retoma
+        copiando solo lo que faltaba; si no, lo armado a medias se descarta.
+        Lo excluido (ver ExcludeRules) que ya estaba en target se copia al
+        árbol nuevo antes del intercambio, así no se pierde (salvo con
+        preserve=False, como en el guardado, que no lleva lo excluido).
+        En la traza, "copy" es armar el árbol nuevo y el resto de "install"
+        es el intercambio y el arranque del borrado en segundo plano.
+        """
+        journal = None
+        if source is not None:
+            journal = self.pending_journal(target)
+            if journal is not None and (journal.header.get("source_id") != source_id
+                                        or journal.phases):
+                recover_install(journal, self.engine)
+                journal = None
+            if journal is not None:
+                print(f"↻ Retomando instalación interrumpida de {source} "
+                      f"({len(journal.done)} archivo(s) ya copiados)")
+            else:
+                journal = Journal(Journal.path_for(target))
+        
+        def traced_build(staging, journal=None):
+            with self.tracer.phase("copy") as phase:
+                size = build(staging) if journal is None else build(staging, journal)
+                preserved = preserve_excluded(target, staging, self.exclude, self.engine) if preserve else 0
+                phase.update(bytes_written=size or 0, preserved=preserved)
+            return size
+        
+        with self.tracer.phase("install", target=str(target)):
+            return replace_tree_atomic(target, traced_build, self.engine, journal, source, source_id)
+    
+    def source_identity(self, ref, path):
+        """Contenido concreto al que apunta una referencia ya resuelta en path
 
+        Un backup es inmutable: alcanza con su nombre y su hash de catálogo
+        (backup:latest cambia de backup cuando se crea otro). saved y los
+        perfiles cambian en el lugar: se usa la firma de rutas, tamaños y fechas.
+        """
+        if ref.startswith("backup:"):
+            entry = self.catalog.get(path.name) or {}
+            return f"backup:{path.name}@{entry.get('digest')}"
+        return f"{path}@{tree_signature(path)}"
     
-    def backup_current_config_with_rotation(self):
-        """Guarda configuración con rotación máximo 2 backups"""
-        if not self.verify_xfce_config():
+    def copy_backup_tree(self, backup_path, dst, journal=None):
+        """Copia un backup a dst según su formato, devuelve los bytes copiados"""
+        if archive_format(backup_path):
+            return extract_archive(backup_path, dst, journal)["bytes"]
+        if self.store.has_snapshot(backup_path.name):
+            return self.store.materialize(backup_path, dst, journal)["bytes"]
+        return self.engine.copy_tree(backup_path, dst, journal=journal)["bytes"]
+    
+    def journal_targets(self):
+        """Árboles que pueden quedar con una operación a medias"""
+        return {"restore": self.xfce_config_path, "replace": self.local_xfce_dir,
+                "save": self.current_config_dir / "xfce4"}
+    
+    def pending_journal(self, target):
+        """Journal de una operación interrumpida sobre target (None si no hay)"""
+        return Journal.load(Journal.path_for(target))
+    
+    def pending_journals(self):
+        """Operaciones interrumpidas: lista de {name, op, target, source, started, done, planned, phases}"""
+        pending = []
+        for name, target in self.journal_targets().items():
+            journal = self.pending_journal(target)
+            if journal is None:
+                continue
+            header = journal.header
+            pending.append({"name": name, "op": header.get("op"), "target": str(target),
+                            "source": header.get("source"), "started": header.get("started"),
+                            "done": len(journal.done), "planned": len(journal.planned) or None,
+                            "phases": journal.phases})
+        return pending
+    
+    def rollback(self, name):
+        """Deshace la operación interrumpida de name (restore, replace o save)
+
+        Las tres se instalan de forma atómica: se vuelve al árbol anterior
+        aunque el intercambio ya se haya hecho. Devuelve False si no había
+        nada pendiente.
+        """
+        target = self.journal_targets()[name]
+        journal = self.pending_journal(target)
+        if journal is None:
             return False
+        rollback_install(journal, self.engine)
+        return True
+
+
+    
+    def backup_blobs(self, entry):
+        """{hash: bytes almacenados (blob o delta)} de un backup del almacén"""
+        return {item["sha256"]: self.store.stored_size(item["sha256"], item["size"])
+                for item in self.store.load_manifest(entry["name"])["entries"] if item["type"] == "file"}
+    
+    def estimate_freed_bytes(self, keep, prune):
+        """Bytes que se liberarían al eliminar prune conservando keep
+
+        Para el almacén deduplicado solo cuentan los blobs que ningún backup
+        conservado comparte.
+        """
+        def blobs(entries):
+            sizes = {}
+            for entry in entries:
+                if entry["format"] == "store":
+                    sizes.update(self.backup_blobs(entry))
+            return sizes
         
-        print("💾 Guardando configuración...")
+        freed = sum(e["stored_bytes"] for e in prune if e["format"] != "store")
+        if any(e["format"] == "store" for e in prune):
+            kept = blobs(keep)
+            freed += sum(size for digest, size in blobs(prune).items() if digest not in kept)
+        return freed
+    
+    def prune_backups(self, policy=None, confirm=None, dry_run=False):
+        """Aplica la política de retención
+
+        Calcula qué se elimina y cuánto se libera antes de borrar nada. Con
+        confirm (función que recibe la pregunta y devuelve True o False) pide
+        una única confirmación; sin confirm no pregunta.
+        Devuelve (backups eliminados, bytes liberados, cancelado).
+        """
+        policy = policy or RetentionPolicy.from_settings(self.settings["retention"])
+        with self.tracer.phase("prune_plan") as phase:
+            keep, prune = policy.plan(self.catalog.entries(), self.backup_blobs)
+            freed = self.estimate_freed_bytes(keep, prune) if prune else 0
+            phase.update(kept=len(keep), pruned=len(prune), freed_bytes=freed)
+        if not prune:
+            return [], 0, False
+        
+        print(f"🗑️  Retención: se eliminarían {len(prune)} backup(s), "
+              f"liberando {freed / (1024 * 1024):.2f} MB")
+        for entry in prune:
+            print(f"   - {entry['name']}")
+        
+        if dry_run:
+            return prune, freed, False
+        if confirm is not None:
+            with self.tracer.phase("prompt"):
+                confirmed = confirm("¿Eliminar estos backups?")
+            if not confirmed:
+                print("❌ Se conservan todos los backups")
+                return [], 0, True
+        
+        with self.tracer.phase("prune"):
+            for entry in prune:
+                self.delete_backup(self.backup_dir / entry["name"])
+                print(f"🗑️  Backup eliminado: {entry['name']}")
+        return prune, freed, False
+    
+    def create_backup(self):
+        """Crea un backup de ~/.config/xfce4 en el formato configurado (sin rotación)
+
+        Devuelve la entrada del catálogo del backup nuevo.
+        """
+        if not self.xfce_config_path.exists():
+            raise SourceNotFoundError(f"No existe la configuración de XFCE en: {self.xfce_config_path}")
+        self.backup_dir.mkdir(exist_ok=True)
+        
+        # Crear nuevo backup con timestamp
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        backup_name = f"backup_{timestamp}"
+        backup_format = self.settings["backup_format"]
+        if backup_format in ARCHIVE_FORMATS:
+            backup_name = f"{backup_name}.{backup_format}"
+        elif backup_format != "store":
+            raise ConfigManagerError(f"formato de backup desconocido: {backup_format}")
+        backup_path = self.backup_dir / backup_name
+        
+        if backup_path.exists():
+            self.delete_backup(backup_path)
+        
+        with self.tracer.phase("backup", format=backup_format) as phase:
+            if backup_format in ARCHIVE_FORMATS:
+                # Tar comprimido escrito en un solo recorrido
+                stats = write_archive(self.xfce_config_path, backup_path, backup_format, self.exclude)
+                self.store.record_archive(backup_path, stats)
+                phase.update(files=stats["file_count"], bytes_read=stats["bytes"],
+                             bytes_written=stats["compressed_bytes"])
+                return self.catalog.add(backup_path, backup_format, stats, stats["compressed_bytes"])
+            
+            # Los archivos sin cambios se enlazan a blobs ya existentes
+            manifest = self.store.create_snapshot(self.xfce_config_path, backup_path, self.exclude)
+            phase.update(files=manifest["file_count"], bytes_read=manifest["bytes"],
+                         bytes_written=manifest["written_bytes"],
+                         bytes_deduplicated=manifest["bytes"] - manifest["written_bytes"],
+                         bytes_delta_saved=manifest.get("delta_saved_bytes", 0))
+            return self.catalog.add(backup_path, "store", manifest, manifest["written_bytes"])
+    
+    def resolve_source(self, ref):
+        """Traduce una referencia de origen a (ruta, función que copia el árbol)
+
+        Referencias: "saved" (current_config/xfce4), "backup:<nombre>" (o
+        "backup:latest") y "local:<nombre>" (carpeta dentro de Configuraciones/).
+        La función recibe el directorio destino (y opcionalmente un Journal
+        para retomar una copia cortada) y devuelve los bytes copiados.
+        """
+        kind, _, name = ref.partition(":")
+        
+        if kind == "saved" and not name:
+            path = self.current_config_dir / "xfce4"
+            if not path.exists():
+                raise SourceNotFoundError("No existe configuración guardada")
+            return path, lambda dst, journal=None: self.engine.copy_tree(path, dst, journal=journal)["bytes"]
+        
+        if kind == "backup" and name:
+            if name == "latest":
+                backups = self.list_backups()
+                if not backups:
+                    raise SourceNotFoundError("No hay backups disponibles")
+                path = backups[-1]
+            else:
+                path = self.backup_dir / name
+                if self.catalog.get(name) is None:
+                    raise SourceNotFoundError(f"No existe el backup '{name}'")
+            return path, lambda dst, journal=None: self.copy_backup_tree(path, dst, journal)
+        
+        if kind == "local" and name:
+            path = self.local_xfce_dir.parent / name
+            if "/" in name or name.startswith("."):
+                raise SourceNotFoundError(f"No existe la configuración '{name}' en {self.local_xfce_dir.parent}/")
+            if not path.is_dir() and self.profile_layers_path(name).exists():
+                path = self.compose_profile(name)
+            if not path.is_dir():
+                raise SourceNotFoundError(f"No existe la configuración '{name}' en {self.local_xfce_dir.parent}/")
+            return path, lambda dst, journal=None: self.engine.copy_tree(path, dst, journal=journal)["bytes"]
+        
+        raise ConfigManagerError(f"Referencia de origen inválida: '{ref}' "
+                                 "(usar saved, backup:<nombre> o local:<nombre>)")
+    
+    def profile_layers_path(self, name):
+        """Archivo de capas de un perfil compuesto: Configuraciones/<nombre>.layers"""
+        return self.local_xfce_dir.parent / f"{name}.layers"
+    
+    def profile_layers(self, name):
+        """Capas de un perfil compuesto, de la base al último overlay
+
+        Una capa por línea, relativa a Configuraciones/ (por ejemplo "xfce4" o
+        "capas/panel-contabilidad"); las líneas con # son comentarios.
+        """
+        root = self.local_xfce_dir.parent
+        layers = []
+        with open(self.profile_layers_path(name), encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                layer = root / line
+                if line.startswith("/") or ".." in Path(line).parts or not layer.is_dir():
+                    raise ConfigManagerError(f"Capa inválida en {name}.layers: '{line}'")
+                layers.append(layer)
+        if not layers:
+            raise ConfigManagerError(f"El perfil '{name}' no tiene capas")
+        return layers
+    
+    def compose_profile(self, name):
+        """Árbol materializado de un perfil compuesto, cacheado en backups/.store/profiles/
+
+        La clave es el hash de las capas (ruta y contenido, en orden): si
+        ninguna cambió se reutiliza la composición anterior sin volver a mezclar.
+        """
+        layers = self.profile_layers(name)
+        cache_dir = self.store.root / "profiles"
+        with self.tracer.phase("compose", profile=name) as phase:
+            key = hashlib.sha256(b"compose-v1\n")
+            for layer in layers:
+                relative = layer.relative_to(self.local_xfce_dir.parent)
+                key.update(f"{relative}\0{describe_tree(layer)['digest']}\n".encode())
+            path = cache_dir / key.hexdigest()
+            
+            if path.is_dir():
+                os.utime(path)
+                phase.update(cache_hits=1)
+                return path
+            
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = cache_dir / f".tmp{os.getpid()}-{threading.get_ident()}"
+            try:
+                merged = compose_layers(layers, tmp, self.engine)
+                os.rename(tmp, path)
+            except BaseException:
+                if tmp.exists():
+                    self.engine.remove_tree(tmp)
+                raise
+            phase.update(layers=len(layers), channels_merged=merged)
         
+        # Conservar solo las composiciones usadas más recientemente
+        cached = sorted((p for p in cache_dir.iterdir() if not p.name.startswith(".")),
+                        key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in cached[PROFILE_CACHE_SIZE:]:
+            self.engine.remove_tree(old)
+        return path
+    
+    @property
+    def xfconf_backend(self):
+        """Backend de xfconf (se crea al primer uso según el ajuste xfconf_backend)"""
+        if self._xfconf_backend is None:
+            self._xfconf_backend = make_xfconf_backend(self.settings["xfconf_backend"], self.xfce_config_path)
+        return self._xfconf_backend
+    
+    def live_delta(self, ref):
+        """Cambios de propiedades entre el xfconfd en vivo y los canales de ref"""
+        changes = []
+        for channel, (_, read) in sorted(self.channels_of(ref).items()):
+            target = parse_xfconf_channel(read())
+            changes.extend(diff_properties(channel, self.xfconf_backend.read_channel(channel), target))
+        return changes
+    
+    def apply_live(self, ref, changes=None):
+        """Aplica en vivo, en una sola tanda, las propiedades de ref que difieren
+
+        changes permite pasar una diferencia ya calculada; devuelve cuántas
+        propiedades se aplicaron.
+        """
+        if changes is None:
+            changes = self.live_delta(ref)
+        return self.xfconf_backend.apply(changes) if changes else 0
+    
+    def restore(self, ref, apply_live=None):
+        """Restaura un origen en ~/.config/xfce4 de forma atómica, devuelve los bytes copiados
+
+        Con apply_live (o el ajuste del mismo nombre), una vez instalado el
+        árbol en disco se empujan a xfconfd solo las propiedades que cambian,
+        así no hace falta reiniciar la sesión. La diferencia se calcula antes
+        del intercambio porque el backend xfconf-query lee el estado de los
+        XML en disco; si la instalación falla no se toca nada en vivo.
+        """
+        if apply_live is None:
+            apply_live = self.settings["apply_live"]
+        path, build = self.resolve_source(ref)
+        source_id = self.source_identity(ref, path)
+        changes = self.live_delta(ref) if apply_live else None
+        copied = self.install_tree(self.xfce_config_path, build, ref, source_id)
+        if apply_live:
+            with self.tracer.phase("apply_live") as phase:
+                applied = self.apply_live(ref, changes)
+                phase.update(properties=applied)
+            print(f"⚡ Propiedades aplicadas en vivo: {applied}")
+        return copied
+    
+    def resolve_home(self, target):
+        """Traduce un usuario o un directorio home a {target, home, uid, gid}"""
+        if "/" in target:
+            home = Path(target)
+            if not home.is_dir():
+                raise SourceNotFoundError(f"No existe el directorio home: {home}")
+            st = home.stat()
+            return {"target": target, "home": home, "uid": st.st_uid, "gid": st.st_gid}
         try:
-            # Obtener backups existentes y ordenarlos
-            existing_backups = []
-            if self.backup_dir.exists():
-                existing_backups = [d for d in self.backup_dir.iterdir() if d.is_dir()]
-                existing_backups.sort(key=lambda x: x.stat().st_mtime)
+            user = pwd.getpwnam(target)
+        except KeyError:
+            raise SourceNotFoundError(f"No existe el usuario '{target}'") from None
+        return {"target": target, "home": Path(user.pw_dir), "uid": user.pw_uid, "gid": user.pw_gid}
+    
+    def restore_many(self, ref, targets, workers=None):
+        """Restaura un origen en ~/.config/xfce4 de varios usuarios o homes a la vez
+
+        El origen se lee una sola vez (los backups se reconstruyen en un árbol
+        temporal) y se copia a cada destino con reflink o copy_file_range
+        cuando el sistema de archivos lo permite; no se usan hardlinks para
+        que ningún usuario comparta archivos con otro. Cada árbol queda a
+        nombre del dueño del home y se instala de forma atómica. Se rechazan
+        los destinos cuyo .config o xfce4 sea un symlink o de otro usuario, y
+        todo lo que se escribe o borra en el home se hace con la identidad de
+        ese usuario (como root solo se lee el origen), así un symlink plantado
+        no lleva a root fuera del home. Lo excluido que ya tenía cada usuario se conserva. Los destinos
+        se procesan en un pool acotado (workers, por defecto copy_workers) y
+        un error en uno no detiene a los demás. Devuelve un resultado por destino.
+        """
+        workers = max(1, workers or self.settings["copy_workers"])
+        results = [{"target": target} for target in targets]
+        
+        with self.source_tree(ref) as source:
+            def restore_home(result):
+                engine = TreeEngine(1)
+                try:
+                    result.update(self.resolve_home(result["target"]))
+                    uid, gid = result["uid"], result["gid"]
+                    config_dir = result["home"] / ".config"
+                    target = config_dir / "xfce4"
+                    
+                    def build(dst):
+                        # Solo la lectura del origen se hace como root
+                        size = copy_tree_as_user(source, dst, uid, gid, engine)
+                        preserve_excluded(target, dst, self.exclude, engine)
+                        check_user_dir(config_dir, uid)
+                        check_user_dir(target, uid)
+                        return size
+                    
+                    with fs_identity(uid, gid), \
+                            self.tracer.phase("restore_home", target=result["target"]) as phase:
+                        if not check_user_dir(config_dir, uid):
+                            config_dir.mkdir(mode=0o700)
+                            os.chown(config_dir, uid, gid)
+                        check_user_dir(target, uid)
+                        result["bytes"] = replace_tree_atomic(target, build, engine)
+                        phase.update(bytes_written=result["bytes"])
+                    result["copy_methods"] = engine.take_copy_report()
+                    result["ok"] = True
+                except (ConfigManagerError, OSError) as e:
+                    result.update(ok=False, error=str(e))
+                return result
             
-            # Si hay 2 o más backups, eliminar el más antiguo
-            if len(existing_backups) >= 2:
-                oldest = existing_backups[0]
-                confirm = input(f"¿Eliminar backup antiguo '{oldest.name}'? (s/N): ")
-                if confirm.lower() == 's':
-                    shutil.rmtree(oldest)
-                    print(f"🗑️  Backup eliminado: {oldest.name}")
-                else:
-                    print("❌ Operación cancelada")
-                    return False
+            with ThreadPoolExecutor(max_workers=min(workers, max(1, len(results)))) as pool:
+                list(pool.map(restore_home, results))
+        
+        for result in results:
+            result.pop("home", None)
+            if result["ok"]:
+                print(f"✅ {result['target']}: {result['bytes'] / 1024:.1f} KB")
+            else:
+                print(f"❌ {result['target']}: {result['error']}")
+        return results
+    
+    def print_restart_hint(self):
+        """Aviso de reinicio (solo si los cambios no se aplicaron en vivo)"""
+        if self.settings["apply_live"]:
+            print("⚡ Cambios de xfconf aplicados en vivo, no hace falta reiniciar la sesión")
+        else:
+            print("⚠️  Reinicia tu sesión o XFCE para que los cambios se apliquen")
+    
+    def replace(self, ref):
+        """Reemplaza Configuraciones/xfce4 con un origen (saved o backup:<nombre>)"""
+        if ref.startswith("local:"):
+            raise ConfigManagerError("La configuración de este repo solo se reemplaza desde saved o backup:<nombre>")
+        path, build = self.resolve_source(ref)
+        return self.install_tree(self.local_xfce_dir, build, ref, self.source_identity(ref, path))
+    
+    def channels_of(self, ref):
+        """Canales xfconf de una referencia: live o cualquier origen de resolve_source"""
+        if ref == "live":
+            return tree_channels(self.xfce_config_path)
+        
+        path, _ = self.resolve_source(ref)
+        if archive_format(path):
+            return archive_channels(path)
+        if self.store.has_snapshot(path.name) and path.parent == self.backup_dir:
+            return self.store.snapshot_channels(path)
+        return tree_channels(path)
+    
+    def diff(self, old_ref, new_ref):
+        """Diferencias de propiedades xfconf entre dos configuraciones"""
+        with self.tracer.phase("diff", old=old_ref, new=new_ref) as phase:
+            old, new = self.channels_of(old_ref), self.channels_of(new_ref)
+            changes = diff_channels(old, new)
+            same = sum(1 for name in old.keys() & new.keys() if old[name][0] == new[name][0])
+            phase.update(channels=len(old.keys() | new.keys()), channels_skipped=same,
+                         changes=len(changes))
+        return changes
+    
+    def update_property_index(self):
+        """Pone al día el índice de propiedades con los snapshots actuales
+
+        Los backups son inmutables: se indexan una vez (versión = hash del
+        catálogo). El guardado y los perfiles cambian en el lugar: se compara
+        el hash de sus canales y solo se reindexan si cambió. En los dos casos
+        solo se parsean canales cuyo hash no estaba en el índice.
+        """
+        index = self.property_index
+        known = index.versions()
+        current = set()
+        stats = {"added": 0, "updated": 0, "removed": 0, "channels_parsed": 0}
+        
+        with self.tracer.phase("property_index") as phase:
+            for entry in self.catalog.entries():
+                source = f"backup:{entry['name']}"
+                current.add(source)
+                if known.get(source) == entry["digest"]:
+                    continue
+                channels = self.channels_of(source)
+                stats["channels_parsed"] += index.add_snapshot(source, "backup", entry["mtime"],
+                                                               entry["digest"], channels)
+                stats["updated" if source in known else "added"] += 1
+            
+            mutable = []
+            if (self.current_config_dir / "xfce4").exists():
+                # Fecha del último guardado (el directorio conserva la del origen)
+                saved = self.save_manifest_path if self.save_manifest_path.exists() else self.current_config_dir
+                mutable.append(("saved", "saved", saved.stat().st_mtime))
+            for local in self.list_configs()["local"]:
+                mutable.append((f"local:{local['name']}", "local", local["mtime"]))
+            for source, kind, mtime in mutable:
+                try:
+                    channels = self.channels_of(source)
+                except ConfigManagerError:
+                    continue
+                current.add(source)
+                version = hashlib.sha256("".join(
+                    f"{name}\0{digest}\n" for name, (digest, _) in sorted(channels.items())).encode()).hexdigest()
+                if known.get(source) == version:
+                    continue
+                stats["channels_parsed"] += index.add_snapshot(source, kind, mtime, version, channels)
+                stats["updated" if source in known else "added"] += 1
             
-            # Crear nuevo backup con timestamp
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            backup_name = f"backup_{timestamp}"
-            backup_path = self.backup_dir / backup_name
+            removed = set(known) - current
+            if removed:
+                index.remove_snapshots(removed)
+            stats["removed"] = len(removed)
+            phase.update(**stats)
+        return stats
+    
+    def property_history(self, channel, prop, changes_only=True):
+        """Historia de una propiedad en todos los snapshots, de la más vieja a la más nueva
+
+        Con changes_only solo se devuelven los backups donde el valor cambió
+        respecto del backup anterior (el guardado y los perfiles van siempre).
+        """
+        self.update_property_index()
+        history = []
+        previous = object()
+        for source, kind, mtime, ptype, value in self.property_index.history(channel, prop):
+            if kind == "backup" and changes_only:
+                if (ptype, value) == previous:
+                    continue
+                previous = (ptype, value)
+            history.append({"source": source, "kind": kind,
+                            "date": datetime.fromtimestamp(mtime).isoformat(timespec='seconds'),
+                            "type": ptype, "value": json.loads(value) if ptype == "array" else value})
+        return history
+    
+    def snapshots_with_value(self, channel, prop, value):
+        """Snapshots donde una propiedad tiene un valor dado (los arrays, en JSON)"""
+        self.update_property_index()
+        return [{"source": source, "kind": kind, "type": ptype,
+                 "date": datetime.fromtimestamp(mtime).isoformat(timespec='seconds')}
+                for source, kind, mtime, ptype in self.property_index.find_value(channel, prop, value)]
+    
+    def verify_tasks(self, ref):
+        """Tareas de verify_files para "saved" o "backup:<nombre>" (None si no hay manifiesto)"""
+        path, _ = self.resolve_source(ref)
+        if ref == "saved":
+            if not self.save_manifest_path.exists():
+                return None
+            return [(rel, path / rel, item["size"], item["mtime_ns"], item["sha256"])
+                    for rel, item in self.load_save_manifest().items() if item["type"] == "file"]
+        
+        if not self.store.has_snapshot(path.name):
+            return None
+        if archive_format(path):
+            archive = self.store.load_manifest(path.name)["archive"]
+            return [(path.name, path, archive["size"], archive["mtime_ns"], archive["sha256"])]
+        return self.store.verify_tasks(path)
+    
+    def verify(self, refs=None, deep=False):
+        """Verifica la integridad de current_config/ y de los backups
+
+        refs son referencias "saved" o "backup:<nombre>" (por defecto todo).
+        Los backups sin manifiesto (directorios viejos, tar anteriores) se
+        comparan con el hash de contenido del catálogo, siempre leyéndolos.
+        Devuelve una lista de {source, files, problems}.
+        """
+        if refs is None:
+            refs = ["saved"] if self.save_manifest_path.exists() else []
+            refs += [f"backup:{e['name']}" for e in self.catalog.entries()]
+        
+        verified = {}
+        results = []
+        for ref in refs:
+            with self.tracer.phase("verify", source=ref, deep=deep) as phase:
+                result = self.verify_one(ref, deep, verified)
+                phase.update(files=result["files"], problems=len(result["problems"]))
+            results.append(result)
+        return results
+    
+    def verify_one(self, ref, deep, verified):
+        """Verifica una referencia (ver verify) y muestra el resultado"""
+        tasks = self.verify_tasks(ref)
+        if ref == "saved":
+            if tasks is None:
+                raise ConfigManagerError("current_config/ no tiene manifiesto: guardar de nuevo")
+            problems = verify_files(tasks, deep, self.engine, verified)
+            files = len(tasks)
+        else:
+            path, _ = self.resolve_source(ref)
+            entry = self.catalog.get(path.name)
+            files = entry["file_count"]
+            if tasks is not None:
+                problems = verify_files(tasks, deep, self.engine, verified)
+            else:
+                info = self.catalog.describe(path)
+                problems = [] if info["digest"] == entry["digest"] else [
+                    {"path": path.name, "problem": "hash distinto"}]
+        
+        result = {"source": ref, "files": files, "problems": problems}
+        if problems:
+            print(f"❌ {ref}: {len(problems)} problema(s)")
+            for problem in problems:
+                print(f"   {problem['path']}: {problem['problem']}")
+        else:
+            print(f"✅ {ref}: {files} archivo(s) OK")
+        return result
+    
+    @contextlib.contextmanager
+    def source_tree(self, ref):
+        """Árbol en disco de un origen mientras dura el with
+
+        saved y local:<nombre> ya son árboles; los backups se reconstruyen una
+        sola vez en un directorio temporal dentro de .store/ que se borra al salir.
+        """
+        path, build = self.resolve_source(ref)
+        if not ref.startswith("backup:"):
+            yield path
+            return
+        self.store.root.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix=".source-", dir=self.store.root) as tmp:
+            root = Path(tmp) / "tree"
+            build(root)
+            yield root
+    
+    def sync_transport(self, remote=None):
+        """Transporte del repositorio de sync (argumento o ajuste sync_remote)"""
+        remote = remote or self.settings["sync_remote"]
+        if not remote:
+            raise ConfigManagerError("No hay repositorio de sync: usar --remote o el ajuste sync_remote")
+        return make_sync_transport(remote)
+    
+    def load_chunk_cache(self):
+        """Caché de cortes por contenido (backups/.store/chunks.json)"""
+        try:
+            with open(self.store.root / "chunks.json", encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_chunk_cache(self, cache, used):
+        """Guarda la caché dejando al final lo usado ahora y descartando lo más viejo"""
+        for digest in used:
+            if digest in cache:
+                cache[digest] = cache.pop(digest)
+        entries = list(cache.items())[-SYNC_CACHE_ENTRIES:]
+        self.store.root.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.store.root / "chunks.json", dict(entries))
+    
+    def sync_index(self, root, cache):
+        """Manifiesto de sync de un árbol y {trozo: (archivo, posición, tamaño)} locales"""
+        root = Path(root)
+        entries = []
+        files = []
+        for rel, entry in scan_tree(root):
+            st = entry.stat(follow_symlinks=False)
+            item = {"path": rel, "mode": st.st_mode & 0o7777, "mtime_ns": st.st_mtime_ns}
+            if entry.is_symlink():
+                item.update(type="symlink", target=os.readlink(entry.path))
+            elif entry.is_dir():
+                item["type"] = "dir"
+            elif entry.is_file():
+                item["type"] = "file"
+                files.append((entry.path, item))
+            else:
+                continue
+            entries.append(item)
+        
+        def chunk_file(task):
+            path, item = task
+            item["sha256"], item["chunks"] = file_chunks(path, cache)
+            item["size"] = sum(size for _, size in item["chunks"])
+        
+        self.engine.map(chunk_file, files)
+        
+        locations = {}
+        for path, item in files:
+            offset = 0
+            for digest, size in item["chunks"]:
+                locations.setdefault(digest, (path, offset, size))
+                offset += size
+        
+        root_st = os.stat(root)
+        manifest = {
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "root": {"mode": root_st.st_mode & 0o7777, "mtime_ns": root_st.st_mtime_ns},
+            "file_count": len(files),
+            "bytes": sum(item["size"] for _, item in files),
+            "digest": tree_digest(entries),
+            "entries": entries,
+        }
+        return manifest, locations
+    
+    def push(self, ref, name=None, remote=None):
+        """Sube un origen al repositorio de sync, enviando solo los trozos que le faltan
+
+        Primero se arma el manifiesto local (con los trozos de cada archivo),
+        se pregunta qué trozos no tiene el repositorio, se suben esos y al
+        final el manifiesto, así nunca queda uno que apunte a trozos ausentes.
+        """
+        transport = self.sync_transport(remote)
+        path, _ = self.resolve_source(ref)
+        kind, _, ref_name = ref.partition(":")
+        name = check_sync_name(name or ("saved" if ref == "saved" else ref_name if kind == "local" else path.name))
+        cache = self.load_chunk_cache()
+        
+        with self.source_tree(ref) as root:
+            with self.tracer.phase("sync_index") as phase:
+                manifest, locations = self.sync_index(root, cache)
+                phase.update(files=manifest["file_count"], chunks=len(locations))
+            manifest["name"] = name
             
-            if backup_path.exists():
-                shutil.rmtree(backup_path)
+            with self.tracer.phase("sync_push") as phase:
+                missing = sorted(transport.missing_chunks(set(locations)))
+                sent = 0
+                for start in range(0, len(missing), SYNC_BATCH):
+                    batch = {d: read_chunk(*locations[d]) for d in missing[start:start + SYNC_BATCH]}
+                    transport.put_chunks(batch)
+                    sent += sum(len(data) for data in batch.values())
+                transport.put_manifest(name, manifest)
+                phase.update(chunks_sent=len(missing), bytes_sent=sent)
+        
+        self.save_chunk_cache(cache, [e["sha256"] for e in manifest["entries"] if e["type"] == "file"])
+        return {"name": name, "files": manifest["file_count"], "bytes": manifest["bytes"],
+                "chunks": len(locations), "chunks_sent": len(missing), "bytes_sent": sent}
+    
+    def pull(self, name, ref=None, remote=None):
+        """Baja un snapshot del repositorio a Configuraciones/<nombre> (o ref "local:<nombre>")
+
+        Los archivos que ya existen localmente con el mismo hash se copian sin
+        transferir nada; de los demás solo se bajan los trozos que no están en
+        el destino actual ni en ~/.config/xfce4. El destino se instala de
+        forma atómica y cada archivo armado se comprueba contra su hash.
+        """
+        transport = self.sync_transport(remote)
+        manifest = transport.get_manifest(check_sync_name(name))
+        if manifest is None:
+            raise SourceNotFoundError(f"No existe el snapshot '{name}' en el repositorio")
+        check_sync_manifest(manifest)
+        kind, _, local_name = (ref or f"local:{name}").partition(":")
+        if kind != "local":
+            raise ConfigManagerError("El destino de pull debe ser local:<nombre>")
+        target = self.local_xfce_dir.parent / check_sync_name(local_name)
+        cache = self.load_chunk_cache()
+        files = [e for e in manifest["entries"] if e["type"] == "file"]
+        
+        local_files = {}
+        locations = {}
+        with self.tracer.phase("sync_index") as phase:
+            for root in (target, self.xfce_config_path):
+                if root.is_dir():
+                    local, found = self.sync_index(root, cache)
+                    for item in local["entries"]:
+                        if item["type"] == "file":
+                            local_files.setdefault(item["sha256"], root / item["path"])
+                    for digest, location in found.items():
+                        locations.setdefault(digest, location)
+            phase.update(local_files=len(local_files), local_chunks=len(locations))
+        
+        needed = {d for item in files if item["sha256"] not in local_files for d, _ in item["chunks"]}
+        missing = sorted(needed - set(locations))
+        fetched = {}
+        with self.tracer.phase("sync_pull") as phase:
+            for start in range(0, len(missing), SYNC_BATCH):
+                for digest, data in transport.get_chunks(missing[start:start + SYNC_BATCH]).items():
+                    if hashlib.sha256(data).hexdigest() != digest:
+                        raise ConfigManagerError(f"Trozo corrupto en el repositorio: {digest}")
+                    fetched[digest] = data
+            phase.update(chunks_received=len(fetched), bytes_received=sum(map(len, fetched.values())))
+        
+        def write_file(item, dst):
+            source = local_files.get(item["sha256"])
+            if source is not None:
+                self.engine.copy_data(source, dst)
+                return
+            hasher = hashlib.sha256()
+            with open(dst, 'wb') as f:
+                for digest, size in item["chunks"]:
+                    data = fetched[digest] if digest in fetched else read_chunk(*locations[digest])
+                    hasher.update(data)
+                    f.write(data)
+            if hasher.hexdigest() != item["sha256"]:
+                raise ConfigManagerError(f"El archivo armado no coincide con el snapshot: {item['path']}")
+        
+        def build(dst):
+            dst.mkdir(parents=True, exist_ok=True)
+            dirs = [(dst, manifest["root"])]
+            for item in manifest["entries"]:
+                path = dst / item["path"]
+                if item["type"] == "dir":
+                    path.mkdir()
+                    dirs.append((path, item))
+                elif item["type"] == "symlink":
+                    os.symlink(item["target"], path)
             
-            shutil.copytree(self.xfce_config_path, backup_path)
+            def restore_file(item):
+                path = dst / item["path"]
+                write_file(item, path)
+                # Sin setuid/setgid: el repositorio no es de confianza
+                os.chmod(path, item["mode"] & 0o1777)
+                os.utime(path, ns=(item["mtime_ns"], item["mtime_ns"]))
             
-            size = sum(f.stat().st_size for f in backup_path.rglob('*') if f.is_file())
-            size_mb = size / (1024 * 1024)
+            self.engine.map(restore_file, files)
+            for path, item in reversed(dirs):
+                os.chmod(path, item["mode"] & 0o1777)
+                os.utime(path, ns=(item["mtime_ns"], item["mtime_ns"]))
+            return manifest["bytes"]
+        
+        self.install_tree(target, build)
+        self.save_chunk_cache(cache, [item["sha256"] for item in files])
+        return {"name": name, "target": str(target), "files": len(files), "bytes": manifest["bytes"],
+                "files_reused": sum(1 for item in files if item["sha256"] in local_files),
+                "chunks_received": len(fetched), "bytes_received": sum(map(len, fetched.values()))}
+    
+    def take_watch_snapshot(self):
+        """Snapshot del modo watch: guardado incremental, backup y retención sin preguntas
+
+        La retención solo se aplica si el ajuste "retention" está configurado:
+        con la de fábrica (2 backups) watch dejaría una historia de dos
+        snapshots y borraría de paso los backups hechos a mano.
+        """
+        with self.tracer.phase("watch_snapshot"):
+            result = {"save": self.save_config_tree()}
+            if self.settings["watch"].get("backup", True):
+                result["backup"] = self.create_backup()
+                if self.retention_configured:
+                    pruned, _, _ = self.prune_backups()
+                    result["pruned"] = [e["name"] for e in pruned]
+        return result
+    
+    def watch(self, stop=None, max_snapshots=None):
+        """Vigila ~/.config/xfce4 y toma snapshots después de cada ráfaga de cambios"""
+        if not self.xfce_config_path.exists():
+            raise SourceNotFoundError(f"No existe la configuración de XFCE en: {self.xfce_config_path}")
+        
+        options = self.settings["watch"]
+        scheduler = SnapshotScheduler(options.get("quiet_period", 2.0), options.get("min_interval", 60.0),
+                                      options.get("max_pending", 4096))
+        watcher = InotifyWatcher(self.xfce_config_path, self.exclude)
+        snapshots = 0
+        print(f"👀 Vigilando {self.xfce_config_path} ({len(watcher.watches)} directorios)")
+        if options.get("backup", True) and not self.retention_configured:
+            print("ℹ️  Sin ajuste \"retention\": los snapshots se acumulan, usá prune para limpiarlos")
+        
+        try:
+            while stop is None or not stop.is_set():
+                wait = scheduler.seconds_until_due()
+                # Sin cambios pendientes se despierta cada segundo para revisar stop
+                for path in watcher.read_events(1.0 if wait is None else min(wait, 1.0)):
+                    # Los cambios en contenido excluido no disparan snapshots
+                    rel = os.path.relpath(path, self.xfce_config_path)
+                    if rel != "." and self.exclude.excluded_path(rel, path.is_dir()):
+                        continue
+                    scheduler.record(path)
+                
+                if scheduler.seconds_until_due() == 0:
+                    pending, dropped = scheduler.take()
+                    result = self.take_watch_snapshot()
+                    snapshots += 1
+                    name = result.get("backup", {}).get("name", "current_config/")
+                    print(f"📸 Snapshot {name}: {len(pending) + dropped} cambio(s), "
+                          f"{result['save']['copied']} archivo(s) copiados")
+                    if max_snapshots is not None and snapshots >= max_snapshots:
+                        break
+        finally:
+            watcher.close()
+        return snapshots
+    
+    def list_configs(self):
+        """Resumen de todas las configuraciones disponibles (para listados y la CLI)"""
+        saved_path = self.current_config_dir / "xfce4"
+        local_root = self.local_xfce_dir.parent
+        local = []
+        if local_root.exists():
+            for d in sorted(local_root.iterdir()):
+                if d.is_dir() and not d.name.startswith('.') and d.name != LAYERS_DIR:
+                    local.append({"name": d.name, "mtime": d.stat().st_mtime})
+                elif d.suffix == ".layers" and not (local_root / d.stem).is_dir():
+                    try:
+                        layers = [str(p.relative_to(local_root)) for p in self.profile_layers(d.stem)]
+                    except ConfigManagerError:
+                        layers = None
+                    local.append({"name": d.stem, "mtime": d.stat().st_mtime, "layers": layers})
+        return {
+            "system": {"path": str(self.xfce_config_path), "exists": self.xfce_config_path.exists()},
+            "saved": {"path": str(saved_path), "mtime": saved_path.stat().st_mtime} if saved_path.exists() else None,
+            "local": local,
+            "backups": self.catalog.entries(),
+        }
+    
+    def backup_current_config_with_rotation(self, assume_yes=False):
+        """Guarda configuración y aplica la política de retención de backups"""
+        if not self.verify_xfce_config():
+            return False
+        
+        print("💾 Guardando configuración...")
+        
+        try:
+            entry = self.create_backup()
+            size_mb = entry["bytes"] / (1024 * 1024)
+            written_mb = entry["stored_bytes"] / (1024 * 1024)
             
-            print(f"✅ Backup creado: {backup_name}")
+            print(f"✅ Backup creado: {entry['name']}")
             print(f"   Tamaño: {size_mb:.2f} MB")
+            print(f"   Datos nuevos escritos: {written_mb:.2f} MB")
+            self.print_copy_report()
+            
+            # Rotación según la política de retención
+            self.prune_backups(confirm=None if assume_yes else confirm_prompt)
             
             # Mostrar backups actuales
-            current_backups = [d for d in self.backup_dir.iterdir() if d.is_dir()]
+            current_backups = self.list_backups()
             print(f"   Backups totales: {len(current_backups)}")
             
             return True
@@ -134,18 +4120,20 @@ class XFCEConfigManager:
                 if confirm.lower() == 's':
                     print(f"🔄 Reemplazando {self.local_xfce_dir}...")
                     
-                    # Eliminar configuración local
-                    if self.local_xfce_dir.exists():
-                        shutil.rmtree(self.local_xfce_dir)
+                    # Armar la nueva configuración aparte y cambiarla de una vez
+                    try:
+                        size = self.replace("saved")
+                    except Exception as e:
+                        print(f"❌ Error al reemplazar: {e}")
+                        print("   La configuración de este repo no se modificó")
+                        input("Presione Enter para continuar...")
+                        return
                     
-                    # Copiar configuración guardada
-                    shutil.copytree(self.current_config_dir / "xfce4", self.local_xfce_dir)
-                    
-                    size = sum(f.stat().st_size for f in self.local_xfce_dir.rglob('*') if f.is_file())
                     size_mb = size / (1024 * 1024)
                     
                     print("✅ Configuración de este repo reemplazada exitosamente")
                     print(f"   Tamaño: {size_mb:.2f} MB")
+                    self.print_copy_report()
                 else:
                     print("❌ Operación cancelada")
             
@@ -168,7 +4156,7 @@ class XFCEConfigManager:
             input("Presione Enter para continuar...")
             return
         
-        backups = [d for d in self.backup_dir.iterdir() if d.is_dir()]
+        backups = self.list_backups()
         backups.sort(reverse=True)  # Más recientes primero
         
         if not backups:
@@ -178,7 +4166,7 @@ class XFCEConfigManager:
         
         print("\n💾 Selecciona backup para reemplazar:")
         for i, backup in enumerate(backups, 1):
-            backup_date = backup.stat().st_mtime
+            backup_date = self.backup_date(backup)
             date_str = datetime.fromtimestamp(backup_date).strftime("%Y-%m-%d %H:%M")
             print(f"   {i}. {backup.name} ({date_str})")
         
@@ -197,18 +4185,20 @@ class XFCEConfigManager:
                 if confirm.lower() == 's':
                     print(f"🔄 Reemplazando {self.local_xfce_dir}...")
                     
-                    # Eliminar configuración local
-                    if self.local_xfce_dir.exists():
-                        shutil.rmtree(self.local_xfce_dir)
-                    
-                    # Copiar backup seleccionado
-                    shutil.copytree(selected_backup, self.local_xfce_dir)
+                    # Armar la nueva configuración aparte y cambiarla de una vez
+                    try:
+                        size = self.replace(f"backup:{selected_backup.name}")
+                    except Exception as e:
+                        print(f"❌ Error al reemplazar: {e}")
+                        print("   La configuración de este repo no se modificó")
+                        input("Presione Enter para continuar...")
+                        return
                     
-                    size = sum(f.stat().st_size for f in self.local_xfce_dir.rglob('*') if f.is_file())
                     size_mb = size / (1024 * 1024)
                     
                     print("✅ Configuración de este repo reemplazada desde backup")
                     print(f"   Tamaño: {size_mb:.2f} MB")
+                    self.print_copy_report()
                 else:
                     print("❌ Operación cancelada")
         
@@ -224,7 +4214,7 @@ class XFCEConfigManager:
             input("Presione Enter para continuar...")
             return
         
-        backups = [d for d in self.backup_dir.iterdir() if d.is_dir()]
+        backups = self.list_backups()
         backups.sort(reverse=True)  # Más recientes primero
         
         if not backups:
@@ -234,7 +4224,7 @@ class XFCEConfigManager:
         
         print("\n💾 Selecciona backup para restaurar:")
         for i, backup in enumerate(backups, 1):
-            backup_date = backup.stat().st_mtime
+            backup_date = self.backup_date(backup)
             date_str = datetime.fromtimestamp(backup_date).strftime("%Y-%m-%d %H:%M")
             print(f"   {i}. {backup.name} ({date_str})")
         
@@ -253,15 +4243,18 @@ class XFCEConfigManager:
                 if confirm.lower() == 's':
                     print("🔄 Restaurando desde backup...")
                     
-                    # Eliminar configuración actual
-                    if self.xfce_config_path.exists():
-                        shutil.rmtree(self.xfce_config_path)
-                    
-                    # Copiar backup seleccionado
-                    shutil.copytree(selected_backup, self.xfce_config_path)
+                    # Armar la nueva configuración aparte y cambiarla de una vez
+                    try:
+                        self.restore(f"backup:{selected_backup.name}")
+                    except Exception as e:
+                        print(f"❌ Error al restaurar: {e}")
+                        print("   La configuración actual no se modificó")
+                        input("Presione Enter para continuar...")
+                        return
                     
                     print("✅ Backup restaurado exitosamente")
-                    print("⚠️  Reinicia tu sesión o XFCE para que los cambios se apliquen")
+                    self.print_copy_report()
+                    self.print_restart_hint()
                 else:
                     print("❌ Operación cancelada")
         
@@ -297,15 +4290,18 @@ class XFCEConfigManager:
                 if confirm.lower() == 's':
                     print("🔄 Restaurando configuración guardada...")
                     
-                    # Eliminar configuración actual
-                    if self.xfce_config_path.exists():
-                        shutil.rmtree(self.xfce_config_path)
-                    
-                    # Copiar configuración guardada
-                    shutil.copytree(config_path, self.xfce_config_path)
+                    # Armar la nueva configuración aparte y cambiarla de una vez
+                    try:
+                        self.restore("saved")
+                    except Exception as e:
+                        print(f"❌ Error al restaurar: {e}")
+                        print("   La configuración actual no se modificó")
+                        input("Presione Enter para continuar...")
+                        return
                     
                     print("✅ Configuración restaurada exitosamente")
-                    print("⚠️  Reinicia tu sesión o XFCE para que los cambios se apliquen")
+                    self.print_copy_report()
+                    self.print_restart_hint()
                 else:
                     print("❌ Operación cancelada")
             
@@ -329,8 +4325,11 @@ class XFCEConfigManager:
             input("Presione Enter para continuar...")
             return
         
-        # Obtener todas las carpetas dentro de Configuraciones/
-        configs = [d for d in configuraciones_dir.iterdir() if d.is_dir()]
+        # Carpetas dentro de Configuraciones/ y perfiles compuestos (<nombre>.layers);
+        # como en list_configs, una carpeta con el mismo nombre tapa al .layers
+        configs = [d for d in configuraciones_dir.iterdir()
+                   if (d.is_dir() and not d.name.startswith('.') and d.name != LAYERS_DIR)
+                   or (d.suffix == ".layers" and not (configuraciones_dir / d.stem).is_dir())]
         
         if not configs:
             print("❌ No hay configuraciones disponibles en Configuraciones/")
@@ -345,7 +4344,7 @@ class XFCEConfigManager:
         for i, config in enumerate(configs, 1):
             config_date = config.stat().st_mtime
             date_str = datetime.fromtimestamp(config_date).strftime("%d/%m/%Y %H:%M:%S")
-            print(f"  {i}. {config.name} ({date_str})")
+            print(f"  {i}. {config.name.removesuffix('.layers')} ({date_str})")
         
         print(f"  {len(configs) + 1}. Volver")
         print("="*50)
@@ -361,19 +4360,22 @@ class XFCEConfigManager:
                 config_date = selected_config.stat().st_mtime
                 date_str = datetime.fromtimestamp(config_date).strftime("%d/%m/%Y %H:%M:%S")
                 
-                confirm = input(f"¿Restaurar '{selected_config.name}' ({date_str})? (s/N): ")
+                confirm = input(f"¿Restaurar '{selected_config.name.removesuffix('.layers')}' ({date_str})? (s/N): ")
                 if confirm.lower() == 's':
-                    print(f"🔄 Restaurando '{selected_config.name}'...")
+                    print(f"🔄 Restaurando '{selected_config.name.removesuffix('.layers')}'...")
                     
-                    # Eliminar configuración actual
-                    if self.xfce_config_path.exists():
-                        shutil.rmtree(self.xfce_config_path)
-                    
-                    # Copiar configuración seleccionada
-                    shutil.copytree(selected_config, self.xfce_config_path)
+                    # Armar la nueva configuración aparte y cambiarla de una vez
+                    try:
+                        self.restore(f"local:{selected_config.name.removesuffix('.layers')}")
+                    except Exception as e:
+                        print(f"❌ Error al restaurar: {e}")
+                        print("   La configuración actual no se modificó")
+                        input("Presione Enter para continuar...")
+                        return
                     
                     print("✅ Configuración restaurada exitosamente")
-                    print("⚠️  Reinicia tu sesión o XFCE para que los cambios se apliquen")
+                    self.print_copy_report()
+                    self.print_restart_hint()
                 else:
                     print("❌ Operación cancelada")
             
@@ -402,7 +4404,7 @@ class XFCEConfigManager:
         
         # Agregar opción de backups si existen
         if self.backup_dir.exists():
-            backup_count = len([d for d in self.backup_dir.iterdir() if d.is_dir()])
+            backup_count = len(self.list_backups())
             if backup_count > 0:
                 options.append("Backups en este repo")
         
@@ -437,6 +4439,60 @@ class XFCEConfigManager:
         
         input("Presione Enter para continuar...")
     
+    def load_save_manifest(self):
+        """Lee el índice del último guardado en current_config/ (vacío si no hay)"""
+        if not (self.current_config_dir / "xfce4").exists():
+            return {}
+        try:
+            with open(self.save_manifest_path, encoding='utf-8') as f:
+                return json.load(f)["entries"]
+        except (OSError, ValueError, KeyError):
+            return {}
+    
+    def save_config_tree(self):
+        """Copia ~/.config/xfce4 a current_config/xfce4 (incremental o completo)
+
+        El árbol nuevo se arma aparte y se instala de forma atómica (ver
+        install_tree): un guardado cortado nunca deja current_config/xfce4 a
+        medias y se puede retomar o deshacer con journal rollback save. En el
+        incremental lo que no cambió se enlaza (hardlink) al guardado anterior
+        y lo que cambió se escribe en archivos nuevos, nunca encima.
+        """
+        if not self.xfce_config_path.exists():
+            raise SourceNotFoundError(f"No existe la configuración de XFCE en: {self.xfce_config_path}")
+        
+        target = self.current_config_dir / "xfce4"
+        # Sin índice del guardado anterior no se sabe qué sobra: guardado completo
+        manifest = self.load_save_manifest() if self.settings["incremental_save"] else {}
+        incremental = bool(manifest)
+        result = {}
+        
+        def build(staging, journal):
+            previous = manifest
+            if journal.planned or journal.done:
+                # Retomado: lo planeado y no terminado se vuelve a revisar
+                previous = journal.resume_index(previous)
+            if incremental:
+                link_tree(target, staging)
+            with self.tracer.phase("save", incremental=incremental) as phase:
+                entries, stats = incremental_copy(self.xfce_config_path, staging, previous,
+                                                  self.engine, self.exclude, journal)
+                # Cada archivo sin cambios ahorra abrirlo, leerlo y escribirlo
+                phase.update(files=len(entries), files_copied=stats["copied"], files_skipped=stats["skipped"],
+                             bytes_read=stats["bytes_copied"], bytes_written=stats["bytes_copied"],
+                             syscalls_avoided=stats["skipped"] * 3)
+            result.update(entries=entries, stats=stats)
+            return stats["bytes_copied"]
+        
+        self.current_config_dir.mkdir(parents=True, exist_ok=True)
+        self.install_tree(target, build, str(self.xfce_config_path),
+                          f"save:{'incremental' if incremental else 'full'}", preserve=False)
+        write_json_atomic(self.save_manifest_path, {
+            "saved": datetime.now().isoformat(timespec='seconds'),
+            "entries": result["entries"],
+        })
+        return result["stats"]
+    
     def save_current_config(self):
         """Guarda configuración actual con rotación de backups"""
         if not self.verify_xfce_config():
@@ -451,18 +4507,14 @@ class XFCEConfigManager:
         
         # Guardar en current_config
         try:
-            # Eliminar configuración actual guardada
-            if self.current_config_dir.exists():
-                shutil.rmtree(self.current_config_dir)
-            
-            # Copiar configuración actual
-            shutil.copytree(self.xfce_config_path, self.current_config_dir / "xfce4")
-            
-            size = sum(f.stat().st_size for f in self.current_config_dir.rglob('*') if f.is_file())
-            size_mb = size / (1024 * 1024)
+            stats = self.save_config_tree()
+            size_mb = stats["bytes"] / (1024 * 1024)
             
             print("✅ Configuración guardada en current_config/")
             print(f"   Tamaño: {size_mb:.2f} MB")
+            print(f"   Copiados: {stats['copied']} · Actualizados: {stats['updated']} · "
+                  f"Eliminados: {stats['deleted']} · Sin cambios: {stats['skipped']}")
+            self.print_copy_report()
             
         except Exception as e:
             print(f"❌ Error al guardar configuración: {e}")
@@ -490,7 +4542,7 @@ class XFCEConfigManager:
             print(f"Configuración en tu sistema: {current_status}")
             print(f"📍 Ruta: {self.xfce_config_path}")
             
-            backup_count = len(list(self.backup_dir.glob("*"))) if self.backup_dir.exists() else 0
+            backup_count = len(self.list_backups())
             print(f"Backups en este repo: {backup_count}")
             
             current_config_status = "✅" if (self.current_config_dir / "xfce4").exists() else "❌"
@@ -544,13 +4596,349 @@ class XFCEConfigManager:
         self.show_menu()
 
 
-if __name__ == "__main__":
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_NOT_FOUND = 3
+EXIT_CANCELLED = 4
+
+
+def build_parser():
+    """Arma el parser de la CLI no interactiva"""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-y", "--yes", action="store_true", help="no pedir confirmaciones")
+    common.add_argument("--json", action="store_true", help="salida en JSON (los mensajes van a stderr)")
+    
+    parser = argparse.ArgumentParser(
+        description="Gestor de configuraciones para XFCE. Sin subcomando abre el menú interactivo.")
+    parser.add_argument("--config", default=str(SETTINGS_FILE), help="archivo de ajustes JSON")
+    parser.add_argument("--trace", metavar="ARCHIVO",
+                        help=f"escribir una traza de fases en formato Chrome (también con {TRACE_ENV}=ARCHIVO)")
+    sub = parser.add_subparsers(dest="command", metavar="COMANDO")
+    
+    p = sub.add_parser("save", parents=[common], help="guardar ~/.config/xfce4 en current_config/")
+    p.add_argument("--backup", action="store_true", help="crear también un backup")
+    p.add_argument("--full", action="store_true", help="copia completa en vez de incremental")
+    
+    p = sub.add_parser("backup", parents=[common], help="crear un backup y aplicar la retención")
+    p.add_argument("--no-prune", action="store_true", help="no aplicar la política de retención")
+    
+    p = sub.add_parser("restore", parents=[common], help="restaurar una configuración en ~/.config/xfce4")
+    p.add_argument("--from", dest="source", required=True,
+                   help="saved | backup:<nombre> | backup:latest | local:<nombre>")
+    p.add_argument("--apply", action="store_true",
+                   help="aplicar en vivo las propiedades xfconf que cambian (sin reiniciar la sesión)")
+    
+    p = sub.add_parser("restore-many", parents=[common],
+                       help="restaurar una configuración en varios usuarios o homes a la vez")
+    p.add_argument("--from", dest="source", required=True,
+                   help="saved | backup:<nombre> | backup:latest | local:<nombre>")
+    p.add_argument("targets", nargs="+", metavar="DESTINO", help="usuario o directorio home (por ejemplo /home/ana)")
+    p.add_argument("--workers", type=int, help="destinos en paralelo (por defecto copy_workers)")
+    
+    p = sub.add_parser("replace", parents=[common], help="reemplazar Configuraciones/xfce4")
+    p.add_argument("--from", dest="source", required=True, help="saved | backup:<nombre> | backup:latest")
+    
+    sub.add_parser("list", parents=[common], help="listar configuraciones y backups")
+    
+    p = sub.add_parser("watch", parents=[common], help="vigilar ~/.config/xfce4 y tomar snapshots automáticos")
+    p.add_argument("--quiet-period", type=float, help="segundos sin cambios antes del snapshot")
+    p.add_argument("--min-interval", type=float, help="segundos mínimos entre snapshots")
+    
+    p = sub.add_parser("verify", parents=[common], help="verificar la integridad de current_config/ y los backups")
+    p.add_argument("sources", nargs="*", metavar="ORIGEN", help="saved | backup:<nombre> (por defecto todos)")
+    p.add_argument("--deep", action="store_true", help="rehashear todo en vez de confiar en tamaño y fecha")
+    
+    p = sub.add_parser("sync", help="subir y bajar configuraciones de un repositorio compartido")
+    p.add_argument("--remote", help="ruta, ssh://host/ruta, host:ruta o http(s)://url (ajuste sync_remote)")
+    actions = p.add_subparsers(dest="sync_command", metavar="ACCIÓN", required=True)
+    q = actions.add_parser("push", parents=[common], help="subir un origen (solo los trozos que faltan)")
+    q.add_argument("--from", dest="source", default="local:xfce4",
+                   help="saved | backup:<nombre> | backup:latest | local:<nombre> (por defecto local:xfce4)")
+    q.add_argument("--name", help="nombre en el repositorio (por defecto el del origen)")
+    q = actions.add_parser("pull", parents=[common], help="bajar un snapshot a Configuraciones/")
+    q.add_argument("name", help="nombre del snapshot en el repositorio")
+    q.add_argument("--to", dest="target", help="local:<nombre> (por defecto local:<snapshot>)")
+    actions.add_parser("list", parents=[common], help="listar los snapshots del repositorio")
+    
+    p = sub.add_parser("history", parents=[common], help="historia de una propiedad xfconf en todos los snapshots")
+    p.add_argument("channel", help="canal xfconf (por ejemplo xfwm4)")
+    p.add_argument("property", help="ruta de la propiedad (por ejemplo /general/theme)")
+    p.add_argument("--value", help="listar los snapshots donde la propiedad tiene este valor")
+    p.add_argument("--all", action="store_true", help="mostrar todos los backups, no solo los cambios")
+    
+    p = sub.add_parser("diff", parents=[common], help="diferencias de propiedades xfconf entre dos configuraciones")
+    p.add_argument("old", help="live | saved | backup:<nombre> | local:<nombre>")
+    p.add_argument("new", help="live | saved | backup:<nombre> | local:<nombre>")
+    
+    p = sub.add_parser("journal", help="operaciones interrumpidas (restore, replace, save)")
+    actions = p.add_subparsers(dest="journal_command", metavar="ACCIÓN", required=True)
+    actions.add_parser("list", parents=[common], help="listar operaciones que quedaron a medias")
+    q = actions.add_parser("rollback", parents=[common], help="deshacer una operación interrumpida")
+    q.add_argument("operation", choices=("restore", "replace", "save"), help="operación a deshacer")
+    
+    p = sub.add_parser("prune", parents=[common], help="aplicar la política de retención")
+    p.add_argument("--dry-run", action="store_true", help="solo mostrar qué se eliminaría")
+    for bucket in ("keep-last", "hourly", "daily", "weekly", "monthly"):
+        p.add_argument(f"--{bucket}", type=int, help="sobrescribe el ajuste de retención")
+    p.add_argument("--max-bytes", type=int, help="tope de espacio total de los backups")
+    
+    return parser
+
+
+def confirm_prompt(question):
+    """Pregunta s/N en la terminal; sin terminal (EOF) cuenta como no"""
+    try:
+        return input(f"{question} (s/N): ").lower() == 's'
+    except EOFError:
+        return False
+
+
+def confirm_cli(args, question, tracer=None):
+    """Confirmación para la CLI: --yes la salta; sin terminal se cancela"""
+    if args.yes:
+        return True
+    with (tracer or NullTracer()).phase("prompt"):
+        return confirm_prompt(question)
+
+
+def prune_confirm(args):
+    """Confirmación de retención para la CLI (None con --yes: no se pregunta)"""
+    return None if args.yes else lambda question: confirm_cli(args, question)
+
+
+def run_command(manager, args):
+    """Ejecuta un subcomando y devuelve (código de salida, resultado)"""
+    if args.command == "save":
+        if args.full:
+            manager.settings["incremental_save"] = False
+        result = {"save": manager.save_config_tree()}
+        print("✅ Configuración guardada en current_config/")
+        if args.backup:
+            result["backup"] = manager.create_backup()
+            print(f"✅ Backup creado: {result['backup']['name']}")
+            pruned, freed, cancelled = manager.prune_backups(confirm=prune_confirm(args))
+            result.update(pruned=[e["name"] for e in pruned], freed_bytes=freed, prune_cancelled=cancelled)
+            if cancelled:
+                return EXIT_CANCELLED, result
+        return EXIT_OK, result
+    
+    if args.command == "backup":
+        entry = manager.create_backup()
+        print(f"✅ Backup creado: {entry['name']}")
+        result = {"backup": entry, "pruned": []}
+        if not args.no_prune:
+            pruned, freed, cancelled = manager.prune_backups(confirm=prune_confirm(args))
+            result.update(pruned=[e["name"] for e in pruned], freed_bytes=freed, prune_cancelled=cancelled)
+            if cancelled:
+                return EXIT_CANCELLED, result
+        return EXIT_OK, result
+    
+    if args.command in ("restore", "replace"):
+        target = manager.xfce_config_path if args.command == "restore" else manager.local_xfce_dir
+        manager.resolve_source(args.source)
+        if not confirm_cli(args, f"¿Reemplazar {target} con '{args.source}'?", manager.tracer):
+            print("❌ Operación cancelada")
+            return EXIT_CANCELLED, {"cancelled": True}
+        if args.command == "restore":
+            size = manager.restore(args.source, apply_live=args.apply or None)
+        else:
+            size = manager.replace(args.source)
+        print(f"✅ {target} actualizado desde '{args.source}'")
+        return EXIT_OK, {"source": args.source, "target": str(target), "bytes": size,
+                         "copy_methods": manager.engine.take_copy_report()}
+    
+    if args.command == "restore-many":
+        manager.resolve_source(args.source)
+        if not confirm_cli(args, f"¿Reemplazar ~/.config/xfce4 de {len(args.targets)} destino(s) con "
+                                 f"'{args.source}'?", manager.tracer):
+            print("❌ Operación cancelada")
+            return EXIT_CANCELLED, {"cancelled": True}
+        results = manager.restore_many(args.source, args.targets, args.workers)
+        ok = all(r["ok"] for r in results)
+        return (EXIT_OK if ok else EXIT_ERROR), {"source": args.source, "results": results}
+    
+    if args.command == "list":
+        configs = manager.list_configs()
+        if not args.json:
+            print(f"Sistema: {configs['system']['path']} {'✅' if configs['system']['exists'] else '❌'}")
+            print(f"Guardada: {'✅' if configs['saved'] else '❌'}")
+            for local in configs["local"]:
+                print(f"local:{local['name']}")
+            for entry in configs["backups"]:
+                print(f"backup:{entry['name']}  {entry['created']}  {entry['file_count']} archivos  "
+                      f"{entry['bytes'] / (1024 * 1024):.2f} MB")
+        return EXIT_OK, configs
+    
+    if args.command == "watch":
+        options = dict(manager.settings["watch"])
+        if args.quiet_period is not None:
+            options["quiet_period"] = args.quiet_period
+        if args.min_interval is not None:
+            options["min_interval"] = args.min_interval
+        manager.settings["watch"] = options
+        
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            snapshots = manager.watch(stop)
+        except KeyboardInterrupt:
+            snapshots = None
+        print("👋 Vigilancia terminada")
+        return EXIT_OK, {"snapshots": snapshots}
+    
+    if args.command == "verify":
+        results = manager.verify(args.sources or None, deep=args.deep)
+        ok = not any(r["problems"] for r in results)
+        return (EXIT_OK if ok else EXIT_ERROR), {"deep": args.deep, "results": results}
+    
+    if args.command == "sync":
+        if args.sync_command == "list":
+            names = manager.sync_transport(args.remote).list_snapshots()
+            for name in names:
+                print(name)
+            return EXIT_OK, {"snapshots": names}
+        
+        if args.sync_command == "push":
+            result = manager.push(args.source, args.name, args.remote)
+            print(f"✅ '{args.source}' subido como '{result['name']}': {result['chunks_sent']} de "
+                  f"{result['chunks']} trozo(s), {result['bytes_sent'] / 1024:.1f} KB enviados")
+            return EXIT_OK, result
+        
+        target = manager.local_xfce_dir.parent / (args.target or f"local:{args.name}").partition(":")[2]
+        if target.exists() and not confirm_cli(args, f"¿Reemplazar {target} con '{args.name}'?", manager.tracer):
+            print("❌ Operación cancelada")
+            return EXIT_CANCELLED, {"cancelled": True}
+        result = manager.pull(args.name, args.target, args.remote)
+        print(f"✅ '{args.name}' bajado en {result['target']}: {result['files_reused']} archivo(s) reutilizados, "
+              f"{result['bytes_received'] / 1024:.1f} KB recibidos")
+        return EXIT_OK, result
+    
+    if args.command == "history":
+        prop = args.property if args.property.startswith("/") else f"/{args.property}"
+        if args.value is not None:
+            found = manager.snapshots_with_value(args.channel, prop, args.value)
+            if not args.json:
+                for item in found:
+                    print(f"{item['date']}  {item['source']}")
+                print(f"{len(found)} snapshot(s) con {args.channel} {prop} = {args.value!r}")
+            return EXIT_OK, {"channel": args.channel, "property": prop, "value": args.value, "snapshots": found}
+        
+        history = manager.property_history(args.channel, prop, changes_only=not args.all)
+        if not args.json:
+            for item in history:
+                value = None if item["type"] is None else (item["type"], item["value"])
+                print(f"{item['date']}  {item['source']:<40} {format_property_value(value)}")
+            if not history:
+                print(f"El canal '{args.channel}' no aparece en ningún snapshot")
+        return EXIT_OK, {"channel": args.channel, "property": prop, "history": history}
+    
+    if args.command == "diff":
+        changes = manager.diff(args.old, args.new)
+        if not args.json:
+            symbols = {"added": "+", "removed": "-", "changed": "~"}
+            for c in changes:
+                print(f"{symbols[c['change']]} {c['channel']} {c['property']}: "
+                      f"{format_property_value(c['old'])} → {format_property_value(c['new'])}")
+            print(f"{len(changes)} cambio(s)")
+        return EXIT_OK, {"old": args.old, "new": args.new, "changes": changes}
+    
+    if args.command == "journal":
+        if args.journal_command == "list":
+            pending = manager.pending_journals()
+            if not args.json:
+                for item in pending:
+                    progress = f"{item['done']}/{item['planned']}" if item["planned"] else str(item["done"])
+                    phase = item["phases"][-1] if item["phases"] else "copiando"
+                    print(f"{item['name']:<8} {item['started']}  {item['source']}  "
+                          f"{progress} archivo(s)  {phase}")
+                if not pending:
+                    print("No hay operaciones interrumpidas")
+            return EXIT_OK, {"pending": pending}
+        
+        if not confirm_cli(args, f"¿Deshacer la operación interrumpida '{args.operation}'?", manager.tracer):
+            print("❌ Operación cancelada")
+            return EXIT_CANCELLED, {"cancelled": True}
+        if not manager.rollback(args.operation):
+            raise SourceNotFoundError(f"No hay una operación '{args.operation}' interrumpida")
+        print(f"↩️  Operación '{args.operation}' deshecha")
+        return EXIT_OK, {"rolled_back": args.operation}
+    
+    if args.command == "prune":
+        retention = dict(manager.settings["retention"])
+        overrides = {"keep_last": args.keep_last, "hourly": args.hourly, "daily": args.daily,
+                     "weekly": args.weekly, "monthly": args.monthly, "max_total_bytes": args.max_bytes}
+        retention.update({k: v for k, v in overrides.items() if v is not None})
+        pruned, freed, cancelled = manager.prune_backups(RetentionPolicy.from_settings(retention),
+                                                         confirm=prune_confirm(args), dry_run=args.dry_run)
+        result = {"pruned": [e["name"] for e in pruned], "freed_bytes": freed, "dry_run": args.dry_run}
+        if cancelled:
+            return EXIT_CANCELLED, dict(result, cancelled=True)
+        return EXIT_OK, result
+    
+    raise ConfigManagerError(f"Comando desconocido: {args.command}")
+
+
+def write_trace(tracer):
+    """Escribe la traza (si está activa) avisando por stderr dónde quedó"""
+    try:
+        path = tracer.write()
+    except OSError as e:
+        print(f"⚠️  No se pudo escribir la traza: {e}", file=sys.stderr)
+        return
+    if path is not None:
+        print(f"📊 Traza escrita en {path}", file=sys.stderr)
+
+
+def main(argv=None):
+    """Punto de entrada: CLI con subcomandos o menú interactivo"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    
+    try:
+        manager = XFCEConfigManager(load_settings(args.config), tracer=make_tracer(args.trace))
+    except (OSError, ValueError) as e:
+        print(f"❌ No se pudieron leer los ajustes: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    
+    if args.command is None:
+        try:
+            manager.run()
+        except KeyboardInterrupt:
+            print("\n\n👋 Programa interrumpido")
+        except Exception as e:
+            print(f"\n❌ Error inesperado: {e}")
+            return EXIT_ERROR
+        finally:
+            write_trace(manager.tracer)
+        return EXIT_OK
+    
+    # Con --json, stdout queda reservado para el resultado
+    output = sys.stderr if args.json else sys.stdout
     try:
-        manager = XFCEConfigManager()
-        manager.run()
+        with contextlib.redirect_stdout(output), manager.tracer.phase(f"command:{args.command}"):
+            code, result = run_command(manager, args)
+        error = None
+    except SourceNotFoundError as e:
+        code, result, error = EXIT_NOT_FOUND, {}, str(e)
+    except (ConfigManagerError, OSError, RuntimeError, ValueError, subprocess.SubprocessError) as e:
+        code, result, error = EXIT_ERROR, {}, str(e)
     except KeyboardInterrupt:
-        print("\n\n👋 Programa interrumpido")
-        sys.exit(0)
-    except Exception as e:
-        print(f"\n❌ Error inesperado: {e}")
-        sys.exit(1)
\ No newline at end of file
+        code, result, error = EXIT_CANCELLED, {}, "interrumpido"
+        if args.command in ("save", "restore", "replace"):
+            error += (f" (repetir el comando retoma la copia; 'journal rollback "
+                      f"{args.command}' la deshace)")
+    
+    if args.json:
+        payload = {"ok": code == EXIT_OK, "command": args.command, **result}
+        if error:
+            payload["error"] = error
+        print(json.dumps(payload, indent=1, ensure_ascii=False, default=str))
+    elif error:
+        print(f"❌ {error}", file=sys.stderr)
+    write_trace(manager.tracer)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file